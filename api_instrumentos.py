@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+API JSON de sólo lectura sobre el inventario, para pantallas de consulta y
+scripts que no necesitan levantar la app de Streamlit.
+
+    python api_instrumentos.py --host 127.0.0.1 --puerto 8765
+
+Rutas (todas GET):
+    /api/instrumentos          ?busqueda= &grupo= &investigador= &instrumento=
+                               &orden= &desc= &tamano= &despues_de=
+    /api/instrumentos/<id>
+    /api/reservas              ?instrumento_id= &orden= &desc= &tamano= &despues_de=
+                               &archivadas=
+    /api/reservas/<id>         (busca también en el archivo)
+    /api/disponibilidad        ?desde= &hasta= &instrumentos=1,2,3 &paso=3600
+
+Las listas se paginan por keyset: la respuesta trae "siguiente", que se pasa
+tal cual en despues_de para pedir la página que sigue.
+
+Cada respuesta lleva un ETag derivado de la versión de los datos. Si el
+cliente lo devuelve en If-None-Match y nada cambió, se responde 304 sin
+tocar la base, así consultar seguido cuesta casi nada.
+"""
+import argparse
+import json
+import logging
+import re
+import uuid
+from datetime import datetime, date, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, Callable
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from datos_instrumentos import (
+    ORDEN_INSTRUMENTOS,
+    ORDEN_RESERVAS,
+    cargar_instrumentos,
+    cargar_instrumentos_pagina,
+    cargar_reservas_pagina,
+    cargar_reservas_ventana,
+    init_db,
+    obtener_instrumento_por_id,
+    obtener_reserva_por_id,
+    ocupacion_por_franja,
+    version_datos,
+)
+
+logger = logging.getLogger(__name__)
+
+API_HOST = "127.0.0.1"
+API_PUERTO = 8765
+API_MAX_TAMANO_PAGINA = 500
+API_MAX_FRANJAS = 5000
+# Columnas internas que no tienen sentido fuera del servidor
+API_COLUMNAS_OCULTAS = ["foto_path"]
+
+# Distingue los ETag de cada arranque: la versión de los datos se cuenta
+# desde cero en cada proceso.
+_ARRANQUE = uuid.uuid4().hex[:8]
+
+
+class NoEncontrado(Exception):
+    pass
+
+
+def etag_actual() -> str:
+    return f'"{_ARRANQUE}-{version_datos()}"'
+
+
+def _etags_pedidos(cabecera: Optional[str]) -> set[str]:
+    if not cabecera:
+        return set()
+    return {e.strip().removeprefix("W/") for e in cabecera.split(",")}
+
+
+def _json_default(valor: Any) -> Any:
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f"{type(valor).__name__} no es serializable")
+
+
+def _registros(df: pd.DataFrame) -> list[Dict[str, Any]]:
+    df = df.drop(columns=API_COLUMNAS_OCULTAS, errors="ignore")
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+# ---------- Parámetros ----------
+def _entero(params: Dict[str, str], nombre: str, defecto: Optional[int] = None) -> Optional[int]:
+    valor = params.get(nombre)
+    if valor in (None, ""):
+        return defecto
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValueError(f"'{nombre}' debe ser un número entero") from None
+
+
+def _booleano(params: Dict[str, str], nombre: str, defecto: bool) -> bool:
+    valor = params.get(nombre)
+    if valor in (None, ""):
+        return defecto
+    return valor.lower() in ("1", "true", "si", "sí")
+
+
+def _fecha(params: Dict[str, str], nombre: str, defecto: datetime) -> datetime:
+    valor = params.get(nombre)
+    if valor in (None, ""):
+        return defecto
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"'{nombre}' debe ser una fecha ISO 8601 (AAAA-MM-DD o AAAA-MM-DDTHH:MM)") from None
+
+
+def _cursor(params: Dict[str, str]) -> Optional[tuple[Any, int]]:
+    valor = params.get("despues_de")
+    if valor in (None, ""):
+        return None
+    try:
+        orden, ultimo_id = json.loads(valor)
+        return orden, int(ultimo_id)
+    except (ValueError, TypeError):
+        raise ValueError("'despues_de' debe ser el valor de 'siguiente' de la página anterior") from None
+
+
+def _tamano(params: Dict[str, str]) -> int:
+    tamano = _entero(params, "tamano", 50)
+    if not 1 <= tamano <= API_MAX_TAMANO_PAGINA:
+        raise ValueError(f"'tamano' debe estar entre 1 y {API_MAX_TAMANO_PAGINA}")
+    return tamano
+
+
+def _orden(params: Dict[str, str], opciones: Dict[str, str], defecto: str) -> str:
+    orden = params.get("orden") or defecto
+    if orden not in opciones and orden != "relevancia":
+        raise ValueError(f"'orden' debe ser uno de: {', '.join(opciones)}")
+    return orden
+
+
+# ---------- Rutas ----------
+def listar_instrumentos(params: Dict[str, str]) -> Dict[str, Any]:
+    busqueda = params.get("busqueda", "")
+    df, total, siguiente = cargar_instrumentos_pagina(
+        params.get("grupo", ""),
+        params.get("investigador", ""),
+        params.get("instrumento", ""),
+        busqueda,
+        orden=_orden(params, ORDEN_INSTRUMENTOS, "relevancia" if busqueda else "id"),
+        descendente=_booleano(params, "desc", False),
+        tamano_pagina=_tamano(params),
+        despues_de=_cursor(params),
+    )
+    return {"total": total, "datos": _registros(df), "siguiente": siguiente}
+
+
+def ver_instrumento(params: Dict[str, str], instrumento_id: str) -> Dict[str, Any]:
+    inst = obtener_instrumento_por_id(int(instrumento_id))
+    if inst is None:
+        raise NoEncontrado(f"No existe el instrumento {instrumento_id}")
+    for columna in API_COLUMNAS_OCULTAS:
+        inst.pop(columna, None)
+    return inst
+
+
+def listar_reservas(params: Dict[str, str]) -> Dict[str, Any]:
+    df, total, siguiente = cargar_reservas_pagina(
+        instrumento_id=_entero(params, "instrumento_id"),
+        orden=_orden(params, ORDEN_RESERVAS, "fecha_inicio"),
+        descendente=_booleano(params, "desc", True),
+        tamano_pagina=_tamano(params),
+        despues_de=_cursor(params),
+        archivadas=_booleano(params, "archivadas", False),
+    )
+    return {"total": total, "datos": _registros(df), "siguiente": siguiente}
+
+
+def ver_reserva(params: Dict[str, str], reserva_id: str) -> Dict[str, Any]:
+    reserva = obtener_reserva_por_id(int(reserva_id))
+    if reserva is None:
+        reserva = obtener_reserva_por_id(int(reserva_id), archivadas=True)
+    if reserva is None:
+        raise NoEncontrado(f"No existe la reserva {reserva_id}")
+    return reserva
+
+
+def disponibilidad(params: Dict[str, str]) -> Dict[str, Any]:
+    hoy = datetime.combine(date.today(), datetime.min.time())
+    desde = _fecha(params, "desde", hoy)
+    hasta = _fecha(params, "hasta", desde + timedelta(days=7))
+    paso = timedelta(seconds=_entero(params, "paso", 3600))
+    if hasta <= desde:
+        raise ValueError("'hasta' debe ser posterior a 'desde'")
+    if paso.total_seconds() < 60 or (hasta - desde) / paso > API_MAX_FRANJAS:
+        raise ValueError(f"'paso' debe ser de al menos 60 segundos y dar como máximo {API_MAX_FRANJAS} franjas")
+
+    instrumentos = cargar_instrumentos()[["id", "instrumento"]]
+    if params.get("instrumentos"):
+        try:
+            pedidos = [int(i) for i in params["instrumentos"].split(",")]
+        except ValueError:
+            raise ValueError("'instrumentos' debe ser una lista de ids separados por comas") from None
+        instrumentos = instrumentos[instrumentos["id"].isin(pedidos)]
+    ids = instrumentos["id"].astype(int).tolist()
+
+    reservas = cargar_reservas_ventana(desde, hasta, ids)
+    inicios, ocupacion = ocupacion_por_franja(reservas, ids, desde, hasta, paso)
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "paso_segundos": int(paso.total_seconds()),
+        "franjas": pd.DatetimeIndex(inicios).to_pydatetime().tolist(),
+        "instrumentos": [
+            {"id": iid, "instrumento": nombre, "ocupacion": fila.tolist()}
+            for iid, nombre, fila in zip(ids, instrumentos["instrumento"], ocupacion)
+        ],
+        "reservas": _registros(reservas),
+    }
+
+
+RUTAS: list[tuple[re.Pattern, Callable[..., Dict[str, Any]]]] = [
+    (re.compile(r"/api/instrumentos"), listar_instrumentos),
+    (re.compile(r"/api/instrumentos/(\d+)"), ver_instrumento),
+    (re.compile(r"/api/reservas"), listar_reservas),
+    (re.compile(r"/api/reservas/(\d+)"), ver_reserva),
+    (re.compile(r"/api/disponibilidad"), disponibilidad),
+]
+
+
+# ---------- Servidor ----------
+class ManejadorApi(BaseHTTPRequestHandler):
+    server_version = "InstrumentosAPI/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        ruta = url.path.rstrip("/")
+        vista, argumentos = next(
+            ((v, m.groups()) for patron, v in RUTAS if (m := patron.fullmatch(ruta))),
+            (None, ()),
+        )
+        if vista is None:
+            self._responder(HTTPStatus.NOT_FOUND, {"error": f"Ruta desconocida: {ruta}"})
+            return
+
+        # La versión se lee antes de consultar: si los datos cambian en el
+        # medio, el próximo pedido verá otro ETag y volverá a descargar.
+        etag = etag_actual()
+        if etag in _etags_pedidos(self.headers.get("If-None-Match")):
+            self._responder(HTTPStatus.NOT_MODIFIED, None, etag)
+            return
+
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            cuerpo = vista(params, *argumentos)
+        except NoEncontrado as e:
+            self._responder(HTTPStatus.NOT_FOUND, {"error": str(e)})
+        except ValueError as e:
+            self._responder(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except Exception:
+            logger.exception("Error atendiendo %s", self.path)
+            self._responder(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Error interno"})
+        else:
+            self._responder(HTTPStatus.OK, cuerpo, etag)
+
+    def _responder(self, estado: HTTPStatus, cuerpo: Optional[Dict[str, Any]], etag: Optional[str] = None):
+        datos = b""
+        if cuerpo is not None:
+            datos = json.dumps(cuerpo, default=_json_default, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        if etag:
+            self.send_header("ETag", etag)
+            # El cliente puede guardar la respuesta pero debe revalidarla siempre
+            self.send_header("Cache-Control", "no-cache")
+        if cuerpo is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, formato: str, *args):
+        logger.info("%s - %s", self.address_string(), formato % args)
+
+
+def crear_servidor(host: str = API_HOST, puerto: int = API_PUERTO) -> ThreadingHTTPServer:
+    init_db()
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorApi)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API JSON de sólo lectura del inventario de instrumentos")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--puerto", type=int, default=API_PUERTO)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    servidor = crear_servidor(args.host, args.puerto)
+    logger.info("API escuchando en http://%s:%d/api/", args.host, args.puerto)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
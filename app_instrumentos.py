@@ -4,15 +4,88 @@ Created on Tue Dec 30 12:18:15 2025
 
 @author: Malavert
 """
+import math
 import os
-import re
-import sqlite3
-from datetime import datetime, date, time
+from functools import partial
+from datetime import datetime, date, time, timedelta
 from pathlib import Path
 from typing import Optional, Dict, Any
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+from datos_instrumentos import (
+    ARCHIVO_ANTIGUEDAD_DIAS,
+    CAMPOS_IMPORTACION_INSTRUMENTOS,
+    CONSULTA_LENTA_MS,
+    CAMPOS_IMPORTACION_RESERVAS,
+    ESTADOS_INSTRUMENTO,
+    ESTADOS_RESERVA,
+    FRECUENCIAS_SERIE,
+    IMPORTACION_FILAS_VISTA_PREVIA,
+    OPCIONES_RESERVA_USO,
+    CopiaEnCurso,
+    CursorPagina,
+    ReservaSolapada,
+    activar_perfil,
+    actualizar_instrumento,
+    actualizar_reserva,
+    actualizar_serie,
+    archivar_reservas,
+    autocompletar_instrumentos,
+    borrar_instrumento,
+    borrar_reserva,
+    borrar_reservas_de_instrumento,
+    cancelar_serie,
+    cargar_instrumentos,
+    cargar_instrumentos_pagina,
+    cargar_reservas_pagina,
+    cargar_reservas_ventana,
+    cargar_uso,
+    contar_archivables,
+    crear_copia,
+    contar_reservas_de_instrumento,
+    eliminar_foto_si_huerfana,
+    exportar_instrumentos,
+    exportar_reservas,
+    formatos_disponibles,
+    foto_en_proceso,
+    guardar_imagen,
+    importar_instrumentos,
+    importar_reservas,
+    iniciar_corrida,
+    init_db,
+    insertar_instrumento,
+    insertar_reserva,
+    insertar_serie_reservas,
+    leer_planilla,
+    mapeo_sugerido,
+    metricas_escritor,
+    mime_exportacion,
+    nombre_exportacion,
+    obtener_cache_miniaturas,
+    obtener_indice_autocompletar,
+    obtener_instrumento_por_id,
+    obtener_perfil,
+    obtener_programador_copias,
+    obtener_reserva_por_id,
+    obtener_serie,
+    ocupacion_por_franja,
+    optimizar_fotos_existentes,
+    recalcular_estadisticas_uso,
+    reconstruir_indice_busqueda,
+    resumen_copias,
+    terminar_corrida,
+    version_datos,
+)
+
+# Con el perfilado activo, mide toda la ejecución del script (ver el panel de
+# diagnóstico al final)
+iniciar_corrida()
 
 # ==============================
 # Configuración general
@@ -49,11 +122,6 @@ button[data-baseweb="tab"] {
 # Carpeta base
 BASE_DIR = Path(__file__).resolve().parent
 
-# Base de datos y fotos
-DB_PATH = BASE_DIR / "instrumentos.db"
-IMAGES_DIR = BASE_DIR / "instrument_photos"
-IMAGES_DIR.mkdir(exist_ok=True)
-
 # ==============================
 # Encabezado con 2 logos
 # ==============================
@@ -64,7 +132,7 @@ col_left, col_center, col_right = st.columns([2.2, 6, 2.2])
 
 with col_left:
     if LOGO_LEFT.exists():
-        st.image(str(LOGO_LEFT), use_container_width=True)
+        st.image(str(LOGO_LEFT), width="stretch")
 
 with col_center:
     st.title("Inventario de Instrumentos - Cultivos Industriales - FAUBA")
@@ -80,365 +148,901 @@ with col_center:
 
 with col_right:
     if LOGO_RIGHT.exists():
-        st.image(str(LOGO_RIGHT), use_container_width=True)
+        st.image(str(LOGO_RIGHT), width="stretch")
 
 # ==============================
-# Compatibilidad rerun
+# Reruns
 # ==============================
-def do_rerun():
-    if hasattr(st, "rerun"):
-        st.rerun()
-    else:
-        st.experimental_rerun()
+def do_rerun(alcance: str = "app"):
+    """Vuelve a ejecutar el script; con alcance="fragment", sólo el fragmento actual.
+
+    Un rerun acotado sólo vale cuando el fragmento corre por su cuenta; si corre
+    dentro de una ejecución completa de la app, se hace un rerun completo.
+    """
+    if alcance == "fragment":
+        try:
+            st.rerun(scope="fragment")
+        except StreamlitAPIException:
+            pass
+    st.rerun()
+
+# ==============================
+# Inicializar DB
+# ==============================
+init_db()
+# Copias de seguridad en segundo plano (INSTRUMENTOS_COPIAS_HORAS=0 las apaga)
+obtener_programador_copias().iniciar()
+obtener_indice_autocompletar().precargar()
 
 # ==============================
-# Funciones de base de datos
+# Contexto de datos de la ejecución
 # ==============================
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def _filas_por_id(df: pd.DataFrame) -> Dict[int, Dict[str, Any]]:
+    # Los faltantes quedan como None, igual que al leer una fila con sqlite3.Row
+    registros = df.astype(object).where(df.notna(), None).to_dict("records")
+    return {int(r["id"]): r for r in registros}
+
+
+class ContextoDatos:
+    """Lecturas compartidas por todos los widgets de una ejecución del script.
+
+    Cada conjunto de datos se lee a lo sumo una vez y las búsquedas por id se
+    resuelven con las filas ya cargadas. Si otra escritura cambia la versión de
+    los datos a mitad de la ejecución, lo memorizado se descarta.
+    """
+
+    def __init__(self):
+        self._version = version_datos()
+        self._instrumentos: Optional[pd.DataFrame] = None
+        self._etiquetas: Optional[Dict[str, int]] = None
+        self._filas_instrumentos: Dict[int, Optional[Dict[str, Any]]] = {}
+        self._filas_reservas: Dict[int, Optional[Dict[str, Any]]] = {}
+        self._conteo_reservas: Dict[int, int] = {}
+
+    def _vigente(self):
+        version = version_datos()
+        if version != self._version:
+            self.__init__()
+
+    def instrumentos(self) -> pd.DataFrame:
+        self._vigente()
+        if self._instrumentos is None:
+            self._instrumentos = cargar_instrumentos()
+            self._filas_instrumentos.update(_filas_por_id(self._instrumentos))
+        return self._instrumentos
+
+    def etiquetas_instrumentos(self) -> Dict[str, int]:
+        """Etiqueta legible -> id, en el orden de cargar_instrumentos()."""
+        df = self.instrumentos()
+        if self._etiquetas is None:
+            ids = df["id"].astype(int)
+            etiquetas = (
+                "[ID " + ids.astype(str) + "] "
+                + df["instrumento"].fillna("") + " – "
+                + df["investigador_grupo"].fillna("")
+            )
+            self._etiquetas = dict(zip(etiquetas.tolist(), ids.tolist()))
+        return self._etiquetas
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS instrumentos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            grupo_unidad TEXT,
-            responsable TEXT,
-            investigador_grupo TEXT NOT NULL,
-            instrumento TEXT NOT NULL,
-            numero_inventario TEXT,
-            reserva_uso TEXT,
-            estado TEXT,
-            ubicacion TEXT,
-            descripcion TEXT,
-            foto_path TEXT,
-            fecha_registro TEXT
+    def registrar_instrumentos(self, df: pd.DataFrame):
+        """Indexa filas ya leídas (p. ej. una página) para no volver a pedirlas."""
+        self._vigente()
+        self._filas_instrumentos.update(_filas_por_id(df))
+
+    def registrar_reservas(self, df: pd.DataFrame):
+        self._vigente()
+        self._filas_reservas.update(_filas_por_id(df))
+
+    def instrumento(self, instrumento_id: int) -> Optional[Dict[str, Any]]:
+        self._vigente()
+        if instrumento_id not in self._filas_instrumentos:
+            self._filas_instrumentos[instrumento_id] = obtener_instrumento_por_id(instrumento_id)
+        return self._filas_instrumentos[instrumento_id]
+
+    def reserva(self, reserva_id: int) -> Optional[Dict[str, Any]]:
+        self._vigente()
+        if reserva_id not in self._filas_reservas:
+            self._filas_reservas[reserva_id] = obtener_reserva_por_id(reserva_id)
+        return self._filas_reservas[reserva_id]
+
+    def cantidad_reservas(self, instrumento_id: int) -> int:
+        self._vigente()
+        if instrumento_id not in self._conteo_reservas:
+            self._conteo_reservas[instrumento_id] = contar_reservas_de_instrumento(instrumento_id)
+        return self._conteo_reservas[instrumento_id]
+
+
+# Streamlit ejecuta el script completo en cada interacción: una instancia por ejecución
+datos = ContextoDatos()
+
+# ==============================
+# UI: paginación
+# ==============================
+TAMANOS_PAGINA = [25, 50, 100, 250]
+
+ETIQUETAS_ORDEN_INSTRUMENTOS = {
+    "relevancia": "Relevancia",
+    "id": "ID",
+    "instrumento": "Instrumento",
+    "investigador_grupo": "Investigador / Grupo",
+    "grupo_unidad": "Grupo / Unidad",
+    "estado": "Estado",
+    "fecha_registro": "Fecha de registro",
+}
+
+ETIQUETAS_ORDEN_RESERVAS = {
+    "fecha_inicio": "Fecha inicio",
+    "fecha_fin": "Fecha fin",
+    "usuario": "Usuario",
+    "estado": "Estado",
+    "instrumento": "Instrumento",
+    "id": "ID",
+}
+
+
+def cursor_pagina(clave: str, firma: tuple) -> Optional[CursorPagina]:
+    # La pila guarda el cursor de inicio de cada página visitada, para poder
+    # volver atrás. Si cambian filtros u orden (la firma) se vuelve a la primera.
+    estado = st.session_state.get(clave)
+    if estado is None or estado["firma"] != firma:
+        estado = {"firma": firma, "cursores": [None]}
+        st.session_state[clave] = estado
+    return estado["cursores"][-1]
+
+
+def reiniciar_paginacion(clave: str):
+    st.session_state.pop(clave, None)
+
+
+def _pagina_siguiente(clave: str, cursor: CursorPagina):
+    st.session_state[clave]["cursores"].append(cursor)
+
+
+def _pagina_anterior(clave: str):
+    st.session_state[clave]["cursores"].pop()
+
+
+def controles_pagina(clave: str, total: int, tamano_pagina: int, siguiente: Optional[CursorPagina]):
+    n_pagina = len(st.session_state[clave]["cursores"])
+    n_paginas = max(1, math.ceil(total / tamano_pagina))
+
+    c_prev, c_info, c_next = st.columns([1, 4, 1])
+    with c_prev:
+        st.button(
+            "◀ Anterior",
+            key=f"{clave}_prev",
+            disabled=n_pagina == 1,
+            on_click=_pagina_anterior,
+            args=(clave,),
+        )
+    with c_info:
+        st.caption(f"Página {n_pagina} de {n_paginas} · {total} registros")
+    with c_next:
+        st.button(
+            "Siguiente ▶",
+            key=f"{clave}_next",
+            disabled=siguiente is None,
+            on_click=_pagina_siguiente,
+            args=(clave, siguiente),
         )
-        """
-    )
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS reservas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            instrumento_id INTEGER NOT NULL,
-            usuario TEXT NOT NULL,
-            fecha_inicio TEXT NOT NULL,
-            fecha_fin TEXT NOT NULL,
-            comentario TEXT,
-            estado TEXT,
-            fecha_registro TEXT,
-            FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+
+# ==============================
+# UI: galería
+# ==============================
+# Páginas chicas: abrir la galería nunca decodifica más de una página de fotos
+TAMANOS_PAGINA_GALERIA = [12, 24, 48]
+GALERIA_COLUMNAS = 4
+
+
+def mostrar_galeria(df: pd.DataFrame):
+    miniaturas = obtener_cache_miniaturas()
+    for inicio in range(0, len(df), GALERIA_COLUMNAS):
+        fila = df.iloc[inicio:inicio + GALERIA_COLUMNAS]
+        for col, inst in zip(st.columns(GALERIA_COLUMNAS), fila.itertuples()):
+            with col:
+                miniatura = miniaturas.obtener(inst.foto_path)
+                if miniatura:
+                    st.image(miniatura, width="stretch")
+                elif foto_en_proceso(inst.foto_path):
+                    st.caption("⏳ Procesando foto")
+                else:
+                    st.caption("Sin foto")
+                st.markdown(f"**[ID {inst.id}] {inst.instrumento}**")
+                st.caption(f"{inst.investigador_grupo} · {inst.estado or ''}")
+
+
+# ==============================
+# UI: línea de tiempo de reservas
+# ==============================
+PASOS_LINEA_TIEMPO = {
+    "1 hora": timedelta(hours=1),
+    "3 horas": timedelta(hours=3),
+    "1 día": timedelta(days=1),
+}
+COLORES_ESTADO_RESERVA = {"Confirmada": "#2e7d32", "Tentativa": "#f9a825", "Cancelada": "#9e9e9e"}
+
+
+def mostrar_linea_de_tiempo(
+    etiquetas: Dict[int, str],
+    instrumento_ids: list[int],
+    desde: datetime,
+    hasta: datetime,
+    paso: timedelta,
+):
+    df = cargar_reservas_ventana(desde, hasta, instrumento_ids)
+
+    if df.empty:
+        st.info("No hay reservas en la ventana elegida: los instrumentos están libres.")
+    else:
+        df_plot = df.assign(etiqueta=df["instrumento_id"].map(etiquetas))
+        fig = px.timeline(
+            df_plot,
+            x_start="fecha_inicio",
+            x_end="fecha_fin",
+            y="etiqueta",
+            color="estado",
+            color_discrete_map=COLORES_ESTADO_RESERVA,
+            hover_data={"id": True, "usuario": True, "etiqueta": False},
+        )
+        fig.update_xaxes(range=[desde, hasta])
+        fig.update_yaxes(autorange="reversed", title=None)
+        fig.update_layout(
+            height=max(250, 30 * df_plot["etiqueta"].nunique() + 120),
+            legend_title_text="Estado",
+            margin=dict(l=10, r=10, t=30, b=10),
+        )
+        st.plotly_chart(fig, width="stretch")
+
+    inicios, ocupacion = ocupacion_por_franja(df, instrumento_ids, desde, hasta, paso)
+    st.caption(
+        f"Ocupación por franja (verde: libre · azul: reservado · rojo: más de una reserva). "
+        f"Franjas libres: {(ocupacion == 0).mean():.0%}"
+    )
+    fig_ocup = go.Figure(
+        go.Heatmap(
+            z=np.minimum(ocupacion, 2),
+            x=inicios,
+            y=[etiquetas.get(i, str(i)) for i in instrumento_ids],
+            customdata=ocupacion,
+            zmin=0,
+            zmax=2,
+            colorscale=[[0.0, "#e8f5e9"], [0.5, "#1e88e5"], [1.0, "#d32f2f"]],
+            showscale=False,
+            hovertemplate="%{y}<br>%{x}<br>Reservas: %{customdata}<extra></extra>",
         )
-        """
     )
+    fig_ocup.update_yaxes(autorange="reversed")
+    fig_ocup.update_layout(
+        height=max(200, 24 * len(instrumento_ids) + 100),
+        margin=dict(l=10, r=10, t=10, b=10),
+    )
+    st.plotly_chart(fig_ocup, width="stretch")
 
-    conn.commit()
-    conn.close()
-
-
-def guardar_imagen(uploaded_file) -> Optional[str]:
-    if uploaded_file is None:
-        return None
-    suffix = Path(uploaded_file.name).suffix.lower()
-    if suffix not in [".png", ".jpg", ".jpeg", ".tif", ".tiff"]:
-        suffix = ".png"
-    file_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{suffix}"
-    file_path = IMAGES_DIR / file_name
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return str(file_path)
-
-
-# ---------- Instrumentos ----------
-def insertar_instrumento(
-    grupo_unidad: str,
-    responsable: str,
-    investigador_grupo: str,
-    instrumento: str,
-    numero_inventario: str,
-    reserva_uso: str,
-    estado: str,
-    ubicacion: str,
-    descripcion: str,
-    foto_path: Optional[str],
-):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO instrumentos
-        (grupo_unidad, responsable, investigador_grupo, instrumento,
-         numero_inventario, reserva_uso, estado, ubicacion,
-         descripcion, foto_path, fecha_registro)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            grupo_unidad,
-            responsable,
-            investigador_grupo,
-            instrumento,
-            numero_inventario,
-            reserva_uso,
-            estado,
-            ubicacion,
-            descripcion,
-            foto_path,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        ),
+
+# ==============================
+# UI: estadísticas de uso
+# ==============================
+ETIQUETAS_DIMENSION_USO = {
+    "instrumento": "Instrumento",
+    "grupo_unidad": "Grupo / Unidad",
+    "usuario": "Usuario",
+}
+USO_MAX_SERIES = 10
+
+
+def mostrar_estadisticas_uso(df: pd.DataFrame, dimension: str):
+    etiqueta_dim = ETIQUETAS_DIMENSION_USO[dimension]
+    totales = df.groupby("dimension")["horas"].sum().sort_values(ascending=False)
+
+    c_h, c_r, c_d = st.columns(3)
+    c_h.metric("Horas reservadas", f"{totales.sum():,.1f}")
+    c_r.metric("Reservas-día", f"{int(df['reservas'].sum()):,}")
+    c_d.metric(f"{etiqueta_dim} con uso", len(totales))
+
+    # Para que el gráfico sea legible, fuera de los más usados se agrupa en "Otros".
+    principales = set(totales.index[:USO_MAX_SERIES])
+    df_serie = (
+        df.assign(dimension=df["dimension"].where(df["dimension"].isin(principales), "Otros"))
+        .groupby(["periodo", "dimension"], as_index=False)["horas"]
+        .sum()
     )
-    conn.commit()
-    conn.close()
-
-
-def cargar_instrumentos(
-    filtro_grupo: str = "",
-    filtro_investigador: str = "",
-    filtro_instrumento: str = "",
-) -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    query = "SELECT * FROM instrumentos WHERE 1=1"
-    params: list[str] = []
-
-    if filtro_grupo:
-        query += " AND grupo_unidad LIKE ?"
-        params.append(f"%{filtro_grupo}%")
-    if filtro_investigador:
-        query += " AND investigador_grupo LIKE ?"
-        params.append(f"%{filtro_investigador}%")
-    if filtro_instrumento:
-        query += " AND instrumento LIKE ?"
-        params.append(f"%{filtro_instrumento}%")
-
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
-
-
-def obtener_instrumento_por_id(instrumento_id: int) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM instrumentos WHERE id = ?", (instrumento_id,))
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
-
-
-def actualizar_instrumento(
-    instrumento_id: int,
-    grupo_unidad: str,
-    responsable: str,
-    investigador_grupo: str,
-    instrumento: str,
-    numero_inventario: str,
-    reserva_uso: str,
-    estado: str,
-    ubicacion: str,
-    descripcion: str,
-    foto_path: Optional[str],
-):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE instrumentos
-        SET grupo_unidad = ?,
-            responsable = ?,
-            investigador_grupo = ?,
-            instrumento = ?,
-            numero_inventario = ?,
-            reserva_uso = ?,
-            estado = ?,
-            ubicacion = ?,
-            descripcion = ?,
-            foto_path = ?
-        WHERE id = ?
-        """,
-        (
-            grupo_unidad,
-            responsable,
-            investigador_grupo,
-            instrumento,
-            numero_inventario,
-            reserva_uso,
-            estado,
-            ubicacion,
-            descripcion,
-            foto_path,
-            instrumento_id,
-        ),
+    fig = px.bar(
+        df_serie,
+        x="periodo",
+        y="horas",
+        color="dimension",
+        labels={"periodo": "Período", "horas": "Horas", "dimension": etiqueta_dim},
+    )
+    fig.update_layout(barmode="stack", margin=dict(l=10, r=10, t=30, b=10))
+    st.plotly_chart(fig, width="stretch")
+
+    df_top = df[df["dimension"].isin(principales)].groupby(["dimension", "estado"], as_index=False)["horas"].sum()
+    fig_top = px.bar(
+        df_top,
+        x="horas",
+        y="dimension",
+        color="estado",
+        orientation="h",
+        color_discrete_map=COLORES_ESTADO_RESERVA,
+        category_orders={"dimension": list(totales.index[:USO_MAX_SERIES])},
+        labels={"horas": "Horas", "dimension": etiqueta_dim, "estado": "Estado"},
     )
-    conn.commit()
-    conn.close()
+    fig_top.update_layout(
+        height=max(250, 30 * len(principales) + 120),
+        margin=dict(l=10, r=10, t=30, b=10),
+    )
+    st.plotly_chart(fig_top, width="stretch")
+
+    resumen = (
+        df.pivot_table(index="dimension", columns="estado", values="horas", aggfunc="sum", fill_value=0)
+        .assign(Total=lambda t: t.sum(axis=1))
+        .sort_values("Total", ascending=False)
+        .round(1)
+        .rename_axis(etiqueta_dim)
+        .reset_index()
+    )
+    st.dataframe(resumen, width="stretch", hide_index=True)
+
+
+# ==============================
+# UI: avisos entre reruns
+# ==============================
+# Los avisos se guardan en session_state para que sobrevivan al rerun que
+# sigue a una escritura; cada uno se muestra una sola vez en su área.
+def avisar(area: str, tipo: str, texto: str):
+    st.session_state.setdefault("avisos", {}).setdefault(area, []).append((tipo, texto))
+
+
+def mostrar_avisos(area: str):
+    for tipo, texto in st.session_state.get("avisos", {}).pop(area, []):
+        getattr(st, tipo)(texto)
+
+
+def texto_solapes(solapes: list[Dict[str, Any]]) -> str:
+    return "; ".join(f"[ID {x['id']}] {x['usuario']} ({x['estado']})" for x in solapes)
+
+
+# ==============================
+# Barra lateral: mantenimiento
+# ==============================
+# El panel es un fragmento y, como las pestañas, sólo se ejecuta abierto: el
+# conteo de reservas archivables y el resumen de copias no se calculan en
+# cada rerun. Las acciones que cambian datos vuelven a ejecutar la app entera
+# para que las pestañas reflejen el cambio.
+def _terminar_mantenimiento(texto: str):
+    avisar("mantenimiento", "success", texto)
+    st.rerun()
+
+
+@st.fragment(key="panel_mantenimiento")
+def panel_mantenimiento():
+    panel = st.expander("🛠️ Mantenimiento", key="expander_mantenimiento", on_change="rerun")
+    if not panel.open:
+        return
+    with panel:
+        mostrar_avisos("mantenimiento")
+        if st.button("Reconstruir índice de búsqueda", key="btn_rebuild_fts"):
+            reconstruir_indice_busqueda()
+            _terminar_mantenimiento("Índice de búsqueda reconstruido.")
+
+        if st.button("Optimizar fotos existentes", key="btn_optimizar_fotos"):
+            with st.spinner("Recomprimiendo fotos..."):
+                resumen = optimizar_fotos_existentes()
+            _terminar_mantenimiento(
+                f"Fotos convertidas: {resumen['convertidas']} · "
+                f"duplicadas: {resumen['duplicadas']} · errores: {resumen['errores']}"
+            )
 
+        if st.button("Recalcular estadísticas de uso", key="btn_recalcular_uso"):
+            with st.spinner("Recalculando estadísticas..."):
+                recalcular_estadisticas_uso()
+            _terminar_mantenimiento("Estadísticas de uso recalculadas.")
+
+        st.markdown("**Archivar reservas**")
+        corte_archivo = datetime.combine(
+            st.date_input(
+                "Terminadas antes del",
+                value=date.today() - timedelta(days=ARCHIVO_ANTIGUEDAD_DIAS),
+                max_value=date.today(),
+                key="archivo_corte",
+            ),
+            time(0, 0),
+        )
+        canceladas_archivo = st.checkbox("Incluir las canceladas", value=True, key="archivo_canceladas")
+        if st.button("Archivar reservas", key="btn_archivar"):
+            with st.spinner("Archivando reservas..."):
+                n_archivadas = archivar_reservas(corte_archivo, canceladas_archivo)
+            _terminar_mantenimiento(f"Reservas archivadas: {n_archivadas}.")
+        st.caption(
+            f"{contar_archivables(corte_archivo, canceladas_archivo)} reserva(s) para archivar. "
+            "Se pueden consultar luego en la pestaña de reservas y siguen contando en las estadísticas."
+        )
 
-def contar_reservas_de_instrumento(instrumento_id: int) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM reservas WHERE instrumento_id = ?", (instrumento_id,))
-    n = cur.fetchone()[0]
-    conn.close()
-    return int(n)
+        st.markdown("**Copias de seguridad**")
+        if st.button("Hacer una copia ahora", key="btn_copia"):
+            try:
+                with st.spinner("Copiando base y fotos..."):
+                    copia = crear_copia()
+                st.success(f"Copia {copia['nombre']} creada ({copia['fotos_copiadas']} fotos nuevas).")
+            except CopiaEnCurso as e:
+                st.warning(str(e))
+        n_copias, ultima_copia = resumen_copias()
+        if ultima_copia is not None:
+            st.caption(
+                f"Última copia: {ultima_copia:%d/%m/%Y %H:%M} · {n_copias} guardadas. "
+                "Para restaurar: python copias_instrumentos.py restaurar <nombre>"
+            )
+        else:
+            st.caption("Todavía no hay copias de seguridad.")
+        if obtener_programador_copias().ultimo_error:
+            st.error(f"Falló la última copia programada: {obtener_programador_copias().ultimo_error}")
 
 
-def borrar_reservas_de_instrumento(instrumento_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM reservas WHERE instrumento_id = ?", (instrumento_id,))
-    conn.commit()
-    conn.close()
+with st.sidebar:
+    panel_mantenimiento()
 
+    # Se completa al final del script, cuando ya se conoce el tiempo total
+    panel_diagnostico = st.container()
+
+# ==============================
+# UI: editar / borrar instrumento
+# ==============================
+# Cada panel es un fragmento: sus widgets sólo vuelven a ejecutar el panel.
+# Las escrituras corren en callbacks que, si salen bien, vuelven a ejecutar
+# el fragmento de la pestaña para que la tabla refleje el cambio.
+FRAGMENTO_INVENTARIO = "pestana_inventario"
+FRAGMENTO_RESERVAS = "pestana_reservas"
+
+CAMPOS_EDICION_INSTRUMENTO = [
+    "grupo_unidad",
+    "responsable",
+    "investigador_grupo",
+    "instrumento",
+    "numero_inventario",
+    "reserva_uso",
+    "estado",
+    "ubicacion",
+    "descripcion",
+]
+
+
+def _clave_edicion(campo: str, instrumento_id: int) -> str:
+    return f"ei_{campo}_{instrumento_id}"
+
+
+def _guardar_instrumento_editado(instrumento_id: int):
+    valores = {c: st.session_state[_clave_edicion(c, instrumento_id)] for c in CAMPOS_EDICION_INSTRUMENTO}
+    if not valores["investigador_grupo"] or not valores["instrumento"]:
+        avisar("editar_instrumento", "error", "Complete al menos 'Investigador / Grupo' e 'Instrumento'.")
+        return
 
-def borrar_instrumento(instrumento_id: int):
     inst = obtener_instrumento_por_id(instrumento_id)
-    foto_path = inst.get("foto_path") if inst else None
+    foto_path_anterior = inst.get("foto_path") if inst else None
+    nueva_foto = st.session_state.get(f"foto_edit_{instrumento_id}")
+    foto_path_final = guardar_imagen(nueva_foto) if nueva_foto is not None else foto_path_anterior
+
+    actualizar_instrumento(instrumento_id=instrumento_id, foto_path=foto_path_final, **valores)
+    if foto_path_anterior != foto_path_final:
+        eliminar_foto_si_huerfana(foto_path_anterior)
+    avisar("inventario", "success", "Instrumento actualizado.")
+    st.rerun(FRAGMENTO_INVENTARIO)
+
+
+@st.fragment
+def panel_editar_instrumento(instrumento_id: int):
+    inst_actual = datos.instrumento(instrumento_id)
+    if inst_actual is None:
+        st.warning("No se encontró el instrumento seleccionado.")
+        return
+
+    def clave(campo: str) -> str:
+        return _clave_edicion(campo, instrumento_id)
+
+    with st.form("form_editar_instrumento"):
+        c1, c2 = st.columns(2)
+
+        with c1:
+            st.text_input("Grupo / Unidad", value=inst_actual.get("grupo_unidad") or "", key=clave("grupo_unidad"))
+            st.text_input("Responsable", value=inst_actual.get("responsable") or "", key=clave("responsable"))
+            st.text_input("Investigador / Grupo *", value=inst_actual.get("investigador_grupo") or "", key=clave("investigador_grupo"))
+            st.text_input("Instrumento *", value=inst_actual.get("instrumento") or "", key=clave("instrumento"))
+            st.text_input("Número de inventario", value=inst_actual.get("numero_inventario") or "", key=clave("numero_inventario"))
+
+        with c2:
+            st.text_input("Ubicación", value=inst_actual.get("ubicacion") or "", key=clave("ubicacion"))
+            st.selectbox(
+                "Reserva de uso",
+                OPCIONES_RESERVA_USO,
+                index=OPCIONES_RESERVA_USO.index(inst_actual.get("reserva_uso") or "Con reserva"),
+                key=clave("reserva_uso"),
+            )
+            st.selectbox(
+                "Estado del instrumento",
+                ESTADOS_INSTRUMENTO,
+                index=ESTADOS_INSTRUMENTO.index(inst_actual.get("estado") or "Operativo"),
+                key=clave("estado"),
+            )
+            st.text_area("Descripción / Observaciones", value=inst_actual.get("descripcion") or "", key=clave("descripcion"))
+            st.file_uploader("Reemplazar foto (opcional)", type=["png", "jpg", "jpeg"], key=f"foto_edit_{instrumento_id}")
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM instrumentos WHERE id = ?", (instrumento_id,))
-    conn.commit()
-    conn.close()
+        st.form_submit_button("Guardar cambios", on_click=_guardar_instrumento_editado, args=(instrumento_id,))
 
-    if foto_path and os.path.exists(foto_path):
-        try:
-            os.remove(foto_path)
-        except OSError:
-            pass
+    mostrar_avisos("editar_instrumento")
 
 
-# ---------- Reservas ----------
-def insertar_reserva(
-    instrumento_id: int,
-    usuario: str,
-    fecha_inicio: datetime,
-    fecha_fin: datetime,
-    comentario: str,
-    estado: str = "Confirmada",
-):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO reservas
-        (instrumento_id, usuario, fecha_inicio, fecha_fin,
-         comentario, estado, fecha_registro)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            instrumento_id,
-            usuario,
-            fecha_inicio.strftime("%Y-%m-%d %H:%M:%S"),
-            fecha_fin.strftime("%Y-%m-%d %H:%M:%S"),
-            comentario,
-            estado,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        ),
-    )
-    conn.commit()
-    conn.close()
-
-
-def cargar_reservas(instrumento_id: Optional[int] = None) -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    if instrumento_id is None:
-        query = """
-        SELECT r.id, r.instrumento_id, i.instrumento,
-               r.usuario, r.fecha_inicio, r.fecha_fin,
-               r.estado, r.comentario
-        FROM reservas r
-        JOIN instrumentos i ON r.instrumento_id = i.id
-        ORDER BY r.fecha_inicio DESC
-        """
-        params: list[Any] = []
-    else:
-        query = """
-        SELECT r.id, r.instrumento_id, i.instrumento,
-               r.usuario, r.fecha_inicio, r.fecha_fin,
-               r.estado, r.comentario
-        FROM reservas r
-        JOIN instrumentos i ON r.instrumento_id = i.id
-        WHERE r.instrumento_id = ?
-        ORDER BY r.fecha_inicio DESC
-        """
-        params = [instrumento_id]
-
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
-
-
-def obtener_reserva_por_id(reserva_id: int) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM reservas WHERE id = ?", (reserva_id,))
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
-
-
-def actualizar_reserva(
-    reserva_id: int,
-    instrumento_id: int,
-    usuario: str,
-    fecha_inicio: datetime,
-    fecha_fin: datetime,
-    comentario: str,
-    estado: str,
-):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE reservas
-        SET instrumento_id = ?,
-            usuario = ?,
-            fecha_inicio = ?,
-            fecha_fin = ?,
-            comentario = ?,
-            estado = ?
-        WHERE id = ?
-        """,
-        (
-            instrumento_id,
-            usuario,
-            fecha_inicio.strftime("%Y-%m-%d %H:%M:%S"),
-            fecha_fin.strftime("%Y-%m-%d %H:%M:%S"),
-            comentario,
-            estado,
-            reserva_id,
-        ),
-    )
-    conn.commit()
-    conn.close()
+def _borrar_instrumento_confirmado(instrumento_id: int):
+    if st.session_state.get(f"confirm_del_{instrumento_id}", "").strip().upper() != "BORRAR":
+        avisar("borrar_instrumento", "error", "Confirmación incorrecta. Escribí BORRAR.")
+        return
+
+    borrar_con_reservas = st.session_state.get(f"del_cascade_{instrumento_id}", False)
+    n_res = contar_reservas_de_instrumento(instrumento_id)
+    if n_res > 0 and not borrar_con_reservas:
+        avisar("borrar_instrumento", "error", "Este instrumento tiene reservas. Marcá la opción para borrarlas o cancelá.")
+        return
+
+    if borrar_con_reservas and n_res > 0:
+        borrar_reservas_de_instrumento(instrumento_id)
+    borrar_instrumento(instrumento_id)
+    avisar("inventario", "success", "Instrumento eliminado.")
+    st.rerun(FRAGMENTO_INVENTARIO)
+
 
+@st.fragment
+def panel_borrar_instrumento(instrumento_id: int):
+    n_res = datos.cantidad_reservas(instrumento_id)
+    st.write(f"Reservas asociadas a este instrumento: **{n_res}**")
 
-def borrar_reserva(reserva_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM reservas WHERE id = ?", (reserva_id,))
-    conn.commit()
-    conn.close()
+    st.checkbox(
+        "Borrar también todas las reservas asociadas",
+        value=False,
+        key=f"del_cascade_{instrumento_id}",
+    )
+    st.text_input("Escribí BORRAR para confirmar", key=f"confirm_del_{instrumento_id}")
+    st.button(
+        "Eliminar definitivamente",
+        key=f"btn_del_{instrumento_id}",
+        on_click=_borrar_instrumento_confirmado,
+        args=(instrumento_id,),
+    )
+    mostrar_avisos("borrar_instrumento")
 
 
 # ==============================
-# Inicializar DB
+# UI: editar / borrar reserva
 # ==============================
-init_db()
+def _guardar_reserva_editada(reserva_id: int):
+    ss = st.session_state
+    usuario = ss[f"res_usuario_{reserva_id}"]
+    if not usuario:
+        avisar("editar_reserva", "error", "Complete 'Usuario solicitante'.")
+        return
+
+    dt_ini = datetime.combine(ss[f"ri_d_{reserva_id}"], ss[f"ri_t_{reserva_id}"])
+    dt_fin = datetime.combine(ss[f"rf_d_{reserva_id}"], ss[f"rf_t_{reserva_id}"])
+    if dt_fin <= dt_ini:
+        avisar("editar_reserva", "error", "La fecha/hora de fin debe ser posterior al inicio.")
+        return
+
+    try:
+        solapes = actualizar_reserva(
+            reserva_id=reserva_id,
+            instrumento_id=datos.etiquetas_instrumentos()[ss[f"res_inst_{reserva_id}"]],
+            usuario=usuario,
+            fecha_inicio=dt_ini,
+            fecha_fin=dt_fin,
+            comentario=ss[f"res_coment_{reserva_id}"],
+            estado=ss[f"res_estado_{reserva_id}"],
+            permitir_tentativas=ss[f"res_tent_{reserva_id}"],
+        )
+    except ReservaSolapada as e:
+        avisar("editar_reserva", "error", f"No se guardaron los cambios. {e}")
+        return
+
+    if solapes:
+        avisar("reservas", "warning", "Reserva actualizada, pero se solapa con: " + texto_solapes(solapes))
+    else:
+        avisar("reservas", "success", "Reserva actualizada.")
+    st.rerun(FRAGMENTO_RESERVAS)
+
+
+@st.fragment
+def panel_editar_reserva(reserva_id: int):
+    res_actual = datos.reserva(reserva_id)
+    if res_actual is None:
+        st.warning("No se encontró la reserva seleccionada.")
+        return
+
+    with st.form("form_editar_reserva"):
+        mapa_inst = datos.etiquetas_instrumentos()
+        etiquetas = list(mapa_inst.keys())
+
+        inst_actual_id = int(res_actual.get("instrumento_id"))
+        default_label = next((lab for lab, iid in mapa_inst.items() if iid == inst_actual_id), etiquetas[0])
+        idx_default = etiquetas.index(default_label) if default_label in etiquetas else 0
+
+        st.selectbox("Instrumento", etiquetas, index=idx_default, key=f"res_inst_{reserva_id}")
+        st.text_input("Usuario solicitante *", value=res_actual.get("usuario") or "", key=f"res_usuario_{reserva_id}")
+
+        dt_ini = res_actual["fecha_inicio"]
+        dt_fin = res_actual["fecha_fin"]
+
+        cfi, cff = st.columns(2)
+        with cfi:
+            st.date_input("Fecha inicio", value=dt_ini.date(), key=f"ri_d_{reserva_id}")
+            st.time_input("Hora inicio", value=dt_ini.time(), key=f"ri_t_{reserva_id}")
+        with cff:
+            st.date_input("Fecha fin", value=dt_fin.date(), key=f"rf_d_{reserva_id}")
+            st.time_input("Hora fin", value=dt_fin.time(), key=f"rf_t_{reserva_id}")
+
+        st.selectbox(
+            "Estado de la reserva",
+            ESTADOS_RESERVA,
+            index=ESTADOS_RESERVA.index(res_actual.get("estado") or "Confirmada"),
+            key=f"res_estado_{reserva_id}",
+        )
+        st.text_area("Comentario", value=res_actual.get("comentario") or "", key=f"res_coment_{reserva_id}")
+        st.checkbox(
+            "Permitir solapamiento con reservas tentativas",
+            value=True,
+            key=f"res_tent_{reserva_id}",
+        )
+
+        st.form_submit_button("Guardar cambios", on_click=_guardar_reserva_editada, args=(reserva_id,))
+
+    mostrar_avisos("editar_reserva")
+
+
+def _borrar_reserva_confirmada(reserva_id: int):
+    if st.session_state.get(f"confirm_del_res_{reserva_id}", "").strip().upper() != "BORRAR":
+        avisar("borrar_reserva", "error", "Confirmación incorrecta. Escribí BORRAR.")
+        return
+    borrar_reserva(reserva_id)
+    avisar("reservas", "success", "Reserva eliminada.")
+    st.rerun(FRAGMENTO_RESERVAS)
+
+
+@st.fragment
+def panel_borrar_reserva(reserva_id: int):
+    st.text_input("Escribí BORRAR para confirmar", key=f"confirm_del_res_{reserva_id}")
+    st.button(
+        "Eliminar reserva",
+        key=f"btn_del_res_{reserva_id}",
+        on_click=_borrar_reserva_confirmada,
+        args=(reserva_id,),
+    )
+    mostrar_avisos("borrar_reserva")
+
 
 # ==============================
-# UI: pestañas
+# UI: reservas recurrentes
 # ==============================
-tab1, tab2, tab3 = st.tabs(
-    ["➕ Cargar instrumento", "📋 Ver base de datos", "📅 Reservas de uso"]
-)
+ETIQUETAS_FRECUENCIA = {"diaria": "Diaria (cada N días)", "semanal": "Semanal (cada N semanas)"}
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+def leer_excepciones(texto: str) -> list[date]:
+    """Fechas AAAA-MM-DD separadas por comas."""
+    try:
+        return [date.fromisoformat(t.strip()) for t in texto.split(",") if t.strip()]
+    except ValueError:
+        raise ValueError("Las excepciones deben ser fechas AAAA-MM-DD separadas por comas.") from None
+
+
+def texto_serie(serie: Dict[str, Any]) -> str:
+    unidad = "día(s)" if serie["frecuencia"] == "diaria" else "semana(s)"
+    texto = f"Cada {serie['intervalo']} {unidad}"
+    if serie["frecuencia"] == "semanal" and serie["dias_semana"]:
+        texto += " los " + ", ".join(DIAS_SEMANA[d].lower() for d in serie["dias_semana"])
+    texto += (
+        f", {serie['fecha_inicio']:%H:%M}–{serie['fecha_fin']:%H:%M},"
+        f" del {serie['fecha_inicio']:%d/%m/%Y} al {serie['hasta']:%d/%m/%Y}"
+    )
+    if serie["excepciones"]:
+        texto += " salvo " + ", ".join(f"{d:%d/%m}" for d in serie["excepciones"])
+    return texto
+
+
+def _guardar_serie_editada(serie_id: int):
+    ss = st.session_state
+
+    def valor(campo: str) -> Any:
+        return ss[f"se_{campo}_{serie_id}"]
+
+    serie = obtener_serie(serie_id)
+    if serie is None:
+        avisar("editar_serie", "error", "La serie ya no existe.")
+        return
+    if not valor("usuario"):
+        avisar("editar_serie", "error", "Complete 'Usuario solicitante'.")
+        return
+
+    try:
+        n, solapes = actualizar_serie(
+            serie_id=serie_id,
+            instrumento_id=int(serie["instrumento_id"]),
+            usuario=valor("usuario"),
+            fecha_inicio=datetime.combine(valor("dia"), valor("hora_ini")),
+            fecha_fin=datetime.combine(valor("dia"), valor("hora_fin")),
+            frecuencia=valor("frecuencia"),
+            hasta=valor("hasta"),
+            intervalo=int(valor("intervalo")),
+            dias_semana=[DIAS_SEMANA.index(d) for d in valor("dias")],
+            excepciones=leer_excepciones(valor("excepciones")),
+            comentario=valor("comentario"),
+            estado=valor("estado"),
+            permitir_tentativas=valor("tentativas"),
+            desde=datetime.now() if valor("conservar") else None,
+        )
+    except (ReservaSolapada, ValueError) as e:
+        avisar("editar_serie", "error", f"No se guardaron los cambios. {e}")
+        return
+
+    texto = f"Serie actualizada: {n} ocurrencia(s) generadas."
+    if solapes:
+        avisar("reservas", "warning", f"{texto} Se solapan con: " + texto_solapes(solapes))
+    else:
+        avisar("reservas", "success", texto)
+    st.rerun(FRAGMENTO_RESERVAS)
+
+
+def _cancelar_serie_confirmada(serie_id: int):
+    todas = st.session_state.get(f"sc_todas_{serie_id}", False)
+    n = cancelar_serie(serie_id, desde=None if todas else datetime.now())
+    avisar("reservas", "success", f"Serie cancelada: {n} reserva(s) pasaron a 'Cancelada'.")
+    st.rerun(FRAGMENTO_RESERVAS)
+
+
+@st.fragment
+def panel_serie(serie_id: int):
+    serie = obtener_serie(serie_id)
+    if serie is None:
+        st.warning("No se encontró la serie de esta reserva.")
+        return
+
+    st.caption(
+        f"Serie {serie_id} · {texto_serie(serie)} · {serie['ocurrencias']} reserva(s) · "
+        f"estado: {serie['estado'] or 'Confirmada'}"
+    )
+
+    def clave(campo: str) -> str:
+        return f"se_{campo}_{serie_id}"
+
+    with st.form("form_editar_serie"):
+        st.text_input("Usuario solicitante *", value=serie["usuario"] or "", key=clave("usuario"))
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            st.date_input("Primer día", value=serie["fecha_inicio"].date(), key=clave("dia"))
+        with c2:
+            st.time_input("Hora inicio", value=serie["fecha_inicio"].time(), key=clave("hora_ini"))
+        with c3:
+            st.time_input("Hora fin", value=serie["fecha_fin"].time(), key=clave("hora_fin"))
+
+        c4, c5, c6 = st.columns(3)
+        with c4:
+            st.selectbox(
+                "Frecuencia",
+                FRECUENCIAS_SERIE,
+                index=FRECUENCIAS_SERIE.index(serie["frecuencia"]),
+                format_func=ETIQUETAS_FRECUENCIA.get,
+                key=clave("frecuencia"),
+            )
+        with c5:
+            st.number_input("Cada", min_value=1, max_value=52, value=int(serie["intervalo"]), key=clave("intervalo"))
+        with c6:
+            st.date_input("Hasta", value=serie["hasta"], key=clave("hasta"))
+
+        st.multiselect(
+            "Días (sólo semanal)",
+            DIAS_SEMANA,
+            default=[DIAS_SEMANA[d] for d in serie["dias_semana"]],
+            key=clave("dias"),
+        )
+        st.text_input(
+            "Excepciones (AAAA-MM-DD, separadas por comas)",
+            value=", ".join(d.isoformat() for d in serie["excepciones"]),
+            key=clave("excepciones"),
+        )
+        st.selectbox(
+            "Estado de las reservas",
+            ESTADOS_RESERVA,
+            index=ESTADOS_RESERVA.index(serie["estado"] or "Confirmada"),
+            key=clave("estado"),
+        )
+        st.text_area("Comentario", value=serie["comentario"] or "", key=clave("comentario"))
+        st.checkbox("Permitir solapamiento con reservas tentativas", value=True, key=clave("tentativas"))
+        st.checkbox(
+            "Conservar las ocurrencias que ya empezaron",
+            value=True,
+            key=clave("conservar"),
+            help="Las ocurrencias que se reemplazan se generan de nuevo desde la regla: "
+                 "se pierden los cambios hechos a mano en cada una.",
+        )
+        st.form_submit_button("Guardar cambios en toda la serie", on_click=_guardar_serie_editada, args=(serie_id,))
+
+    mostrar_avisos("editar_serie")
+
+    st.markdown("---")
+    st.checkbox("Cancelar también las ocurrencias pasadas", value=False, key=f"sc_todas_{serie_id}")
+    st.button(
+        "Cancelar la serie",
+        key=f"btn_cancelar_serie_{serie_id}",
+        on_click=_cancelar_serie_confirmada,
+        args=(serie_id,),
+    )
+
+
+def formulario_serie(instrumento_id: int):
+    with st.form("form_serie", clear_on_submit=True):
+        usuario = st.text_input("Usuario solicitante *")
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            primer_dia = st.date_input("Primer día", value=date.today())
+        with c2:
+            hora_ini = st.time_input("Hora inicio", value=time(9, 0))
+        with c3:
+            hora_fin = st.time_input("Hora fin", value=time(12, 0))
+
+        c4, c5, c6 = st.columns(3)
+        with c4:
+            frecuencia = st.selectbox("Frecuencia", FRECUENCIAS_SERIE, index=1, format_func=ETIQUETAS_FRECUENCIA.get)
+        with c5:
+            intervalo = st.number_input("Cada", min_value=1, max_value=52, value=1)
+        with c6:
+            hasta = st.date_input("Hasta", value=date.today() + timedelta(weeks=16))
+
+        dias = st.multiselect(
+            "Días (sólo semanal)",
+            DIAS_SEMANA,
+            help="Si se deja vacío, se repite el mismo día de la semana que el primer día.",
+        )
+        excepciones_txt = st.text_input(
+            "Excepciones (AAAA-MM-DD, separadas por comas)",
+            help="Días que se saltean, por ejemplo feriados.",
+        )
+        comentario = st.text_area("Comentario", key="serie_comentario")
+        estado = st.selectbox("Estado de las reservas", ESTADOS_RESERVA, index=0)
+        permitir_tent = st.checkbox("Permitir solapamiento con reservas tentativas", value=True)
+
+        if st.form_submit_button("Registrar serie"):
+            if not usuario:
+                st.error("Por favor complete el campo 'Usuario solicitante'.")
+                return
+            try:
+                serie_id, n, solapes = insertar_serie_reservas(
+                    instrumento_id=instrumento_id,
+                    usuario=usuario,
+                    fecha_inicio=datetime.combine(primer_dia, hora_ini),
+                    fecha_fin=datetime.combine(primer_dia, hora_fin),
+                    frecuencia=frecuencia,
+                    hasta=hasta,
+                    intervalo=int(intervalo),
+                    dias_semana=[DIAS_SEMANA.index(d) for d in dias],
+                    excepciones=leer_excepciones(excepciones_txt),
+                    comentario=comentario,
+                    estado=estado,
+                    permitir_tentativas=permitir_tent,
+                )
+            except (ReservaSolapada, ValueError) as e:
+                st.error(f"No se registró la serie. {e}")
+                return
+
+            texto = f"Serie {serie_id} registrada: {n} reserva(s)."
+            if solapes:
+                avisar("reservas", "warning", f"{texto} Se solapan con: " + texto_solapes(solapes))
+            else:
+                avisar("reservas", "success", texto)
+            do_rerun("fragment")
+
 
 # ------------------------------
 # TAB 1: Cargar instrumento
 # ------------------------------
-with tab1:
+@st.fragment(key="pestana_carga")
+def pestana_cargar_instrumento():
     st.subheader("Nuevo instrumento")
+    mostrar_avisos("carga")
 
     with st.form("form_instrumento", clear_on_submit=True):
         col1, col2 = st.columns(2)
@@ -452,8 +1056,8 @@ with tab1:
 
         with col2:
             ubicacion = st.text_input("Ubicación")
-            reserva_uso = st.selectbox("Reserva de uso", ["Libre", "Con reserva", "Uso restringido"], index=1)
-            estado = st.selectbox("Estado del instrumento", ["Operativo", "En reparación", "Fuera de servicio", "De baja"], index=0)
+            reserva_uso = st.selectbox("Reserva de uso", OPCIONES_RESERVA_USO, index=1)
+            estado = st.selectbox("Estado del instrumento", ESTADOS_INSTRUMENTO, index=0)
             descripcion = st.text_area("Descripción / Observaciones")
             foto = st.file_uploader("Foto del instrumento", type=["png", "jpg", "jpeg"])
 
@@ -476,14 +1080,21 @@ with tab1:
                     descripcion=descripcion,
                     foto_path=foto_path,
                 )
-                st.success("Instrumento guardado correctamente.")
-                do_rerun()
+                avisar("carga", "success", "Instrumento guardado correctamente.")
+                do_rerun("fragment")
 
 # ------------------------------
 # TAB 2: Ver / Editar / Borrar instrumentos
 # ------------------------------
-with tab2:
+@st.fragment(key=FRAGMENTO_INVENTARIO)
+def pestana_inventario():
     st.subheader("Base de datos de instrumentos")
+    mostrar_avisos("inventario")
+
+    busqueda = st.text_input(
+        "🔎 Buscar en todo el inventario",
+        placeholder="Instrumento, investigador, grupo, ubicación, descripción o N° de inventario",
+    )
 
     colf1, colf2, colf3 = st.columns(3)
     with colf1:
@@ -493,22 +1104,68 @@ with tab2:
     with colf3:
         filtro_inst = st.text_input("Filtrar por Instrumento")
 
-    df_inst = cargar_instrumentos(filtro_grupo, filtro_inv, filtro_inst)
+    vista_inst = st.radio("Vista", ["Tabla", "Galería"], horizontal=True, key="inst_vista")
+
+    opciones_orden = [o for o in ETIQUETAS_ORDEN_INSTRUMENTOS if o != "relevancia" or busqueda]
+    colo1, colo2, colo3 = st.columns([2, 1, 1])
+    with colo1:
+        orden_inst = st.selectbox(
+            "Ordenar por",
+            opciones_orden,
+            format_func=ETIQUETAS_ORDEN_INSTRUMENTOS.get,
+            key="inst_orden",
+        )
+    with colo2:
+        desc_inst = st.checkbox("Descendente", value=False, key="inst_desc")
+    with colo3:
+        if vista_inst == "Galería":
+            tam_inst = st.selectbox("Fichas por página", TAMANOS_PAGINA_GALERIA, index=0, key="inst_tam_gal")
+        else:
+            tam_inst = st.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key="inst_tam")
+
+    firma_inst = (filtro_grupo, filtro_inv, filtro_inst, busqueda, orden_inst, desc_inst, tam_inst, vista_inst)
+    cursor_inst = cursor_pagina("pag_inst", firma_inst)
+    df_inst, total_inst, siguiente_inst = cargar_instrumentos_pagina(
+        filtro_grupo,
+        filtro_inv,
+        filtro_inst,
+        busqueda,
+        orden=orden_inst,
+        descendente=desc_inst,
+        tamano_pagina=tam_inst,
+        despues_de=cursor_inst,
+    )
+
+    datos.registrar_instrumentos(df_inst)
+
+    if df_inst.empty and cursor_inst is not None:
+        # La página guardada quedó vacía (p. ej. se borraron sus filas)
+        reiniciar_paginacion("pag_inst")
+        do_rerun("fragment")
 
     if df_inst.empty:
         st.info("Todavía no hay instrumentos cargados que coincidan con el filtro.")
     else:
-        st.markdown("#### Tabla de instrumentos")
-        df_tabla = df_inst.drop(columns=["foto_path"], errors="ignore")
-        st.dataframe(df_tabla, use_container_width=True)
-
-        csv = df_tabla.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="⬇️ Descargar inventario en CSV",
-            data=csv,
-            file_name="inventario_instrumentos.csv",
-            mime="text/csv",
-        )
+        if vista_inst == "Galería":
+            st.markdown("#### Galería de instrumentos")
+            mostrar_galeria(df_inst)
+        else:
+            st.markdown("#### Tabla de instrumentos")
+            df_tabla = df_inst.drop(columns=["foto_path"], errors="ignore")
+            st.dataframe(df_tabla, width="stretch")
+        controles_pagina("pag_inst", total_inst, tam_inst, siguiente_inst)
+
+        # Exporta todo el inventario filtrado, no sólo la página visible
+        cold1, cold2 = st.columns([1, 3])
+        with cold1:
+            formato_inst = st.selectbox("Formato", formatos_disponibles(), key="inst_export_formato")
+        with cold2:
+            st.download_button(
+                label=f"⬇️ Descargar inventario ({formato_inst})",
+                data=partial(exportar_instrumentos, formato_inst, filtro_grupo, filtro_inv, filtro_inst, busqueda),
+                file_name=nombre_exportacion("inventario_instrumentos", formato_inst),
+                mime=mime_exportacion(formato_inst),
+            )
 
         st.markdown("---")
         st.markdown("### Detalle de un instrumento")
@@ -533,114 +1190,49 @@ with tab2:
 
         with col_b:
             foto_path = inst_row.get("foto_path", None)
-            if foto_path and os.path.exists(foto_path):
+            if isinstance(foto_path, str) and os.path.exists(foto_path):
                 st.image(foto_path, caption="Foto del instrumento")
+            elif foto_en_proceso(foto_path):
+                st.caption("⏳ Procesando la foto, aparecerá en unos segundos.")
             else:
                 st.caption("Sin foto disponible para este instrumento.")
 
         st.markdown("---")
         st.markdown("## Editar / Borrar instrumento")
 
-        inst_actual = obtener_instrumento_por_id(int(id_sel))
-        if inst_actual is None:
-            st.warning("No se encontró el instrumento seleccionado.")
-        else:
-            with st.expander("✏️ Editar instrumento", expanded=False):
-                with st.form("form_editar_instrumento"):
-                    c1, c2 = st.columns(2)
-
-                    with c1:
-                        e_grupo_unidad = st.text_input("Grupo / Unidad", value=inst_actual.get("grupo_unidad") or "")
-                        e_responsable = st.text_input("Responsable", value=inst_actual.get("responsable") or "")
-                        e_investigador_grupo = st.text_input("Investigador / Grupo *", value=inst_actual.get("investigador_grupo") or "")
-                        e_instrumento = st.text_input("Instrumento *", value=inst_actual.get("instrumento") or "")
-                        e_numero_inventario = st.text_input("Número de inventario", value=inst_actual.get("numero_inventario") or "")
-
-                    with c2:
-                        e_ubicacion = st.text_input("Ubicación", value=inst_actual.get("ubicacion") or "")
-                        e_reserva_uso = st.selectbox(
-                            "Reserva de uso",
-                            ["Libre", "Con reserva", "Uso restringido"],
-                            index=["Libre", "Con reserva", "Uso restringido"].index(inst_actual.get("reserva_uso") or "Con reserva"),
-                        )
-                        e_estado = st.selectbox(
-                            "Estado del instrumento",
-                            ["Operativo", "En reparación", "Fuera de servicio", "De baja"],
-                            index=["Operativo", "En reparación", "Fuera de servicio", "De baja"].index(inst_actual.get("estado") or "Operativo"),
-                        )
-                        e_descripcion = st.text_area("Descripción / Observaciones", value=inst_actual.get("descripcion") or "")
-                        nueva_foto = st.file_uploader("Reemplazar foto (opcional)", type=["png", "jpg", "jpeg"], key=f"foto_edit_{id_sel}")
-
-                    guardar_cambios = st.form_submit_button("Guardar cambios")
+        with st.expander("✏️ Editar instrumento", expanded=False):
+            panel_editar_instrumento(int(id_sel))
 
-                    if guardar_cambios:
-                        if not e_investigador_grupo or not e_instrumento:
-                            st.error("Complete al menos 'Investigador / Grupo' e 'Instrumento'.")
-                        else:
-                            foto_path_final = inst_actual.get("foto_path")
-                            if nueva_foto is not None:
-                                if foto_path_final and os.path.exists(foto_path_final):
-                                    try:
-                                        os.remove(foto_path_final)
-                                    except OSError:
-                                        pass
-                                foto_path_final = guardar_imagen(nueva_foto)
-
-                            actualizar_instrumento(
-                                instrumento_id=int(id_sel),
-                                grupo_unidad=e_grupo_unidad,
-                                responsable=e_responsable,
-                                investigador_grupo=e_investigador_grupo,
-                                instrumento=e_instrumento,
-                                numero_inventario=e_numero_inventario,
-                                reserva_uso=e_reserva_uso,
-                                estado=e_estado,
-                                ubicacion=e_ubicacion,
-                                descripcion=e_descripcion,
-                                foto_path=foto_path_final,
-                            )
-                            st.success("Instrumento actualizado.")
-                            do_rerun()
+        with st.expander("🗑️ Borrar instrumento", expanded=False):
+            panel_borrar_instrumento(int(id_sel))
 
-            with st.expander("🗑️ Borrar instrumento", expanded=False):
-                n_res = contar_reservas_de_instrumento(int(id_sel))
-                st.write(f"Reservas asociadas a este instrumento: **{n_res}**")
-
-                borrar_con_reservas = st.checkbox(
-                    "Borrar también todas las reservas asociadas",
-                    value=False,
-                    key=f"del_cascade_{id_sel}",
-                )
-                confirmar = st.text_input("Escribí BORRAR para confirmar", key=f"confirm_del_{id_sel}")
-
-                if st.button("Eliminar definitivamente", key=f"btn_del_{id_sel}"):
-                    if confirmar.strip().upper() != "BORRAR":
-                        st.error("Confirmación incorrecta. Escribí BORRAR.")
-                    else:
-                        if n_res > 0 and not borrar_con_reservas:
-                            st.error("Este instrumento tiene reservas. Marcá la opción para borrarlas o cancelá.")
-                        else:
-                            if borrar_con_reservas and n_res > 0:
-                                borrar_reservas_de_instrumento(int(id_sel))
-                            borrar_instrumento(int(id_sel))
-                            st.success("Instrumento eliminado.")
-                            do_rerun()
 
 # ------------------------------
 # TAB 3: Reservas + editar/borrar reservas
 # ------------------------------
-with tab3:
+@st.fragment(key=FRAGMENTO_RESERVAS)
+def pestana_reservas():
     st.subheader("Reservas de uso de instrumentos")
+    mostrar_avisos("reservas")
 
-    df_all_inst = cargar_instrumentos()
-    if df_all_inst.empty:
+    if datos.instrumentos().empty:
         st.info("Primero cargue al menos un instrumento en la pestaña anterior.")
     else:
-        opciones = {
-            f"[ID {row.id}] {row.instrumento} – {row.investigador_grupo}": int(row.id)
-            for _, row in df_all_inst.iterrows()
-        }
-        etiqueta_seleccion = st.selectbox("Seleccionar instrumento para reservar", list(opciones.keys()), key="inst_reserve_select")
+        opciones = datos.etiquetas_instrumentos()
+        busqueda_inst = st.text_input(
+            "Buscar instrumento",
+            key="inst_reserve_buscar",
+            placeholder="Nombre, n° de inventario o grupo (tolera errores de tipeo)",
+        )
+        candidatas = list(opciones.keys())
+        if busqueda_inst.strip():
+            por_id = {iid: etiqueta for etiqueta, iid in opciones.items()}
+            coincidencias = [por_id[iid] for iid in autocompletar_instrumentos(busqueda_inst) if iid in por_id]
+            if coincidencias:
+                candidatas = coincidencias
+            else:
+                st.caption("Sin coincidencias: se listan todos los instrumentos.")
+        etiqueta_seleccion = st.selectbox("Seleccionar instrumento para reservar", candidatas, key="inst_reserve_select")
         instrumento_id = opciones[etiqueta_seleccion]
 
         st.markdown("#### Nueva reserva")
@@ -656,7 +1248,12 @@ with tab3:
                 hora_fin_t = st.time_input("Hora fin", value=time(12, 0))
 
             comentario_res = st.text_area("Comentario")
-            estado_res = st.selectbox("Estado de la reserva", ["Confirmada", "Tentativa", "Cancelada"], index=0)
+            estado_res = st.selectbox("Estado de la reserva", ESTADOS_RESERVA, index=0)
+            permitir_tent_res = st.checkbox(
+                "Permitir solapamiento con reservas tentativas",
+                value=True,
+                help="Si se desmarca, cualquier reserva no cancelada en el mismo horario bloquea el registro.",
+            )
 
             submitted_reserva = st.form_submit_button("Registrar reserva")
 
@@ -670,39 +1267,127 @@ with tab3:
                     if fecha_fin_dt <= fecha_inicio_dt:
                         st.error("La fecha/hora de fin debe ser posterior al inicio.")
                     else:
-                        insertar_reserva(
-                            instrumento_id=instrumento_id,
-                            usuario=usuario_res,
-                            fecha_inicio=fecha_inicio_dt,
-                            fecha_fin=fecha_fin_dt,
-                            comentario=comentario_res,
-                            estado=estado_res,
-                        )
-                        st.success("Reserva registrada correctamente.")
-                        do_rerun()
+                        try:
+                            solapes = insertar_reserva(
+                                instrumento_id=instrumento_id,
+                                usuario=usuario_res,
+                                fecha_inicio=fecha_inicio_dt,
+                                fecha_fin=fecha_fin_dt,
+                                comentario=comentario_res,
+                                estado=estado_res,
+                                permitir_tentativas=permitir_tent_res,
+                            )
+                        except ReservaSolapada as e:
+                            st.error(f"No se registró la reserva. {e}")
+                        else:
+                            if solapes:
+                                avisar("reservas", "warning", "Reserva registrada, pero se solapa con: " + texto_solapes(solapes))
+                            else:
+                                avisar("reservas", "success", "Reserva registrada correctamente.")
+                            do_rerun("fragment")
+
+        with st.expander("🔁 Nueva reserva recurrente", expanded=False):
+            formulario_serie(instrumento_id)
+
+        st.markdown("---")
+        with st.expander("🗓️ Línea de tiempo de disponibilidad", expanded=False):
+            todos_lt = st.checkbox("Todos los instrumentos", value=False, key="lt_todos")
+            if todos_lt:
+                ids_lt = list(opciones.values())
+            else:
+                seleccion_lt = st.multiselect(
+                    "Instrumentos", list(opciones.keys()), default=[etiqueta_seleccion], key="lt_inst"
+                )
+                ids_lt = [opciones[e] for e in seleccion_lt]
+
+            col_lt1, col_lt2 = st.columns([2, 1])
+            with col_lt1:
+                rango_lt = st.date_input(
+                    "Ventana de fechas",
+                    value=(date.today(), date.today() + timedelta(days=30)),
+                    key="lt_rango",
+                )
+            with col_lt2:
+                paso_lt = st.selectbox("Tamaño de franja", list(PASOS_LINEA_TIEMPO), index=1, key="lt_paso")
+
+            if not ids_lt:
+                st.info("Seleccione al menos un instrumento.")
+            elif isinstance(rango_lt, tuple) and len(rango_lt) == 2:
+                mostrar_linea_de_tiempo(
+                    {iid: etiqueta for etiqueta, iid in opciones.items()},
+                    ids_lt,
+                    datetime.combine(rango_lt[0], time(0, 0)),
+                    datetime.combine(rango_lt[1], time(0, 0)) + timedelta(days=1),
+                    PASOS_LINEA_TIEMPO[paso_lt],
+                )
 
         st.markdown("---")
         st.markdown("#### Reservas registradas")
 
-        ver_todas = st.checkbox("Ver reservas de todos los instrumentos", value=False)
+        colv1, colv2 = st.columns(2)
+        with colv1:
+            ver_todas = st.checkbox("Ver reservas de todos los instrumentos", value=False)
+        with colv2:
+            ver_archivadas = st.checkbox(
+                "Ver reservas archivadas",
+                value=False,
+                key="res_archivadas",
+                help="Reservas viejas o canceladas movidas al archivo desde Mantenimiento. Son de sólo lectura.",
+            )
+        filtro_res_id = None if ver_todas else instrumento_id
+
+        colr1, colr2, colr3 = st.columns([2, 1, 1])
+        with colr1:
+            orden_res = st.selectbox(
+                "Ordenar por",
+                list(ETIQUETAS_ORDEN_RESERVAS),
+                format_func=ETIQUETAS_ORDEN_RESERVAS.get,
+                key="res_orden",
+            )
+        with colr2:
+            desc_res = st.checkbox("Descendente", value=True, key="res_desc")
+        with colr3:
+            tam_res = st.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key="res_tam")
+
+        cursor_res = cursor_pagina("pag_res", (filtro_res_id, orden_res, desc_res, tam_res, ver_archivadas))
+        df_res, total_res, siguiente_res = cargar_reservas_pagina(
+            instrumento_id=filtro_res_id,
+            orden=orden_res,
+            descendente=desc_res,
+            tamano_pagina=tam_res,
+            despues_de=cursor_res,
+            archivadas=ver_archivadas,
+        )
+
+        if not ver_archivadas:
+            datos.registrar_reservas(df_res)
 
-        if ver_todas:
-            df_res = cargar_reservas(instrumento_id=None)
-        else:
-            df_res = cargar_reservas(instrumento_id=instrumento_id)
+        if df_res.empty and cursor_res is not None:
+            reiniciar_paginacion("pag_res")
+            do_rerun("fragment")
 
         if df_res.empty:
-            st.info("No hay reservas registradas.")
+            st.info("No hay reservas archivadas." if ver_archivadas else "No hay reservas registradas.")
         else:
-            st.dataframe(df_res, use_container_width=True)
+            st.dataframe(df_res, width="stretch")
+            controles_pagina("pag_res", total_res, tam_res, siguiente_res)
+
+            colde1, colde2 = st.columns([1, 3])
+            with colde1:
+                formato_res = st.selectbox("Formato", formatos_disponibles(), key="res_export_formato")
+            with colde2:
+                st.download_button(
+                    label=f"⬇️ Descargar reservas{' archivadas' if ver_archivadas else ''} ({formato_res})",
+                    data=partial(exportar_reservas, formato_res, filtro_res_id, ver_archivadas),
+                    file_name=nombre_exportacion(
+                        "reservas_archivadas" if ver_archivadas else "reservas_instrumentos", formato_res
+                    ),
+                    mime=mime_exportacion(formato_res),
+                )
 
-            csv_res = df_res.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="⬇️ Descargar reservas en CSV",
-                data=csv_res,
-                file_name="reservas_instrumentos.csv",
-                mime="text/csv",
-            )
+            if ver_archivadas:
+                # Las archivadas son de sólo lectura
+                return
 
             st.markdown("---")
             st.markdown("## Editar / Borrar reserva")
@@ -710,77 +1395,250 @@ with tab3:
             ids_res = df_res["id"].tolist()
             reserva_id_sel = st.selectbox("Seleccionar ID de reserva", ids_res, key="res_edit_select")
 
-            res_actual = obtener_reserva_por_id(int(reserva_id_sel))
-            if res_actual is None:
-                st.warning("No se encontró la reserva seleccionada.")
+            with st.expander("✏️ Editar reserva", expanded=False):
+                panel_editar_reserva(int(reserva_id_sel))
+
+            with st.expander("🗑️ Borrar reserva", expanded=False):
+                panel_borrar_reserva(int(reserva_id_sel))
+
+            reserva_sel = datos.reserva(int(reserva_id_sel))
+            if reserva_sel is not None and reserva_sel.get("serie_id") is not None:
+                with st.expander("🔁 Editar / cancelar toda la serie", expanded=False):
+                    panel_serie(int(reserva_sel["serie_id"]))
+
+
+# ------------------------------
+# TAB 4: Importación masiva desde planillas
+# ------------------------------
+@st.fragment(key="pestana_importacion")
+def pestana_importacion():
+    st.subheader("Importar instrumentos o reservas desde una planilla")
+
+    tipo_imp = st.radio("Datos a importar", ["Instrumentos", "Reservas"], horizontal=True, key="imp_tipo")
+    campos_imp = CAMPOS_IMPORTACION_INSTRUMENTOS if tipo_imp == "Instrumentos" else CAMPOS_IMPORTACION_RESERVAS
+    st.caption(
+        "Columnas esperadas: "
+        + ", ".join(f"{c} *" if oblig else c for c, oblig in campos_imp.items())
+        + ". (*) obligatorias."
+    )
+
+    archivo_imp = st.file_uploader("Planilla CSV o XLSX", type=["csv", "xlsx"], key=f"imp_archivo_{tipo_imp}")
+    if archivo_imp is not None:
+        try:
+            df_plan = leer_planilla(archivo_imp)
+        except Exception as e:
+            st.error(f"No se pudo leer la planilla: {e}")
+            df_plan = None
+
+        if df_plan is not None:
+            st.write(f"Filas en la planilla: **{len(df_plan)}**")
+
+            st.markdown("#### Correspondencia de columnas")
+            sugerido = mapeo_sugerido(list(df_plan.columns), campos_imp)
+            opciones_col = ["(no importar)"] + list(df_plan.columns)
+            mapeo_imp: Dict[str, str] = {}
+            cols_map = st.columns(3)
+            for i, (campo, obligatorio) in enumerate(campos_imp.items()):
+                with cols_map[i % 3]:
+                    elegido = st.selectbox(
+                        f"{campo} *" if obligatorio else campo,
+                        opciones_col,
+                        index=opciones_col.index(sugerido[campo]) if campo in sugerido else 0,
+                        key=f"imp_map_{tipo_imp}_{campo}",
+                    )
+                if elegido != "(no importar)":
+                    mapeo_imp[campo] = elegido
+
+            permitir_tent_imp = True
+            if tipo_imp == "Reservas":
+                permitir_tent_imp = st.checkbox(
+                    "Permitir solapamiento con reservas tentativas", value=True, key="imp_tent"
+                )
+
+            faltantes = [c for c, oblig in campos_imp.items() if oblig and c not in mapeo_imp]
+            if faltantes:
+                st.warning(f"Asigne una columna a los campos obligatorios: {', '.join(faltantes)}")
             else:
-                with st.expander("✏️ Editar reserva", expanded=False):
-                    with st.form("form_editar_reserva"):
-                        df_inst_all = cargar_instrumentos()
-                        mapa_inst = {
-                            f"[ID {row.id}] {row.instrumento} – {row.investigador_grupo}": int(row.id)
-                            for _, row in df_inst_all.iterrows()
-                        }
-                        etiquetas = list(mapa_inst.keys())
-
-                        inst_actual_id = int(res_actual.get("instrumento_id"))
-                        default_label = next((lab for lab, iid in mapa_inst.items() if iid == inst_actual_id), etiquetas[0])
-                        idx_default = etiquetas.index(default_label) if default_label in etiquetas else 0
-
-                        r_inst_label = st.selectbox("Instrumento", etiquetas, index=idx_default, key=f"res_inst_{reserva_id_sel}")
-                        r_instrumento_id = mapa_inst[r_inst_label]
-
-                        r_usuario = st.text_input("Usuario solicitante *", value=res_actual.get("usuario") or "")
-
-                        dt_ini = datetime.strptime(res_actual["fecha_inicio"], "%Y-%m-%d %H:%M:%S")
-                        dt_fin = datetime.strptime(res_actual["fecha_fin"], "%Y-%m-%d %H:%M:%S")
-
-                        cfi, cff = st.columns(2)
-                        with cfi:
-                            r_fecha_ini = st.date_input("Fecha inicio", value=dt_ini.date(), key=f"ri_d_{reserva_id_sel}")
-                            r_hora_ini = st.time_input("Hora inicio", value=dt_ini.time(), key=f"ri_t_{reserva_id_sel}")
-                        with cff:
-                            r_fecha_fin = st.date_input("Fecha fin", value=dt_fin.date(), key=f"rf_d_{reserva_id_sel}")
-                            r_hora_fin = st.time_input("Hora fin", value=dt_fin.time(), key=f"rf_t_{reserva_id_sel}")
-
-                        r_estado = st.selectbox(
-                            "Estado de la reserva",
-                            ["Confirmada", "Tentativa", "Cancelada"],
-                            index=["Confirmada", "Tentativa", "Cancelada"].index(res_actual.get("estado") or "Confirmada"),
+                colb1, colb2 = st.columns(2)
+                with colb1:
+                    simular_imp = st.button("🔍 Vista previa (no guarda)", key="imp_simular")
+                with colb2:
+                    confirmar_imp = st.button("📥 Importar filas válidas", type="primary", key="imp_confirmar")
+
+                if simular_imp or confirmar_imp:
+                    with st.spinner("Validando planilla..."):
+                        if tipo_imp == "Instrumentos":
+                            resultado_imp = importar_instrumentos(df_plan, mapeo_imp, simular=simular_imp)
+                        else:
+                            resultado_imp = importar_reservas(
+                                df_plan, mapeo_imp, simular=simular_imp, permitir_tentativas=permitir_tent_imp
+                            )
+
+                    errores_imp = resultado_imp["errores"]
+                    c_val, c_err, c_ins = st.columns(3)
+                    c_val.metric("Filas válidas", resultado_imp["validas"])
+                    c_err.metric("Filas con errores", errores_imp["fila"].nunique())
+                    c_ins.metric("Filas insertadas", resultado_imp["insertadas"])
+
+                    if confirmar_imp:
+                        st.success(f"Se importaron {resultado_imp['insertadas']} filas en una sola transacción.")
+
+                    if not errores_imp.empty:
+                        st.markdown("#### Errores por fila")
+                        st.dataframe(errores_imp, width="stretch", hide_index=True)
+                        st.download_button(
+                            label="⬇️ Descargar reporte de errores (CSV)",
+                            data=errores_imp.to_csv(index=False).encode("utf-8"),
+                            file_name="errores_importacion.csv",
+                            mime="text/csv",
+                            key="imp_errores_csv",
                         )
-                        r_coment = st.text_area("Comentario", value=res_actual.get("comentario") or "")
 
-                        guardar_reserva_btn = st.form_submit_button("Guardar cambios")
+                    if not resultado_imp["vista_previa"].empty:
+                        st.markdown(f"#### Vista previa (primeras {IMPORTACION_FILAS_VISTA_PREVIA} filas válidas)")
+                        st.dataframe(resultado_imp["vista_previa"], width="stretch", hide_index=True)
 
-                        if guardar_reserva_btn:
-                            if not r_usuario:
-                                st.error("Complete 'Usuario solicitante'.")
-                            else:
-                                r_dt_ini = datetime.combine(r_fecha_ini, r_hora_ini)
-                                r_dt_fin = datetime.combine(r_fecha_fin, r_hora_fin)
-
-                                if r_dt_fin <= r_dt_ini:
-                                    st.error("La fecha/hora de fin debe ser posterior al inicio.")
-                                else:
-                                    actualizar_reserva(
-                                        reserva_id=int(reserva_id_sel),
-                                        instrumento_id=int(r_instrumento_id),
-                                        usuario=r_usuario,
-                                        fecha_inicio=r_dt_ini,
-                                        fecha_fin=r_dt_fin,
-                                        comentario=r_coment,
-                                        estado=r_estado,
-                                    )
-                                    st.success("Reserva actualizada.")
-                                    do_rerun()
-
-                with st.expander("🗑️ Borrar reserva", expanded=False):
-                    confirmar_r = st.text_input("Escribí BORRAR para confirmar", key=f"confirm_del_res_{reserva_id_sel}")
-                    if st.button("Eliminar reserva", key=f"btn_del_res_{reserva_id_sel}"):
-                        if confirmar_r.strip().upper() != "BORRAR":
-                            st.error("Confirmación incorrecta. Escribí BORRAR.")
-                        else:
-                            borrar_reserva(int(reserva_id_sel))
-                            st.success("Reserva eliminada.")
-                            do_rerun()
+# ------------------------------
+# TAB 5: Estadísticas de uso
+# ------------------------------
+@st.fragment(key="pestana_estadisticas")
+def pestana_estadisticas():
+    st.subheader("Uso de instrumentos")
+    st.caption("Horas reservadas, calculadas a partir de los totales diarios precalculados.")
+
+    hoy_uso = date.today()
+    cu1, cu2, cu3, cu4 = st.columns(4)
+    with cu1:
+        rango_uso = st.date_input(
+            "Período",
+            value=(hoy_uso - timedelta(days=90), hoy_uso),
+            key="uso_rango",
+        )
+    with cu2:
+        periodo_uso = st.radio("Agrupar por", ["semana", "mes"], horizontal=True, key="uso_periodo")
+    with cu3:
+        dimension_uso = st.selectbox(
+            "Dimensión",
+            list(ETIQUETAS_DIMENSION_USO),
+            format_func=ETIQUETAS_DIMENSION_USO.get,
+            key="uso_dimension",
+        )
+    with cu4:
+        estados_uso = st.multiselect(
+            "Estados",
+            ESTADOS_RESERVA,
+            default=["Confirmada", "Tentativa"],
+            key="uso_estados",
+        )
+
+    if not isinstance(rango_uso, (tuple, list)) or len(rango_uso) != 2:
+        st.info("Elija la fecha de inicio y de fin del período.")
+    else:
+        df_uso = cargar_uso(rango_uso[0], rango_uso[1], periodo_uso, dimension_uso, tuple(estados_uso))
+        if df_uso.empty:
+            st.info("No hay reservas en el período y estados elegidos.")
+        else:
+            mostrar_estadisticas_uso(df_uso, dimension_uso)
+
+
+# ==============================
+# UI: diagnóstico de rendimiento
+# ==============================
+def _cambiar_perfil():
+    activar_perfil(st.session_state["perfil_activo"])
+
+
+def _tabla_perfil(df: pd.DataFrame):
+    st.dataframe(
+        df,
+        hide_index=True,
+        width="stretch",
+        column_config={
+            "funcion": "Función",
+            "llamadas": "Llamadas",
+            "total_ms": st.column_config.NumberColumn("Total (ms)", format="%.1f"),
+            "media_ms": st.column_config.NumberColumn("Media (ms)", format="%.1f"),
+            "max_ms": st.column_config.NumberColumn("Máx. (ms)", format="%.1f"),
+            "filas": "Filas",
+        },
+    )
+
+
+def _mostrar_escritor():
+    metricas = metricas_escritor()
+    if not metricas["activo"]:
+        st.caption("Escritor único desactivado: cada escritura confirma por su cuenta.")
+        return
+    st.markdown("**Escritor único**")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("En cola", metricas["profundidad_cola"])
+    c2.metric("Pedidos por lote", f"{metricas['pedidos_por_lote']:.1f}")
+    c3.metric("Commit p95", f"{metricas['commit_p95_ms']:.1f} ms")
+    st.caption(
+        f"{metricas['pedidos']} escrituras en {metricas['lotes']} lotes · "
+        f"espera en cola p50 {metricas['espera_p50_ms']:.1f} ms, p95 {metricas['espera_p95_ms']:.1f} ms · "
+        f"commit p50 {metricas['commit_p50_ms']:.1f} ms, máx. {metricas['commit_max_ms']:.1f} ms · "
+        f"{metricas['errores']} rechazadas, {metricas['commits_fallidos']} commits fallidos"
+    )
+
+
+def mostrar_diagnostico(corrida):
+    perfil = obtener_perfil()
+    # El perfilado es del proceso: el interruptor refleja lo que haya
+    # elegido cualquier sesión
+    st.session_state["perfil_activo"] = perfil.activo
+    with st.expander("🩺 Diagnóstico de rendimiento", expanded=False):
+        st.toggle(
+            "Perfilar funciones de datos",
+            key="perfil_activo",
+            on_change=_cambiar_perfil,
+            help="Afecta a todas las sesiones de este servidor. Apagado no mide nada.",
+        )
+        _mostrar_escritor()
+        if not perfil.activo:
+            return
+
+        if corrida is not None:
+            st.metric("Última ejecución completa", f"{corrida.duracion * 1000:.0f} ms")
+            st.caption(
+                f"{corrida.consultas} consultas SQL · {corrida.segundos_sql * 1000:.0f} ms en SQLite"
+            )
+            _tabla_perfil(corrida.funciones.tabla())
+
+        st.markdown("**Acumulado desde que se activó**")
+        st.caption(f"{perfil.consultas} consultas SQL · {perfil.segundos_sql * 1000:.0f} ms en SQLite")
+        _tabla_perfil(perfil.tabla_funciones())
+
+        lentas = perfil.ultimas_consultas_lentas()
+        st.markdown(f"**Consultas lentas** (≥ {CONSULTA_LENTA_MS:.0f} ms): {len(lentas)}")
+        for consulta in lentas:
+            st.caption(f"{consulta['momento']:%H:%M:%S} · {consulta['ms']:.1f} ms")
+            plan = f"\n\n-- EXPLAIN QUERY PLAN\n{consulta['plan']}" if consulta["plan"] else ""
+            st.code(consulta["sql"] + plan, language="sql")
+
+        st.button("Reiniciar estadísticas", key="btn_reiniciar_perfil", on_click=perfil.reiniciar)
+
+
+# ==============================
+# UI: pestañas
+# ==============================
+# Las pestañas recuerdan cuál está abierta (on_change="rerun") y sólo se
+# ejecuta el contenido de esa; cada pestaña es además su propio fragmento.
+PESTANAS = [
+    ("➕ Cargar instrumento", pestana_cargar_instrumento),
+    ("📋 Ver base de datos", pestana_inventario),
+    ("📅 Reservas de uso", pestana_reservas),
+    ("📥 Importación masiva", pestana_importacion),
+    ("📊 Estadísticas de uso", pestana_estadisticas),
+]
+
+for contenedor, (_, dibujar_pestana) in zip(
+    st.tabs([etiqueta for etiqueta, _ in PESTANAS], key="pestana_activa", on_change="rerun"),
+    PESTANAS,
+):
+    with contenedor:
+        if contenedor.open:
+            dibujar_pestana()
 
+with panel_diagnostico:
+    mostrar_diagnostico(terminar_corrida())
@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks de la capa de datos (datos_instrumentos) con datos sintéticos.
+
+Genera bases reproducibles (misma semilla, mismos datos) de miles a millones
+de filas, mide latencia (percentiles) y throughput de las operaciones más
+usadas y guarda el resultado en JSON para compararlo con una corrida previa.
+
+    python benchmark_instrumentos.py correr --escalas chica,media --salida actual.json
+    python benchmark_instrumentos.py correr --escalas chica --base base.json
+    python benchmark_instrumentos.py comparar base.json actual.json --tolerancia 0.2
+
+Cada escala corre en un proceso aparte: la ruta de la base se fija al
+importar datos_instrumentos y así cada medición arranca con cachés y pool
+vacíos. Las bases generadas se guardan como plantillas en --directorio y se
+copian antes de medir, porque varias operaciones escriben.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Tamaños predefinidos; --instrumentos, --reservas y --fotos arman una escala a medida
+ESCALAS = {
+    "chica": {"instrumentos": 200, "reservas": 5_000, "fotos": 50},
+    "media": {"instrumentos": 2_000, "reservas": 100_000, "fotos": 500},
+    "grande": {"instrumentos": 10_000, "reservas": 1_000_000, "fotos": 2_000},
+}
+SEMILLA = 12345
+DIRECTORIO_PLANTILLAS = Path(tempfile.gettempdir()) / "instrumentos_bench"
+
+# Cada operación se repite hasta REPETICIONES veces o hasta agotar
+# SEGUNDOS_POR_OPERACION, con un mínimo de REPETICIONES_MINIMAS.
+REPETICIONES = 30
+REPETICIONES_MINIMAS = 3
+SEGUNDOS_POR_OPERACION = 20.0
+
+# Por debajo de esta diferencia absoluta un cambio se considera ruido
+UMBRAL_RUIDO_MS = 0.5
+TOLERANCIA = 0.2
+
+GENERACION_FILAS_POR_BLOQUE = 100_000
+
+
+# ==============================
+# Generador de datos sintéticos
+# ==============================
+GRUPOS = [
+    "Fisiología Vegetal", "Microbiología", "Edafología", "Genética", "Química Analítica",
+    "Ecología", "Fitopatología", "Forrajicultura", "Bioquímica", "Hidrología",
+    "Biología Molecular", "Zoología Agrícola", "Nutrición Animal", "Física", "Climatología",
+]
+INVESTIGADORES = [
+    "García", "Fernández", "López", "Martínez", "González", "Rodríguez", "Pérez", "Sánchez",
+    "Romero", "Álvarez", "Torres", "Ruiz", "Ramírez", "Flores", "Acosta", "Benítez",
+]
+TIPOS_INSTRUMENTO = [
+    "Microscopio", "Espectrofotómetro", "Centrífuga", "Balanza analítica", "Estufa de cultivo",
+    "Autoclave", "pHmetro", "Cromatógrafo", "Termociclador", "Liofilizador", "Campana de flujo",
+    "Freezer -80", "Agitador orbital", "Conductímetro", "Fluorómetro", "Medidor de fotosíntesis",
+]
+UBICACIONES = ["Pabellón Central", "Laboratorio 1", "Laboratorio 2", "Invernáculo", "Campo experimental"]
+PROBABILIDAD_ESTADO_RESERVA = {"Confirmada": 0.75, "Tentativa": 0.15, "Cancelada": 0.10}
+FOTO_GENERADA_LADO = (320, 240)
+
+
+def _elegir(rng: np.random.Generator, opciones: list[str], n: int) -> list[str]:
+    return np.asarray(opciones, dtype=object)[rng.integers(0, len(opciones), n)].tolist()
+
+
+def _imagen_sintetica(rng: np.random.Generator, tamano: tuple[int, int]) -> Image.Image:
+    # Degradé con ruido: comprime parecido a una foto real, no a un color liso
+    ancho, alto = tamano
+    base = rng.integers(0, 256, 3)
+    x = np.linspace(0, 1, ancho)[None, :, None]
+    y = np.linspace(0, 1, alto)[:, None, None]
+    pixeles = base + 120 * x - 80 * y + rng.normal(0, 18, (alto, ancho, 3))
+    return Image.fromarray(np.clip(pixeles, 0, 255).astype(np.uint8), "RGB")
+
+
+def _generar_fotos(rng: np.random.Generator, directorio: Path, cantidad: int) -> list[str]:
+    directorio.mkdir(parents=True, exist_ok=True)
+    rutas = []
+    for _ in range(cantidad):
+        buffer = io.BytesIO()
+        _imagen_sintetica(rng, FOTO_GENERADA_LADO).save(buffer, "WEBP", quality=80)
+        datos = buffer.getvalue()
+        # Mismo esquema de nombres que guardar_imagen (contenido direccionado)
+        ruta = directorio / f"{hashlib.sha256(datos).hexdigest()[:32]}.webp"
+        ruta.write_bytes(datos)
+        rutas.append(str(ruta))
+    return rutas
+
+
+def _generar_instrumentos(conn: sqlite3.Connection, rng: np.random.Generator, cantidad: int, fotos: list[str], ahora: int):
+    from datos_instrumentos import ESTADOS_INSTRUMENTO, OPCIONES_RESERVA_USO
+
+    tipos = _elegir(rng, TIPOS_INSTRUMENTO, cantidad)
+    grupos = _elegir(rng, GRUPOS, cantidad)
+    foto_path: list[Optional[str]] = [None] * cantidad
+    for i, ruta in zip(rng.permutation(cantidad)[: len(fotos)], fotos):
+        foto_path[int(i)] = ruta
+
+    filas = zip(
+        grupos,
+        _elegir(rng, INVESTIGADORES, cantidad),
+        [f"Dr./Dra. {a}" for a in _elegir(rng, INVESTIGADORES, cantidad)],
+        [f"{t} {i + 1}" for i, t in enumerate(tipos)],
+        [f"INV-{n:07d}" for n in rng.permutation(cantidad * 10)[:cantidad]],
+        _elegir(rng, OPCIONES_RESERVA_USO, cantidad),
+        np.asarray(ESTADOS_INSTRUMENTO, dtype=object)[
+            rng.choice(len(ESTADOS_INSTRUMENTO), cantidad, p=[0.85, 0.08, 0.05, 0.02])
+        ].tolist(),
+        _elegir(rng, UBICACIONES, cantidad),
+        [f"{t} del grupo de {g}" for t, g in zip(tipos, grupos)],
+        foto_path,
+        (ahora - rng.integers(0, 5 * 365 * 86400, cantidad)).tolist(),
+    )
+    conn.executemany(
+        """
+        INSERT INTO instrumentos
+        (grupo_unidad, investigador_grupo, responsable, instrumento, numero_inventario,
+         reserva_uso, estado, ubicacion, descripcion, foto_path, fecha_registro)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        filas,
+    )
+
+
+def _generar_reservas(conn: sqlite3.Connection, rng: np.random.Generator, cantidad: int, instrumentos: int, ahora: int):
+    # Pocos instrumentos concentran la mayoría de las reservas (pesos de Pareto)
+    pesos = rng.pareto(1.2, instrumentos) + 0.05
+    pesos /= pesos.sum()
+    usuarios = [f"usuario{n}" for n in range(max(20, cantidad // 200))]
+    estados = list(PROBABILIDAD_ESTADO_RESERVA)
+    desde = ahora - 3 * 365 * 86400
+    hasta = ahora + 90 * 86400
+
+    for inicio_bloque in range(0, cantidad, GENERACION_FILAS_POR_BLOQUE):
+        n = min(GENERACION_FILAS_POR_BLOQUE, cantidad - inicio_bloque)
+        inicio = rng.integers(desde, hasta, n) // 1800 * 1800  # en medias horas
+        fin = inicio + rng.integers(1, 17, n) * 1800
+        filas = zip(
+            (rng.choice(instrumentos, n, p=pesos) + 1).tolist(),
+            _elegir(rng, usuarios, n),
+            inicio.tolist(),
+            fin.tolist(),
+            np.where(rng.random(n) < 0.2, "Ensayo", "").tolist(),
+            np.asarray(estados, dtype=object)[
+                rng.choice(len(estados), n, p=list(PROBABILIDAD_ESTADO_RESERVA.values()))
+            ].tolist(),
+            (inicio - rng.integers(0, 30 * 86400, n)).tolist(),
+        )
+        conn.executemany(
+            """
+            INSERT INTO reservas
+            (instrumento_id, usuario, fecha_inicio, fecha_fin, comentario, estado, fecha_registro)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            filas,
+        )
+
+
+def generar_base(db_path: Path, fotos_dir: Path, instrumentos: int, reservas: int, fotos: int, semilla: int):
+    """Crea una base completa (esquema, datos, FTS y uso_diario) a partir de la semilla."""
+    from datos_instrumentos import aplicar_migraciones, _recalcular_uso_diario
+
+    rng = np.random.default_rng(semilla)
+    # Reloj fijo: la misma semilla da exactamente la misma base cualquier día
+    ahora = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+    tmp = db_path.with_name(f".{db_path.name}.tmp")
+    tmp.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        aplicar_migraciones(conn)
+        rutas = _generar_fotos(rng, fotos_dir, fotos)
+        _generar_instrumentos(conn, rng, instrumentos, rutas, ahora)
+        _generar_reservas(conn, rng, reservas, instrumentos, ahora)
+        _recalcular_uso_diario(conn)
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp, db_path)
+
+
+# ==============================
+# Medición
+# ==============================
+def resumir_tiempos(tiempos: list[float]) -> Dict[str, float]:
+    ms = np.asarray(tiempos) * 1000
+    p50, p90, p95, p99 = np.percentile(ms, [50, 90, 95, 99])
+    return {
+        "n": len(ms),
+        "min_ms": round(float(ms.min()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p90_ms": round(float(p90), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "media_ms": round(float(ms.mean()), 3),
+        "ops_por_s": round(len(ms) / float(ms.sum() / 1000), 2),
+    }
+
+
+def medir(
+    operacion: Callable[[int], Any],
+    preparar: Optional[Callable[[int], Any]] = None,
+    repeticiones: int = REPETICIONES,
+    segundos: float = SEGUNDOS_POR_OPERACION,
+) -> Dict[str, float]:
+    """Mide operacion(i); preparar(i), si se indica, corre antes y fuera del tiempo medido."""
+    tiempos: list[float] = []
+    limite = time.perf_counter() + segundos
+    for i in range(repeticiones):
+        if i >= REPETICIONES_MINIMAS and time.perf_counter() > limite:
+            break
+        if preparar is not None:
+            preparar(i)
+        t0 = time.perf_counter()
+        operacion(i)
+        tiempos.append(time.perf_counter() - t0)
+    return resumir_tiempos(tiempos)
+
+
+def _foto_subida(rng: np.random.Generator) -> io.BytesIO:
+    archivo = io.BytesIO()
+    _imagen_sintetica(rng, (1200, 900)).save(archivo, "JPEG", quality=90)
+    archivo.name = "foto.jpg"
+    return archivo
+
+
+def medir_operaciones(repeticiones: int, segundos: float, semilla: int) -> Dict[str, Dict[str, float]]:
+    import datos_instrumentos as datos
+
+    datos.init_db()
+    rng = np.random.default_rng(semilla + 1)
+    with datos.conexion() as conn:
+        ids = [r[0] for r in conn.execute("SELECT id FROM instrumentos ORDER BY id")]
+        desde, hasta = conn.execute("SELECT MIN(fecha_inicio), MAX(fecha_fin) FROM reservas").fetchone()
+    if not ids:
+        raise SystemExit("La base no tiene instrumentos")
+    desde, hasta = desde or datos.ahora_epoch(), hasta or datos.ahora_epoch() + 86400
+    al_azar = rng.choice(ids, repeticiones).tolist()
+
+    def sin_cache(_i: int):
+        # Lo mismo que pasa después de cualquier escritura
+        datos._version_datos().incrementar()
+
+    def medir_op(operacion, preparar=None):
+        return medir(operacion, preparar, repeticiones, segundos)
+
+    resultados: Dict[str, Dict[str, float]] = {}
+    resultados["cargar_instrumentos"] = medir_op(lambda i: datos.cargar_instrumentos(), sin_cache)
+    resultados["cargar_instrumentos_cache"] = medir_op(lambda i: datos.cargar_instrumentos())
+    resultados["cargar_instrumentos_busqueda"] = medir_op(
+        lambda i: datos.cargar_instrumentos(busqueda=TIPOS_INSTRUMENTO[i % len(TIPOS_INSTRUMENTO)]), sin_cache
+    )
+    resultados["cargar_instrumentos_pagina"] = medir_op(
+        lambda i: datos.cargar_instrumentos_pagina(orden="instrumento"), sin_cache
+    )
+    resultados["cargar_reservas"] = medir_op(lambda i: datos.cargar_reservas(), sin_cache)
+    resultados["cargar_reservas_instrumento"] = medir_op(
+        lambda i: datos.cargar_reservas(al_azar[i]), sin_cache
+    )
+    resultados["cargar_reservas_pagina"] = medir_op(lambda i: datos.cargar_reservas_pagina(), sin_cache)
+    dia_desde, dia_hasta = datos.desde_epoch(desde).date(), datos.desde_epoch(hasta).date()
+    resultados["cargar_uso_semanal"] = medir_op(
+        lambda i: datos.cargar_uso(dia_desde, dia_hasta, "semana", "instrumento"), sin_cache
+    )
+    # Con una letra de menos, como quien escribe apurado. El índice se arma
+    # una vez por proceso: esa primera búsqueda queda fuera de la medición.
+    con_errores = [t[:len(t) // 2] + t[len(t) // 2 + 1:] for t in TIPOS_INSTRUMENTO]
+    datos.autocompletar_instrumentos(con_errores[0])
+    resultados["autocompletar_instrumentos"] = medir_op(
+        lambda i: datos.autocompletar_instrumentos(con_errores[i % len(con_errores)])
+    )
+
+    inicios = rng.integers(desde, hasta, repeticiones) // 1800 * 1800
+    resultados["insertar_reserva"] = medir_op(
+        lambda i: datos.insertar_reserva(
+            al_azar[i],
+            "benchmark",
+            datos.desde_epoch(int(inicios[i])),
+            datos.desde_epoch(int(inicios[i]) + 7200),
+            "",
+            estado="Tentativa",
+        )
+    )
+
+    fotos = [_foto_subida(rng) for _ in range(repeticiones)]
+    resultados["guardar_imagen"] = medir_op(lambda i: datos.guardar_imagen(fotos[i % len(fotos)]))
+
+    # Al final porque vacía instrumentos: cada repetición borra uno distinto
+    a_borrar = rng.permutation(ids)[:repeticiones].tolist()
+    resultados["borrar_reservas_de_instrumento"] = medir_op(
+        lambda i: datos.borrar_reservas_de_instrumento(a_borrar[i % len(a_borrar)])
+    )
+    return resultados
+
+
+# ==============================
+# Corrida por escala (en un proceso propio)
+# ==============================
+def _plantilla(directorio: Path, escala: Dict[str, int], semilla: int) -> tuple[Path, Path]:
+    nombre = f"i{escala['instrumentos']}_r{escala['reservas']}_f{escala['fotos']}_s{semilla}"
+    return directorio / f"{nombre}.db", directorio / f"{nombre}_fotos"
+
+
+def correr_escala(args: argparse.Namespace) -> Dict[str, Any]:
+    escala = {"instrumentos": args.instrumentos, "reservas": args.reservas, "fotos": args.fotos}
+    directorio = Path(args.directorio)
+    directorio.mkdir(parents=True, exist_ok=True)
+    plantilla, fotos_dir = _plantilla(directorio, escala, args.semilla)
+
+    generacion_s = None
+    if not plantilla.exists():
+        t0 = time.perf_counter()
+        generar_base(plantilla, fotos_dir, semilla=args.semilla, **escala)
+        generacion_s = round(time.perf_counter() - t0, 2)
+
+    # datos_instrumentos ya quedó apuntando a la copia de trabajo (ver main)
+    shutil.copyfile(plantilla, os.environ["INSTRUMENTOS_DB"])
+    operaciones = medir_operaciones(args.repeticiones, args.segundos, args.semilla)
+    return {
+        "filas": escala,
+        "semilla": args.semilla,
+        "generacion_s": generacion_s,
+        "tamano_base_mb": round(plantilla.stat().st_size / 2**20, 2),
+        "operaciones": operaciones,
+    }
+
+
+def _escala_en_subproceso(nombre: str, escala: Dict[str, int], args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="instrumentos_bench_") as trabajo:
+        salida = Path(trabajo) / "resultado.json"
+        comando = [
+            sys.executable, str(Path(__file__).resolve()), "_escala",
+            "--instrumentos", str(escala["instrumentos"]),
+            "--reservas", str(escala["reservas"]),
+            "--fotos", str(escala["fotos"]),
+            "--semilla", str(args.semilla),
+            "--repeticiones", str(args.repeticiones),
+            "--segundos", str(args.segundos),
+            "--directorio", str(args.directorio),
+            "--trabajo", trabajo,
+            "--salida", str(salida),
+        ]
+        print(f"== {nombre}: {escala['instrumentos']:,} instrumentos, {escala['reservas']:,} reservas, "
+              f"{escala['fotos']:,} fotos", file=sys.stderr)
+        subprocess.run(comando, check=True)
+        return json.loads(salida.read_text(encoding="utf-8"))
+
+
+def _metadatos() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pandas": pd.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# ==============================
+# Reportes y comparación
+# ==============================
+def imprimir_resultados(resultados: Dict[str, Any]):
+    for nombre, escala in resultados["escalas"].items():
+        print(f"\n{nombre}  (generación: {escala['generacion_s'] or 'plantilla existente'} s, "
+              f"base: {escala['tamano_base_mb']} MB)")
+        print(f"  {'operación':34} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>10}")
+        for op, r in escala["operaciones"].items():
+            print(f"  {op:34} {r['n']:>4} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} "
+                  f"{r['p99_ms']:>10.2f} {r['ops_por_s']:>10.1f}")
+
+
+def comparar(base: Dict[str, Any], actual: Dict[str, Any], tolerancia: float, umbral_ms: float) -> list[str]:
+    """Imprime la comparación y devuelve las regresiones (p50 o p95 más lentos que la tolerancia)."""
+    regresiones = []
+    for nombre, escala in actual["escalas"].items():
+        anterior = base.get("escalas", {}).get(nombre)
+        if anterior is None or anterior["filas"] != escala["filas"]:
+            print(f"\n{nombre}: sin referencia comparable en la base")
+            continue
+        print(f"\n{nombre}  (base {base['metadatos'].get('commit')} → actual {actual['metadatos'].get('commit')})")
+        print(f"  {'operación':34} {'p50 base':>10} {'p50 act.':>10} {'cambio':>8}   {'p95 base':>10} {'p95 act.':>10} {'cambio':>8}")
+        for op, r in escala["operaciones"].items():
+            ref = anterior["operaciones"].get(op)
+            if ref is None:
+                print(f"  {op:34} (nueva)")
+                continue
+            marcas = []
+            celdas = []
+            for metrica in ("p50_ms", "p95_ms"):
+                cambio = r[metrica] / ref[metrica] - 1 if ref[metrica] else 0.0
+                lento = cambio > tolerancia and r[metrica] - ref[metrica] > umbral_ms
+                if lento:
+                    marcas.append(metrica[:3])
+                celdas.append(f"{ref[metrica]:>10.2f} {r[metrica]:>10.2f} {cambio:>+8.0%}{'!' if lento else ' '}")
+            print(f"  {op:34} {'  '.join(celdas)}")
+            if marcas:
+                regresiones.append(f"{nombre}/{op} ({', '.join(marcas)})")
+    return regresiones
+
+
+def _informar_regresiones(regresiones: list[str], tolerancia: float) -> int:
+    if regresiones:
+        print(f"\nRegresiones (más de {tolerancia:.0%} más lento): " + "; ".join(regresiones))
+        return 1
+    print("\nSin regresiones.")
+    return 0
+
+
+# ==============================
+# Línea de comandos
+# ==============================
+def _escalas_pedidas(args: argparse.Namespace) -> Dict[str, Dict[str, int]]:
+    a_medida = {k: getattr(args, k) for k in ("instrumentos", "reservas", "fotos")}
+    if any(v is not None for v in a_medida.values()):
+        return {"personalizada": {k: v or 0 for k, v in a_medida.items()}}
+    desconocidas = [e for e in args.escalas.split(",") if e not in ESCALAS]
+    if desconocidas:
+        raise SystemExit(f"Escalas desconocidas: {', '.join(desconocidas)} (disponibles: {', '.join(ESCALAS)})")
+    return {e: ESCALAS[e] for e in args.escalas.split(",")}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de la capa de datos de instrumentos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_correr = sub.add_parser("correr", help="Generar las bases (si hace falta) y medir")
+    p_correr.add_argument("--escalas", default="chica", help=f"Separadas por comas: {', '.join(ESCALAS)}")
+    p_correr.add_argument("--instrumentos", type=int, help="Escala a medida (reemplaza --escalas)")
+    p_correr.add_argument("--reservas", type=int)
+    p_correr.add_argument("--fotos", type=int)
+    p_correr.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    p_correr.add_argument("--base", help="JSON de una corrida anterior para comparar")
+
+    p_comparar = sub.add_parser("comparar", help="Comparar dos resultados guardados")
+    p_comparar.add_argument("base")
+    p_comparar.add_argument("actual")
+
+    # Uso interno: una escala por proceso
+    p_escala = sub.add_parser("_escala")
+    p_escala.add_argument("--instrumentos", type=int, required=True)
+    p_escala.add_argument("--reservas", type=int, required=True)
+    p_escala.add_argument("--fotos", type=int, required=True)
+    p_escala.add_argument("--trabajo", required=True)
+    p_escala.add_argument("--salida", required=True)
+
+    for p in (p_correr, p_escala):
+        p.add_argument("--semilla", type=int, default=SEMILLA)
+        p.add_argument("--repeticiones", type=int, default=REPETICIONES)
+        p.add_argument("--segundos", type=float, default=SEGUNDOS_POR_OPERACION,
+                       help="Tiempo máximo por operación")
+        p.add_argument("--directorio", default=str(DIRECTORIO_PLANTILLAS),
+                       help="Dónde guardar las bases generadas para reutilizarlas")
+    for p in (p_correr, p_comparar):
+        p.add_argument("--tolerancia", type=float, default=TOLERANCIA,
+                       help="Aumento relativo de p50/p95 que cuenta como regresión")
+        p.add_argument("--umbral-ms", type=float, default=UMBRAL_RUIDO_MS)
+
+    args = parser.parse_args()
+
+    if args.comando == "_escala":
+        # Antes de importar datos_instrumentos, que lee estas rutas al cargarse
+        trabajo = Path(args.trabajo)
+        os.environ["INSTRUMENTOS_DB"] = str(trabajo / "instrumentos.db")
+        os.environ["INSTRUMENTOS_FOTOS"] = str(trabajo / "fotos")
+        os.environ["INSTRUMENTOS_MINIATURAS"] = str(trabajo / "miniaturas")
+        resultado = correr_escala(args)
+        Path(args.salida).write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+        return 0
+
+    if args.comando == "comparar":
+        base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+        actual = json.loads(Path(args.actual).read_text(encoding="utf-8"))
+        return _informar_regresiones(comparar(base, actual, args.tolerancia, args.umbral_ms), args.tolerancia)
+
+    resultados = {
+        "metadatos": _metadatos(),
+        "escalas": {
+            nombre: _escala_en_subproceso(nombre, escala, args)
+            for nombre, escala in _escalas_pedidas(args).items()
+        },
+    }
+    imprimir_resultados(resultados)
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(resultados, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.base:
+        base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+        return _informar_regresiones(comparar(base, resultados, args.tolerancia, args.umbral_ms), args.tolerancia)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
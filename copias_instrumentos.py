@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Copias de seguridad de instrumentos.db y de las fotos, sin detener la app.
+
+    python copias_instrumentos.py crear
+    python copias_instrumentos.py listar
+    python copias_instrumentos.py verificar 20250301-020000
+    python copias_instrumentos.py restaurar 20250301-020000
+    python copias_instrumentos.py programar        # cada INSTRUMENTOS_COPIAS_HORAS
+
+Las copias quedan en INSTRUMENTOS_COPIAS (por defecto ./copias). La app ya
+hace una copia programada mientras está abierta; "programar" sirve para un
+servidor donde la app no corre todo el tiempo.
+
+"restaurar" verifica la copia (hash e integrity_check de la base, hash de
+cada foto), guarda antes una copia del estado actual y recién entonces la
+vuelca sobre la base en uso. Esa copia se llama previa-<fecha>, no entra en
+la rotación de --retener y, si ya no hace falta, se borra a mano.
+"""
+import argparse
+import logging
+import sys
+
+import datos_instrumentos as datos
+
+
+def _listar() -> int:
+    copias = datos.listar_copias()
+    if not copias:
+        print("No hay copias.")
+        return 0
+    for copia in copias:
+        print(
+            f"{copia['nombre']}  {copia['fecha']:%d/%m/%Y %H:%M}  "
+            f"base {copia['bytes_base'] / 1e6:.1f} MB  "
+            f"{copia['fotos']} fotos ({copia['fotos_copiadas']} nuevas)  esquema {copia['esquema']}"
+        )
+    return 0
+
+
+def _verificar(nombre: str, rapida: bool) -> int:
+    problemas = datos.verificar_copia(nombre, completa=not rapida)
+    for problema in problemas:
+        print(problema)
+    if not problemas:
+        print(f"La copia {nombre} está completa y sin errores.")
+    return 1 if problemas else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Copias de seguridad del inventario de instrumentos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_crear = sub.add_parser("crear", help="Hace una copia ahora")
+    p_crear.add_argument("--retener", type=int, default=datos.BACKUP_RETENER,
+                         help="Cuántas copias conservar (las más viejas se borran)")
+    sub.add_parser("listar", help="Lista las copias disponibles")
+    p_verif = sub.add_parser("verificar", help="Verifica una copia sin tocar la base")
+    p_verif.add_argument("nombre")
+    p_verif.add_argument("--rapida", action="store_true", help="No recalcula el hash de cada foto")
+    p_rest = sub.add_parser("restaurar", help="Verifica y restaura una copia")
+    p_rest.add_argument("nombre")
+    p_rest.add_argument("--sin-fotos", action="store_true", help="Restaura sólo la base")
+    sub.add_parser("programar", help="Queda corriendo y hace una copia cada INSTRUMENTOS_COPIAS_HORAS")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    datos.init_db()
+
+    try:
+        if args.comando == "crear":
+            manifiesto = datos.crear_copia(args.retener)
+            print(
+                f"Copia {manifiesto['nombre']}: {len(manifiesto['fotos'])} fotos "
+                f"({manifiesto['fotos_copiadas']} nuevas), {manifiesto['segundos']} s"
+            )
+        elif args.comando == "listar":
+            return _listar()
+        elif args.comando == "verificar":
+            return _verificar(args.nombre, args.rapida)
+        elif args.comando == "restaurar":
+            resultado = datos.restaurar_copia(args.nombre, restaurar_fotos=not args.sin_fotos)
+            print(
+                f"Restaurada la copia {resultado['copia']} ({resultado['fotos_restauradas']} fotos). "
+                f"El estado anterior quedó en la copia {resultado['previa']}."
+            )
+        elif args.comando == "programar":
+            programador = datos.obtener_programador_copias()
+            programador.iniciar()
+            try:
+                programador.esperar()
+            except KeyboardInterrupt:
+                programador.detener()
+    except (ValueError, datos.CopiaEnCurso) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4314 @@
+# -*- coding: utf-8 -*-
+"""
+Acceso a datos del inventario de instrumentos: SQLite, fotos, exportación
+e importación. No depende de Streamlit, así lo pueden usar la app, la API
+JSON y scripts sueltos.
+"""
+import gzip
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+import unicodedata
+import uuid
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
+from functools import lru_cache, wraps
+from datetime import datetime, date, time, timedelta
+from pathlib import Path
+from time import monotonic, perf_counter, sleep
+from typing import Optional, Dict, Any, Iterator, Iterable, Callable, TypeVar, BinaryIO
+
+import pandas as pd
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Carpeta base
+BASE_DIR = Path(__file__).resolve().parent
+
+# Base de datos, fotos, copias y miniaturas (las rutas se pueden cambiar con
+# INSTRUMENTOS_DB, INSTRUMENTOS_FOTOS, INSTRUMENTOS_COPIAS e
+# INSTRUMENTOS_MINIATURAS, p. ej. para apuntar a una copia de prueba)
+DB_PATH = Path(os.environ.get("INSTRUMENTOS_DB", BASE_DIR / "instrumentos.db"))
+IMAGES_DIR = Path(os.environ.get("INSTRUMENTOS_FOTOS", BASE_DIR / "instrument_photos"))
+BACKUP_DIR = Path(os.environ.get("INSTRUMENTOS_COPIAS", BASE_DIR / "copias"))
+MINIATURAS_DIR = Path(os.environ.get("INSTRUMENTOS_MINIATURAS", BASE_DIR / "cache_miniaturas"))
+
+
+# ==============================
+# Recursos compartidos del proceso
+# ==============================
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def recurso_compartido(func: F) -> F:
+    """Crea el recurso una sola vez por proceso y lo comparte entre hilos."""
+    lock = threading.Lock()
+    instancia: list[Any] = []
+
+    @wraps(func)
+    def envoltura():
+        with lock:
+            if not instancia:
+                instancia.append(func())
+        return instancia[0]
+    return envoltura  # type: ignore[return-value]
+
+
+# ==============================
+# Perfilado (opcional)
+# ==============================
+# Apagado por defecto. Con INSTRUMENTOS_PERFIL=1, o activándolo desde el
+# panel de diagnóstico de la app, se cuentan llamadas, tiempo y filas de cada
+# función de datos (@perfilado) y se registran las consultas SQL que tardan
+# más de CONSULTA_LENTA_MS junto con su EXPLAIN QUERY PLAN. Apagado cuesta
+# un if por llamada.
+CONSULTA_LENTA_MS = float(os.environ.get("INSTRUMENTOS_CONSULTA_LENTA_MS", 100))
+CONSULTAS_LENTAS_MAX = 50
+_SENTENCIAS_CON_PLAN = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# Medición de la ejecución en curso y filas escritas, por hilo: Streamlit
+# corre cada ejecución del script en su propio hilo.
+_hilo = threading.local()
+
+
+class EstadisticasFunciones:
+    def __init__(self):
+        # nombre -> [llamadas, segundos, máximo, filas]
+        self.por_funcion: Dict[str, list] = {}
+
+    def registrar(self, nombre: str, segundos: float, filas: int):
+        e = self.por_funcion.setdefault(nombre, [0, 0.0, 0.0, 0])
+        e[0] += 1
+        e[1] += segundos
+        e[2] = max(e[2], segundos)
+        e[3] += filas
+
+    def tabla(self) -> pd.DataFrame:
+        df = pd.DataFrame(
+            [(nombre, *e) for nombre, e in self.por_funcion.items()],
+            columns=["funcion", "llamadas", "total_ms", "max_ms", "filas"],
+        )
+        df["total_ms"] *= 1000
+        df["max_ms"] *= 1000
+        df.insert(3, "media_ms", df["total_ms"] / df["llamadas"].clip(lower=1))
+        return df.sort_values("total_ms", ascending=False, ignore_index=True).round(2)
+
+
+class MedicionCorrida:
+    """Lo medido durante una ejecución del script."""
+
+    def __init__(self):
+        self.inicio = perf_counter()
+        self.duracion: Optional[float] = None
+        self.funciones = EstadisticasFunciones()
+        self.consultas = 0
+        self.segundos_sql = 0.0
+
+    def terminar(self):
+        self.duracion = perf_counter() - self.inicio
+
+
+class Perfil:
+    """Estadísticas acumuladas del proceso, compartidas por todas las sesiones."""
+
+    def __init__(self, activo: bool):
+        self.activo = activo
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.funciones = EstadisticasFunciones()
+            self.consultas = 0
+            self.segundos_sql = 0.0
+            self.consultas_lentas: "deque[Dict[str, Any]]" = deque(maxlen=CONSULTAS_LENTAS_MAX)
+
+    def registrar_funcion(self, nombre: str, segundos: float, filas: int):
+        with self._lock:
+            self.funciones.registrar(nombre, segundos, filas)
+        corrida = getattr(_hilo, "corrida", None)
+        if corrida is not None:
+            corrida.funciones.registrar(nombre, segundos, filas)
+
+    def registrar_consulta(self, conn: sqlite3.Connection, sql: str, parametros: Any, segundos: float):
+        lenta = None
+        if segundos * 1000 >= CONSULTA_LENTA_MS:
+            lenta = {
+                "momento": datetime.now(),
+                "ms": segundos * 1000,
+                "sql": " ".join(sql.split()),
+                "plan": _plan_consulta(conn, sql, parametros) if parametros is not None else "",
+            }
+            logger.warning(
+                "Consulta lenta (%.1f ms): %s\nEXPLAIN QUERY PLAN:\n%s", lenta["ms"], lenta["sql"], lenta["plan"]
+            )
+        with self._lock:
+            self.consultas += 1
+            self.segundos_sql += segundos
+            if lenta is not None:
+                self.consultas_lentas.append(lenta)
+        corrida = getattr(_hilo, "corrida", None)
+        if corrida is not None:
+            corrida.consultas += 1
+            corrida.segundos_sql += segundos
+
+    def tabla_funciones(self) -> pd.DataFrame:
+        with self._lock:
+            return self.funciones.tabla()
+
+    def ultimas_consultas_lentas(self) -> list[Dict[str, Any]]:
+        with self._lock:
+            return list(reversed(self.consultas_lentas))
+
+
+@recurso_compartido
+def obtener_perfil() -> Perfil:
+    return Perfil(activo=os.environ.get("INSTRUMENTOS_PERFIL") == "1")
+
+
+def activar_perfil(activo: bool):
+    obtener_perfil().activo = activo
+
+
+def iniciar_corrida() -> Optional[MedicionCorrida]:
+    """Empieza a medir una ejecución del script (si el perfilado está activo)."""
+    _hilo.corrida = MedicionCorrida() if obtener_perfil().activo else None
+    return _hilo.corrida
+
+
+def terminar_corrida() -> Optional[MedicionCorrida]:
+    corrida = getattr(_hilo, "corrida", None)
+    _hilo.corrida = None
+    if corrida is not None:
+        corrida.terminar()
+    return corrida
+
+
+def _plan_consulta(conn: sqlite3.Connection, sql: str, parametros: Any) -> str:
+    if not sql.lstrip().upper().startswith(_SENTENCIAS_CON_PLAN):
+        return ""
+    try:
+        # Cursor base: el plan no se mide ni se registra a sí mismo
+        filas = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parametros).fetchall()
+    except sqlite3.Error as e:
+        return f"(no se pudo obtener el plan: {e})"
+    # Cada fila es (id, padre, no usado, detalle); se indenta según el árbol
+    nivel = {0: -1}
+    lineas = []
+    for id_nodo, padre, _, detalle in filas:
+        nivel[id_nodo] = nivel.get(padre, -1) + 1
+        lineas.append("  " * nivel[id_nodo] + detalle)
+    return "\n".join(lineas)
+
+
+def _contar_filas(resultado: Any) -> Optional[int]:
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], pd.DataFrame):
+        resultado = resultado[0]  # (página, total, cursor)
+    if isinstance(resultado, (pd.DataFrame, list)):
+        return len(resultado)
+    if isinstance(resultado, (dict, int)):
+        return 1
+    return None
+
+
+def perfilado(func: F) -> F:
+    """Mide llamadas, tiempo y filas (las escritas o, si no escribió, las devueltas)."""
+    nombre = func.__name__
+
+    @wraps(func)
+    def envoltura(*args, **kwargs):
+        perfil = obtener_perfil()
+        if not perfil.activo:
+            return func(*args, **kwargs)
+        escritas = getattr(_hilo, "filas_escritas", 0)
+        resultado = None
+        t0 = perf_counter()
+        try:
+            resultado = func(*args, **kwargs)
+            return resultado
+        finally:
+            filas = getattr(_hilo, "filas_escritas", 0) - escritas
+            if not filas:
+                filas = _contar_filas(resultado) or 0
+            perfil.registrar_funcion(nombre, perf_counter() - t0, filas)
+    return envoltura  # type: ignore[return-value]
+
+
+class CursorPerfilado(sqlite3.Cursor):
+    """Mide cada sentencia desde execute hasta que se terminan de leer sus filas."""
+
+    # [sql, parámetros, segundos] de la sentencia en curso
+    _pendiente: Optional[list] = None
+
+    def execute(self, sql: str, parametros: Any = ()):
+        self._cerrar_medicion()
+        if not obtener_perfil().activo:
+            return super().execute(sql, parametros)
+        t0 = perf_counter()
+        super().execute(sql, parametros)
+        self._pendiente = [sql, parametros, perf_counter() - t0]
+        if self.description is None:
+            # No devuelve filas (escrituras, BEGIN, PRAGMA de asignación)
+            self._cerrar_medicion()
+        return self
+
+    def executemany(self, sql: str, secuencia: Iterable):
+        self._cerrar_medicion()
+        if not obtener_perfil().activo:
+            return super().executemany(sql, secuencia)
+        t0 = perf_counter()
+        super().executemany(sql, secuencia)
+        # Sin parámetros sueltos no se puede pedir el plan
+        self._pendiente = [sql, None, perf_counter() - t0]
+        self._cerrar_medicion()
+        return self
+
+    def _medir_lectura(self, leer: Callable, *args):
+        if self._pendiente is None:
+            return leer(*args)
+        t0 = perf_counter()
+        try:
+            return leer(*args)
+        finally:
+            self._pendiente[2] += perf_counter() - t0
+
+    def fetchone(self):
+        fila = self._medir_lectura(super().fetchone)
+        self._cerrar_medicion()
+        return fila
+
+    def fetchmany(self, size: Optional[int] = None):
+        size = self.arraysize if size is None else size
+        filas = self._medir_lectura(super().fetchmany, size)
+        if len(filas) < size:
+            self._cerrar_medicion()
+        return filas
+
+    def fetchall(self):
+        filas = self._medir_lectura(super().fetchall)
+        self._cerrar_medicion()
+        return filas
+
+    def __next__(self):
+        try:
+            return self._medir_lectura(super().__next__)
+        except StopIteration:
+            self._cerrar_medicion()
+            raise
+
+    def close(self):
+        self._cerrar_medicion()
+        super().close()
+
+    def __del__(self):
+        # Cursores descartados sin leer todas sus filas
+        self._cerrar_medicion()
+
+    def _cerrar_medicion(self):
+        if self._pendiente is None:
+            return
+        sql, parametros, segundos = self._pendiente
+        self._pendiente = None
+        if self.rowcount > 0:
+            _hilo.filas_escritas = getattr(_hilo, "filas_escritas", 0) + self.rowcount
+        obtener_perfil().registrar_consulta(self.connection, sql, parametros, segundos)
+
+
+class ConexionPerfilada(sqlite3.Connection):
+    """Conexión cuyos cursores (también los de pandas) pasan por CursorPerfilado."""
+
+    def cursor(self, factory=CursorPerfilado):
+        return super().cursor(factory)
+
+    # Connection.execute de sqlite3 no pasa por cursor(): se redirige a mano
+    def execute(self, sql: str, parametros: Any = ()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql: str, secuencia: Iterable):
+        return self.cursor().executemany(sql, secuencia)
+
+
+# ==============================
+# Pool de conexiones SQLite
+# ==============================
+# Cantidad máxima de conexiones ociosas que se guardan para reutilizar
+POOL_MAX_CONEXIONES = 8
+# Milisegundos que una conexión espera el lock de escritura antes de fallar
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+class PoolConexiones:
+    """Pool thread-safe de conexiones SQLite configuradas en modo WAL."""
+
+    def __init__(self, db_path: Path, max_conexiones: int = POOL_MAX_CONEXIONES):
+        self.db_path = str(db_path)
+        self._libres: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=max_conexiones)
+
+    def _nueva_conexion(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=ConexionPerfilada,
+        )
+        # Sólo tiene efecto en una base nueva, y antes de pasarla a WAL; las
+        # existentes se convierten con "mantenimiento_instrumentos.py vacuum --convertir"
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL: los lectores no bloquean al escritor ni viceversa
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        # En WAL, NORMAL es seguro ante caídas de la app y evita un fsync por commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")  # ~16 MB de caché de páginas
+        conn.execute("PRAGMA mmap_size=134217728")  # 128 MB
+        return conn
+
+    @contextmanager
+    def conexion(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._libres.get_nowait()
+        except queue.Empty:
+            conn = self._nueva_conexion()
+
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._libres.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def cerrar(self):
+        while True:
+            try:
+                self._libres.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+@recurso_compartido
+def obtener_pool() -> PoolConexiones:
+    # Un único pool por proceso, compartido por todas las sesiones
+    return PoolConexiones(DB_PATH)
+
+
+def conexion():
+    conn = getattr(_escritura, "conexion", None)
+    if conn is not None:
+        # Dentro de un lote del escritor: la transacción (y el commit) es del lote
+        return nullcontext(conn)
+    return obtener_pool().conexion()
+
+
+# ==============================
+# Escritor único
+# ==============================
+# Las escrituras interactivas (reservas, altas y ediciones) no abren su propia
+# transacción: se encolan y un único hilo las ejecuta en lotes. Cada pedido
+# corre dentro de un SAVEPOINT, así un error (p. ej. ReservaSolapada) sólo
+# deshace ese pedido, y el lote entero se confirma con un solo COMMIT (group
+# commit). Mientras se confirma un lote, los pedidos nuevos se acumulan y van
+# juntos en el siguiente. Quien llama recibe el resultado o la excepción recién
+# después del COMMIT. Las tareas masivas (importación, archivo, replicación)
+# siguen manejando sus propias transacciones.
+ESCRITOR_UNICO = os.environ.get("INSTRUMENTOS_ESCRITOR_UNICO", "1") != "0"
+ESCRITOR_MAX_LOTE = 64
+ESCRITOR_MUESTRAS = 1000
+
+_escritura = threading.local()
+
+
+class PedidoEscritura:
+    def __init__(self, func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.futuro: Future = Future()
+        self.encolado = perf_counter()
+
+
+class MetricasEscritor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pedidos = 0
+        self.errores = 0
+        self.lotes = 0
+        self.commits_fallidos = 0
+        self.esperas_ms: deque = deque(maxlen=ESCRITOR_MUESTRAS)
+        self.commits_ms: deque = deque(maxlen=ESCRITOR_MUESTRAS)
+        self.tamanos_lote: deque = deque(maxlen=ESCRITOR_MUESTRAS)
+
+    def registrar_lote(self, esperas_ms: list[float], commit_ms: Optional[float], errores: int):
+        with self._lock:
+            self.lotes += 1
+            self.pedidos += len(esperas_ms)
+            self.errores += errores
+            self.esperas_ms.extend(esperas_ms)
+            self.tamanos_lote.append(len(esperas_ms))
+            if commit_ms is None:
+                self.commits_fallidos += 1
+            else:
+                self.commits_ms.append(commit_ms)
+
+    def resumen(self) -> Dict[str, Any]:
+        with self._lock:
+            esperas = np.array(self.esperas_ms) if self.esperas_ms else np.zeros(1)
+            commits = np.array(self.commits_ms) if self.commits_ms else np.zeros(1)
+            return {
+                "pedidos": self.pedidos,
+                "lotes": self.lotes,
+                "pedidos_por_lote": round(float(np.mean(self.tamanos_lote)), 2) if self.tamanos_lote else 0.0,
+                "errores": self.errores,
+                "commits_fallidos": self.commits_fallidos,
+                "espera_p50_ms": round(float(np.percentile(esperas, 50)), 2),
+                "espera_p95_ms": round(float(np.percentile(esperas, 95)), 2),
+                "commit_p50_ms": round(float(np.percentile(commits, 50)), 2),
+                "commit_p95_ms": round(float(np.percentile(commits, 95)), 2),
+                "commit_max_ms": round(float(commits.max()), 2),
+            }
+
+
+class EscritorUnico:
+    """Hilo que ejecuta las escrituras encoladas agrupándolas en transacciones cortas."""
+
+    def __init__(self, max_lote: int = ESCRITOR_MAX_LOTE):
+        self.max_lote = max_lote
+        self.metricas = MetricasEscritor()
+        self._cola: "queue.Queue[PedidoEscritura]" = queue.Queue()
+        self._hilo = threading.Thread(target=self._ciclo, name="escritor", daemon=True)
+        self._hilo.start()
+
+    def profundidad(self) -> int:
+        return self._cola.qsize()
+
+    def ejecutar(self, func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        if threading.current_thread() is self._hilo:
+            # Una escritura encolada que llama a otra: ya está dentro del lote
+            return func(*args, **kwargs)
+        pedido = PedidoEscritura(func, args, kwargs)
+        self._cola.put(pedido)
+        return pedido.futuro.result()
+
+    def _ciclo(self):
+        conn = obtener_pool()._nueva_conexion()
+        while True:
+            lote = [self._cola.get()]
+            while len(lote) < self.max_lote:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._ejecutar_lote(conn, lote)
+            except BaseException as e:
+                # Que ningún pedido quede esperando para siempre
+                logger.exception("Falló un lote del escritor")
+                for pedido in lote:
+                    if not pedido.futuro.done():
+                        pedido.futuro.set_exception(e)
+                if conn.in_transaction:
+                    conn.rollback()
+
+    def _ejecutar_lote(self, conn: sqlite3.Connection, lote: list[PedidoEscritura]):
+        conn.execute("BEGIN IMMEDIATE")
+        esperas_ms = []
+        hechos: list[tuple[PedidoEscritura, Any, list[Callable[[], Any]]]] = []
+        errores = 0
+        for pedido in lote:
+            esperas_ms.append((perf_counter() - pedido.encolado) * 1000)
+            _escritura.conexion = conn
+            _escritura.pendientes = []
+            conn.execute("SAVEPOINT pedido")
+            try:
+                resultado = pedido.func(*pedido.args, **pedido.kwargs)
+            except Exception as e:
+                conn.execute("ROLLBACK TO pedido")
+                conn.execute("RELEASE pedido")
+                pedido.futuro.set_exception(e)
+                errores += 1
+            else:
+                conn.execute("RELEASE pedido")
+                hechos.append((pedido, resultado, _escritura.pendientes))
+            finally:
+                _escritura.conexion = None
+                _escritura.pendientes = None
+
+        inicio = perf_counter()
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.metricas.registrar_lote(esperas_ms, None, errores + len(hechos))
+            for pedido, _resultado, _pendientes in hechos:
+                pedido.futuro.set_exception(e)
+            return
+        self.metricas.registrar_lote(esperas_ms, (perf_counter() - inicio) * 1000, errores)
+
+        for pedido, resultado, pendientes in hechos:
+            for accion in pendientes:
+                try:
+                    accion()
+                except Exception:
+                    logger.exception("Falló una acción posterior al commit")
+            pedido.futuro.set_result(resultado)
+
+
+@recurso_compartido
+def obtener_escritor() -> EscritorUnico:
+    return EscritorUnico()
+
+
+def encolar_escritura(func: F) -> F:
+    """Marca una escritura interactiva: se ejecuta en el escritor único (si está activo)."""
+    @wraps(func)
+    def envoltura(*args, **kwargs):
+        if not ESCRITOR_UNICO:
+            return func(*args, **kwargs)
+        return obtener_escritor().ejecutar(func, args, kwargs)
+    return envoltura  # type: ignore[return-value]
+
+
+def despues_de_confirmar(accion: Callable[[], Any]):
+    """Ejecuta `accion` cuando la escritura en curso quedó confirmada."""
+    pendientes = getattr(_escritura, "pendientes", None)
+    if pendientes is None:
+        accion()
+    else:
+        pendientes.append(accion)
+
+
+def metricas_escritor() -> Dict[str, Any]:
+    """Profundidad de la cola y latencias del escritor único."""
+    if not ESCRITOR_UNICO:
+        return {"activo": False}
+    escritor = obtener_escritor()
+    return {"activo": True, "profundidad_cola": escritor.profundidad(), **escritor.metricas.resumen()}
+
+
+def _iniciar_escritura(conn: sqlite3.Connection):
+    # Lock de escritura desde el principio; dentro de un lote del escritor la
+    # transacción ya está abierta
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+# ==============================
+# Caché de lecturas
+# ==============================
+# Las lecturas cacheadas reciben la versión de los datos como primer argumento.
+# Las funciones de escritura la incrementan al terminar y, además, la versión
+# sigue a PRAGMA data_version, que cambia cuando otra conexión (de este u otro
+# proceso, p. ej. la app y la API) confirma cambios en la base. Así cualquier
+# escritura deja obsoletas las entradas previas.
+CACHE_TTL_SEGUNDOS = 600
+CACHE_MAX_ENTRADAS = 256
+
+
+class VersionDatos:
+    def __init__(self, db_path: Path):
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self.valor = 0
+
+    def incrementar(self):
+        with self._lock:
+            self.valor += 1
+
+    def actual(self) -> int:
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                if self._data_version is not None:
+                    self.valor += 1
+                self._data_version = data_version
+            return self.valor
+
+
+@recurso_compartido
+def _version_datos() -> VersionDatos:
+    return VersionDatos(DB_PATH)
+
+
+def version_datos() -> int:
+    return _version_datos().actual()
+
+
+def modifica_datos(func: F) -> F:
+    """Marca una función de escritura: al terminar bien invalida la caché de lecturas."""
+    @wraps(func)
+    def envoltura(*args, **kwargs):
+        resultado = func(*args, **kwargs)
+        _version_datos().incrementar()
+        return resultado
+    return envoltura  # type: ignore[return-value]
+
+
+def _copia(valor: Any) -> Any:
+    # Como st.cache_data: quien llama puede modificar lo que recibe sin
+    # alterar lo guardado en la caché
+    if isinstance(valor, pd.DataFrame):
+        return valor.copy()
+    if isinstance(valor, tuple):
+        return tuple(_copia(v) for v in valor)
+    return valor
+
+
+def cache_lecturas(func: F) -> F:
+    """Caché LRU con vencimiento (CACHE_TTL_SEGUNDOS), segura entre hilos."""
+    lock = threading.Lock()
+    entradas: "OrderedDict[tuple, tuple[float, Any]]" = OrderedDict()
+
+    @wraps(func)
+    def envoltura(*args, **kwargs):
+        clave = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            entrada = entradas.get(clave)
+            if entrada is not None and monotonic() - entrada[0] < CACHE_TTL_SEGUNDOS:
+                entradas.move_to_end(clave)
+                return _copia(entrada[1])
+
+        resultado = func(*args, **kwargs)
+        with lock:
+            entradas[clave] = (monotonic(), resultado)
+            entradas.move_to_end(clave)
+            while len(entradas) > CACHE_MAX_ENTRADAS:
+                entradas.popitem(last=False)
+        return _copia(resultado)
+
+    envoltura.clear = entradas.clear  # type: ignore[attr-defined]
+    return envoltura  # type: ignore[return-value]
+
+
+# ==============================
+# Funciones de base de datos
+# ==============================
+@perfilado
+def init_db():
+    IMAGES_DIR.mkdir(exist_ok=True)
+    with conexion() as conn:
+        aplicar_migraciones(conn)
+
+
+# ---------- Fechas ----------
+# Las fechas se guardan como INTEGER: segundos desde epoch (UTC), así los
+# rangos, solapamientos y ordenamientos comparan enteros. Hacia la UI y las
+# exportaciones se muestran en la hora local del servidor (variable TZ), la
+# misma que usa SQLite con el modificador 'localtime'.
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+COLUMNAS_FECHA = {"fecha_registro", "fecha_inicio", "fecha_fin", "fecha_archivado"}
+COLUMNAS_ENTERAS_NULABLES = {"serie_id"}
+
+COLUMNAS_INSTRUMENTOS = [
+    "id",
+    "grupo_unidad",
+    "responsable",
+    "investigador_grupo",
+    "instrumento",
+    "numero_inventario",
+    "reserva_uso",
+    "estado",
+    "ubicacion",
+    "descripcion",
+    "foto_path",
+    "fecha_registro",
+]
+COLUMNAS_RESERVAS = [
+    "id",
+    "instrumento_id",
+    "usuario",
+    "fecha_inicio",
+    "fecha_fin",
+    "comentario",
+    "estado",
+    "fecha_registro",
+]
+
+
+def a_epoch(valor: datetime) -> int:
+    """datetime sin zona (hora local) o con zona -> segundos desde epoch."""
+    if isinstance(valor, pd.Timestamp):
+        # Timestamp.timestamp() tomaría un valor sin zona como UTC
+        valor = valor.to_pydatetime()
+    return int(valor.timestamp())
+
+
+def desde_epoch(valor: Optional[float]) -> Optional[datetime]:
+    return None if valor is None or pd.isna(valor) else datetime.fromtimestamp(valor)
+
+
+def ahora_epoch() -> int:
+    return a_epoch(datetime.now())
+
+
+def columnas_legibles(alias: str, columnas: list[str]) -> str:
+    """Lista de SELECT con las fechas convertidas a texto en hora local."""
+    return ", ".join(
+        f"datetime({alias}.{c}, 'unixepoch', 'localtime') AS {c}" if c in COLUMNAS_FECHA else f"{alias}.{c}"
+        for c in columnas
+    )
+
+
+def _enteros_nulables(df: pd.DataFrame) -> pd.DataFrame:
+    # Sin esto pandas lee como float una columna entera con faltantes
+    for c in COLUMNAS_ENTERAS_NULABLES.intersection(df.columns):
+        df[c] = df[c].astype("Int64")
+    return df
+
+
+def _tipar_columnas(df: pd.DataFrame) -> pd.DataFrame:
+    # Convierte las columnas leídas con columnas_legibles() a datetime64
+    for c in COLUMNAS_FECHA.intersection(df.columns):
+        df[c] = pd.to_datetime(df[c], format=FORMATO_FECHA)
+    return _enteros_nulables(df)
+
+
+def _fila_tipada(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    fila = dict(row)
+    for c in COLUMNAS_FECHA.intersection(fila):
+        fila[c] = desde_epoch(fila[c])
+    return fila
+
+
+# ---------- Migraciones de esquema ----------
+# Cada migración lleva la base de la versión N-1 a la N. La versión aplicada
+# se guarda en PRAGMA user_version, así que nunca se modifican migraciones ya
+# publicadas: los cambios nuevos se agregan al final de MIGRACIONES.
+def _migracion_tablas_base(conn: sqlite3.Connection):
+    cur = conn.cursor()
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS instrumentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            grupo_unidad TEXT,
+            responsable TEXT,
+            investigador_grupo TEXT NOT NULL,
+            instrumento TEXT NOT NULL,
+            numero_inventario TEXT,
+            reserva_uso TEXT,
+            estado TEXT,
+            ubicacion TEXT,
+            descripcion TEXT,
+            foto_path TEXT,
+            fecha_registro TEXT
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reservas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instrumento_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            fecha_inicio TEXT NOT NULL,
+            fecha_fin TEXT NOT NULL,
+            comentario TEXT,
+            estado TEXT,
+            fecha_registro TEXT,
+            FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+        )
+        """
+    )
+
+
+def _migracion_indices(conn: sqlite3.Connection):
+    # Listado de reservas por instrumento ordenado por fecha y borrado por
+    # instrumento: el índice incluye fecha_fin y estado para que el conteo y
+    # los chequeos por rango se resuelvan sin leer la tabla.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_instrumento_inicio
+        ON reservas(instrumento_id, fecha_inicio, fecha_fin, estado)
+        """
+    )
+    # Listado de todas las reservas (ORDER BY fecha_inicio DESC)
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_inicio
+        ON reservas(fecha_inicio)
+        """
+    )
+    # Columnas por las que se filtra y ordena el inventario
+    for columna in ("grupo_unidad", "investigador_grupo", "instrumento"):
+        conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_instrumentos_{columna}
+            ON instrumentos({columna} COLLATE NOCASE)
+            """
+        )
+    conn.execute("ANALYZE")
+
+
+def _migracion_indice_solapamientos(conn: sqlite3.Connection):
+    # Chequeo de solapamientos: el rango fecha_fin > inicio_nuevo sólo recorre
+    # las reservas que terminan después del inicio pedido, no todo el historial.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_instrumento_fin
+        ON reservas(instrumento_id, fecha_fin, fecha_inicio, estado)
+        """
+    )
+
+
+# Columnas del inventario indexadas para búsqueda de texto completo
+COLUMNAS_FTS = [
+    "instrumento",
+    "investigador_grupo",
+    "grupo_unidad",
+    "ubicacion",
+    "descripcion",
+    "numero_inventario",
+]
+
+
+def _migracion_busqueda_fts(conn: sqlite3.Connection):
+    columnas = ", ".join(COLUMNAS_FTS)
+    nuevos = ", ".join(f"new.{c}" for c in COLUMNAS_FTS)
+    viejos = ", ".join(f"old.{c}" for c in COLUMNAS_FTS)
+
+    # Tabla FTS de contenido externo: guarda sólo el índice y lee el texto
+    # de instrumentos. remove_diacritics hace que "calibracion" encuentre
+    # "calibración"; prefix acelera las búsquedas mientras se escribe.
+    conn.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS instrumentos_fts USING fts5(
+            {columnas},
+            content='instrumentos',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS instrumentos_fts_ai AFTER INSERT ON instrumentos BEGIN
+            INSERT INTO instrumentos_fts(rowid, {columnas}) VALUES (new.id, {nuevos});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS instrumentos_fts_ad AFTER DELETE ON instrumentos BEGIN
+            INSERT INTO instrumentos_fts(instrumentos_fts, rowid, {columnas})
+            VALUES ('delete', old.id, {viejos});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS instrumentos_fts_au AFTER UPDATE ON instrumentos BEGIN
+            INSERT INTO instrumentos_fts(instrumentos_fts, rowid, {columnas})
+            VALUES ('delete', old.id, {viejos});
+            INSERT INTO instrumentos_fts(rowid, {columnas}) VALUES (new.id, {nuevos});
+        END
+        """
+    )
+    conn.execute("INSERT INTO instrumentos_fts(instrumentos_fts) VALUES ('rebuild')")
+
+
+def _migracion_indice_fotos(conn: sqlite3.Connection):
+    # Saber si otro instrumento comparte la foto antes de borrar el archivo
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_instrumentos_foto_path
+        ON instrumentos(foto_path)
+        """
+    )
+
+
+def _migracion_indice_fin_reservas(conn: sqlite3.Connection):
+    # Reservas que tocan una ventana de fechas de todos los instrumentos: el
+    # rango fecha_fin > desde deja afuera todo el historial ya terminado.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_fin
+        ON reservas(fecha_fin)
+        """
+    )
+
+
+def _migracion_uso_diario(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS uso_diario (
+            dia TEXT NOT NULL,
+            instrumento_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            horas REAL NOT NULL,
+            reservas INTEGER NOT NULL,
+            PRIMARY KEY (dia, instrumento_id, usuario, estado)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_uso_diario_instrumento
+        ON uso_diario(instrumento_id, dia)
+        """
+    )
+    _recalcular_uso_diario(conn)
+
+
+def _reconstruir_tabla(conn: sqlite3.Connection, tabla: str, definicion: str):
+    # SQLite no cambia el tipo de una columna: se crea la tabla nueva, se copian
+    # las filas convirtiendo las fechas de texto (hora local) a epoch, y se
+    # reemplaza la vieja recreando sus índices y triggers.
+    objetos = [
+        sql
+        for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (tabla,),
+        )
+    ]
+    secuencia = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (tabla,)).fetchone()
+    columnas = [row[1] for row in conn.execute(f"PRAGMA table_info({tabla})")]
+    seleccion = ", ".join(
+        f"CAST(strftime('%s', {c}, 'utc') AS INTEGER)" if c in COLUMNAS_FECHA else c
+        for c in columnas
+    )
+
+    conn.execute(f"CREATE TABLE {tabla}_nueva ({definicion})")
+    conn.execute(f"INSERT INTO {tabla}_nueva ({', '.join(columnas)}) SELECT {seleccion} FROM {tabla}")
+    conn.execute(f"DROP TABLE {tabla}")
+    conn.execute(f"ALTER TABLE {tabla}_nueva RENAME TO {tabla}")
+    for sql in objetos:
+        conn.execute(sql)
+    if secuencia is not None:
+        # Que AUTOINCREMENT no reutilice ids de filas ya borradas
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (tabla,))
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (tabla, secuencia[0]))
+
+
+def _migracion_fechas_epoch(conn: sqlite3.Connection):
+    _reconstruir_tabla(
+        conn,
+        "instrumentos",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        grupo_unidad TEXT,
+        responsable TEXT,
+        investigador_grupo TEXT NOT NULL,
+        instrumento TEXT NOT NULL,
+        numero_inventario TEXT,
+        reserva_uso TEXT,
+        estado TEXT,
+        ubicacion TEXT,
+        descripcion TEXT,
+        foto_path TEXT,
+        fecha_registro INTEGER
+        """,
+    )
+    _reconstruir_tabla(
+        conn,
+        "reservas",
+        """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        instrumento_id INTEGER NOT NULL,
+        usuario TEXT NOT NULL,
+        fecha_inicio INTEGER NOT NULL,
+        fecha_fin INTEGER NOT NULL,
+        comentario TEXT,
+        estado TEXT,
+        fecha_registro INTEGER,
+        FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+        """,
+    )
+
+    # Vistas con las fechas legibles, para exportaciones y consultas a mano
+    conn.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS instrumentos_legible AS
+        SELECT {columnas_legibles("i", COLUMNAS_INSTRUMENTOS)} FROM instrumentos i
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS reservas_legible AS
+        SELECT {columnas_legibles("r", COLUMNAS_RESERVAS)} FROM reservas r
+        """
+    )
+    conn.execute("ANALYZE")
+
+
+def _migracion_series_reserva(conn: sqlite3.Connection):
+    # Reglas de reservas recurrentes; cada ocurrencia es una fila normal de
+    # reservas que apunta a su serie con serie_id.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS series_reserva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instrumento_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            frecuencia TEXT NOT NULL,
+            intervalo INTEGER NOT NULL DEFAULT 1,
+            dias_semana TEXT,
+            fecha_inicio INTEGER NOT NULL,
+            fecha_fin INTEGER NOT NULL,
+            hasta TEXT NOT NULL,
+            excepciones TEXT,
+            comentario TEXT,
+            estado TEXT,
+            fecha_registro INTEGER,
+            FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+        )
+        """
+    )
+    conn.execute("ALTER TABLE reservas ADD COLUMN serie_id INTEGER REFERENCES series_reserva(id)")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_serie
+        ON reservas(serie_id, fecha_inicio) WHERE serie_id IS NOT NULL
+        """
+    )
+    conn.execute("DROP VIEW IF EXISTS reservas_legible")
+    conn.execute(
+        f"""
+        CREATE VIEW reservas_legible AS
+        SELECT {columnas_legibles("r", COLUMNAS_RESERVAS + ["serie_id"])} FROM reservas r
+        """
+    )
+
+
+def _migracion_archivo_reservas(conn: sqlite3.Connection):
+    # Reservas viejas o canceladas que se sacan de la tabla de trabajo. Conservan
+    # su id (AUTOINCREMENT en reservas evita que se reutilice).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reservas_archivo (
+            id INTEGER PRIMARY KEY,
+            instrumento_id INTEGER NOT NULL,
+            usuario TEXT NOT NULL,
+            fecha_inicio INTEGER NOT NULL,
+            fecha_fin INTEGER NOT NULL,
+            comentario TEXT,
+            estado TEXT,
+            fecha_registro INTEGER,
+            serie_id INTEGER,
+            fecha_archivado INTEGER NOT NULL,
+            FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_archivo_instrumento
+        ON reservas_archivo(instrumento_id, fecha_inicio)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_archivo_inicio
+        ON reservas_archivo(fecha_inicio)
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_archivo_serie
+        ON reservas_archivo(serie_id) WHERE serie_id IS NOT NULL
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS reservas_archivo_legible AS
+        SELECT {columnas_legibles("r", COLUMNAS_RESERVAS + ["serie_id", "fecha_archivado"])}
+        FROM reservas_archivo r
+        """
+    )
+
+
+# Tablas que se copian a las réplicas, en el orden en que se aplican
+TABLAS_REPLICADAS = ["instrumentos", "series_reserva", "reservas", "reservas_archivo"]
+
+
+def _json_fila(conn: sqlite3.Connection, tabla: str, alias: str) -> str:
+    columnas = [row[1] for row in conn.execute(f"PRAGMA table_info({tabla})")]
+    return "json_object(" + ", ".join(f"'{c}', {alias}.{c}" for c in columnas) + ")"
+
+
+def _migracion_registro_cambios(conn: sqlite3.Connection):
+    # Registro de cambios para replicar la base de a poco: los triggers anotan
+    # cada alta, modificación y baja con un número de secuencia creciente.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metadatos (
+            clave TEXT PRIMARY KEY,
+            valor TEXT
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO metadatos (clave, valor) VALUES ('origen', ?)", (uuid.uuid4().hex,))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla TEXT NOT NULL,
+            operacion TEXT NOT NULL,
+            fila_id INTEGER NOT NULL,
+            datos TEXT,
+            fecha INTEGER NOT NULL
+        )
+        """
+    )
+
+    ahora = "CAST(strftime('%s', 'now') AS INTEGER)"
+    # Mientras se aplican cambios de otra base no se anotan de nuevo: se
+    # copian tal cual, con su número de secuencia
+    cuando = "WHEN NOT EXISTS (SELECT 1 FROM metadatos WHERE clave = 'aplicando_cambios')"
+    for tabla in TABLAS_REPLICADAS:
+        nuevos = _json_fila(conn, tabla, "new")
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {tabla}_cambios_ai AFTER INSERT ON {tabla} {cuando} BEGIN
+                INSERT INTO cambios (tabla, operacion, fila_id, datos, fecha)
+                VALUES ('{tabla}', 'I', new.id, {nuevos}, {ahora});
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {tabla}_cambios_au AFTER UPDATE ON {tabla} {cuando} BEGIN
+                INSERT INTO cambios (tabla, operacion, fila_id, datos, fecha)
+                VALUES ('{tabla}', 'U', new.id, {nuevos}, {ahora});
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {tabla}_cambios_ad AFTER DELETE ON {tabla} {cuando} BEGIN
+                INSERT INTO cambios (tabla, operacion, fila_id, datos, fecha)
+                VALUES ('{tabla}', 'D', old.id, NULL, {ahora});
+            END
+            """
+        )
+
+    # Las filas que ya existían entran como altas: exportar desde 0 arma una
+    # réplica completa
+    for tabla in TABLAS_REPLICADAS:
+        conn.execute(
+            f"""
+            INSERT INTO cambios (tabla, operacion, fila_id, datos, fecha)
+            SELECT '{tabla}', 'I', t.id, {_json_fila(conn, tabla, "t")}, {ahora}
+            FROM {tabla} t ORDER BY t.id
+            """
+        )
+
+
+def _migracion_indice_canceladas(conn: sqlite3.Connection):
+    # Canceladas todavía no terminadas, para contar lo archivable sin
+    # recorrer la tabla: las demás entran por idx_reservas_fin.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reservas_canceladas
+        ON reservas(fecha_fin) WHERE estado = 'Cancelada'
+        """
+    )
+
+
+MIGRACIONES = [
+    (1, _migracion_tablas_base),
+    (2, _migracion_indices),
+    (3, _migracion_indice_solapamientos),
+    (4, _migracion_busqueda_fts),
+    (5, _migracion_indice_fotos),
+    (6, _migracion_indice_fin_reservas),
+    (7, _migracion_uso_diario),
+    (8, _migracion_fechas_epoch),
+    (9, _migracion_series_reserva),
+    (10, _migracion_archivo_reservas),
+    (11, _migracion_registro_cambios),
+    (12, _migracion_indice_canceladas),
+]
+ESQUEMA_VERSION = MIGRACIONES[-1][0]
+
+
+def version_esquema(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def aplicar_migraciones(conn: sqlite3.Connection):
+    actual = version_esquema(conn)
+    if actual == ESQUEMA_VERSION:
+        # Caso habitual en cada rerun: una sola consulta
+        return
+    if actual > ESQUEMA_VERSION:
+        raise RuntimeError(
+            f"La base {DB_PATH.name} tiene versión de esquema {actual}, "
+            f"más nueva que la que soporta esta aplicación ({ESQUEMA_VERSION})."
+        )
+
+    for version, migracion in MIGRACIONES:
+        if version_esquema(conn) >= version:
+            continue
+        # BEGIN IMMEDIATE toma el lock de escritura antes de releer la versión,
+        # así dos procesos que arrancan a la vez no aplican la misma migración.
+        conn.execute("BEGIN IMMEDIATE")
+        if version_esquema(conn) >= version:
+            conn.rollback()
+            continue
+        migracion(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+
+
+# ---------- Fotos ----------
+# Las fotos se guardan recomprimidas en WebP con el lado mayor acotado y se
+# nombran por el hash SHA-256 del archivo subido: la misma foto subida dos
+# veces se almacena una sola vez. El decodificado y la recompresión corren en
+# un pool de hilos para no demorar el rerun que guarda el formulario.
+FOTO_MAX_LADO = 1600
+FOTO_CALIDAD_WEBP = 80
+FOTO_BLOQUE_BYTES = 1 << 20
+FOTO_WORKERS = 2
+EXTENSIONES_FOTO = [".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp"]
+_PATRON_FOTO_OPTIMIZADA = re.compile(r"^[0-9a-f]{32}\.webp$")
+# Una foto recién subida todavía no tiene su fila en instrumentos (o la
+# transacción no confirmó): no se la considera huérfana hasta pasado este lapso.
+FOTOS_HUERFANAS_GRACIA_SEGUNDOS = 3600
+# Serializa la deduplicación de guardar_imagen con el borrado de huérfanas.
+# Cada foto reutilizada se anota con su hora: hasta pasada la gracia no se
+# borra aunque ningún instrumento la use todavía.
+_lock_fotos = threading.Lock()
+_fotos_reutilizadas: Dict[str, float] = {}
+
+
+def _modo_destino(img: Image.Image) -> str:
+    con_alfa = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+    return "RGBA" if con_alfa else "RGB"
+
+
+def _procesar_foto(origen: Path, destino: Path, borrar_origen: bool):
+    tmp = destino.with_name(f".{destino.stem}_{uuid.uuid4().hex}.tmp")
+    try:
+        with Image.open(origen) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((FOTO_MAX_LADO, FOTO_MAX_LADO), Image.Resampling.LANCZOS)
+            modo = _modo_destino(img)
+            if img.mode != modo:
+                img = img.convert(modo)
+            img.save(tmp, "WEBP", quality=FOTO_CALIDAD_WEBP, method=4)
+        # os.replace es atómico: nadie ve un archivo a medio escribir
+        os.replace(tmp, destino)
+    except Exception:
+        logger.exception("No se pudo recomprimir la foto %s", origen)
+        tmp.unlink(missing_ok=True)
+        if borrar_origen and not destino.exists():
+            # Mejor conservar la subida original que perder la foto. Queda con
+            # nombre .webp sin serlo: optimizar_fotos_existentes lo reconoce
+            # por el contenido y vuelve a intentarlo.
+            os.replace(origen, destino)
+            logger.warning("La foto %s quedó guardada sin recomprimir", destino)
+            return
+        raise
+    finally:
+        if borrar_origen:
+            origen.unlink(missing_ok=True)
+
+
+class ProcesadorFotos:
+    """Pool de hilos que recomprime fotos, sin trabajos duplicados por destino."""
+
+    def __init__(self, workers: int = FOTO_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fotos")
+        self._lock = threading.Lock()
+        self._pendientes: Dict[str, Future] = {}
+
+    def enviar(self, origen: Path, destino: Path, borrar_origen: bool) -> Future:
+        clave = str(destino)
+        with self._lock:
+            futuro = self._pendientes.get(clave)
+            if futuro is not None:
+                if borrar_origen:
+                    origen.unlink(missing_ok=True)
+                return futuro
+            futuro = self._executor.submit(_procesar_foto, origen, destino, borrar_origen)
+            self._pendientes[clave] = futuro
+        futuro.add_done_callback(lambda _f: self._terminar(clave))
+        return futuro
+
+    def _terminar(self, clave: str):
+        with self._lock:
+            self._pendientes.pop(clave, None)
+
+    def en_proceso(self, ruta: str) -> bool:
+        with self._lock:
+            return ruta in self._pendientes
+
+
+@recurso_compartido
+def obtener_procesador_fotos() -> ProcesadorFotos:
+    return ProcesadorFotos()
+
+
+def _copiar_con_hash(origen: BinaryIO, destino: Path) -> str:
+    # Copia por bloques, sin cargar el archivo entero en memoria
+    sha = hashlib.sha256()
+    with open(destino, "wb") as f:
+        for bloque in iter(lambda: origen.read(FOTO_BLOQUE_BYTES), b""):
+            sha.update(bloque)
+            f.write(bloque)
+    return sha.hexdigest()
+
+
+def _hash_archivo(ruta: Path) -> str:
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(FOTO_BLOQUE_BYTES), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _es_webp(ruta: Path) -> bool:
+    with open(ruta, "rb") as f:
+        encabezado = f.read(12)
+    return encabezado[:4] == b"RIFF" and encabezado[8:12] == b"WEBP"
+
+
+def _es_imagen(ruta: Path) -> bool:
+    # Image.open sólo lee el encabezado; el decodificado completo va al pool
+    try:
+        with Image.open(ruta):
+            return True
+    except (UnidentifiedImageError, OSError):
+        return False
+
+
+def _reservar_foto(ruta: Path):
+    # Con _lock_fotos tomado. El mtime nuevo protege la foto también del
+    # recolector de "mantenimiento_instrumentos.py fotos", que corre en otro proceso.
+    ahora = monotonic()
+    for vieja in [r for r, t in _fotos_reutilizadas.items() if ahora - t > FOTOS_HUERFANAS_GRACIA_SEGUNDOS]:
+        del _fotos_reutilizadas[vieja]
+    _fotos_reutilizadas[str(ruta)] = ahora
+    os.utime(ruta)
+
+
+def guardar_imagen(uploaded_file) -> Optional[str]:
+    if uploaded_file is None:
+        return None
+    suffix = Path(uploaded_file.name).suffix.lower()
+    if suffix not in EXTENSIONES_FOTO:
+        suffix = ".png"
+
+    tmp = IMAGES_DIR / f".subida_{uuid.uuid4().hex}{suffix}"
+    uploaded_file.seek(0)
+    digest = _copiar_con_hash(uploaded_file, tmp)[:32]
+
+    destino = IMAGES_DIR / f"{digest}.webp"
+    procesador = obtener_procesador_fotos()
+    with _lock_fotos:
+        reutilizada = destino.exists()
+        if reutilizada:
+            _reservar_foto(destino)
+    if reutilizada:
+        tmp.unlink(missing_ok=True)
+    elif _es_imagen(tmp):
+        procesador.enviar(tmp, destino, borrar_origen=True)
+    else:
+        # Formato que Pillow no reconoce: se guarda tal cual se subió
+        destino = IMAGES_DIR / f"{digest}{suffix}"
+        os.replace(tmp, destino)
+    return str(destino)
+
+
+# ---------- Miniaturas ----------
+# Caché en disco de miniaturas para la galería. El nombre de cada miniatura
+# combina un hash de foto_path con el mtime y el tamaño del original, así una
+# foto reemplazada nunca devuelve una miniatura vieja. Al superar el límite se
+# descartan las menos usadas (LRU).
+MINIATURA_LADO = 320
+MINIATURA_CALIDAD_WEBP = 70
+MINIATURAS_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _generar_miniatura(origen: Path, destino: Path) -> int:
+    tmp = destino.with_name(f".{uuid.uuid4().hex}.tmp")
+    try:
+        with Image.open(origen) as img:
+            # En JPEG, draft decodifica directamente a una escala reducida
+            img.draft("RGB", (MINIATURA_LADO, MINIATURA_LADO))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((MINIATURA_LADO, MINIATURA_LADO), Image.Resampling.LANCZOS)
+            modo = _modo_destino(img)
+            if img.mode != modo:
+                img = img.convert(modo)
+            img.save(tmp, "WEBP", quality=MINIATURA_CALIDAD_WEBP)
+        os.replace(tmp, destino)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return destino.stat().st_size
+
+
+class CacheMiniaturas:
+    def __init__(self, directorio: Path, max_bytes: int = MINIATURAS_MAX_BYTES):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.directorio.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        # El orden LRU se recupera del mtime, que se actualiza en cada acierto
+        for archivo in sorted(self.directorio.glob("*.webp"), key=lambda a: a.stat().st_mtime):
+            self._agregar(archivo.name, archivo.stat().st_size)
+
+    @staticmethod
+    def _prefijo(foto_path: str) -> str:
+        return hashlib.sha1(str(foto_path).encode("utf-8")).hexdigest()[:20]
+
+    def _agregar(self, nombre: str, tamano: int):
+        self._entradas[nombre] = tamano
+        self._total_bytes += tamano
+
+    def _quitar(self, nombre: str):
+        self._total_bytes -= self._entradas.pop(nombre, 0)
+        (self.directorio / nombre).unlink(missing_ok=True)
+
+    def obtener(self, foto_path: Optional[str]) -> Optional[str]:
+        """Ruta de la miniatura de foto_path, generándola si hace falta."""
+        # Desde un DataFrame, una foto faltante llega como NaN en lugar de None
+        if not isinstance(foto_path, str) or not foto_path:
+            return None
+        try:
+            info = os.stat(foto_path)
+        except OSError:
+            return None
+
+        prefijo = self._prefijo(foto_path)
+        nombre = f"{prefijo}_{info.st_mtime_ns}_{info.st_size}.webp"
+        ruta = self.directorio / nombre
+
+        with self._lock:
+            if nombre in self._entradas:
+                if ruta.exists():
+                    self._entradas.move_to_end(nombre)
+                    os.utime(ruta)
+                    return str(ruta)
+                self._quitar(nombre)
+
+        try:
+            tamano = _generar_miniatura(Path(foto_path), ruta)
+        except Exception:
+            logger.warning("No se pudo generar la miniatura de %s", foto_path, exc_info=True)
+            return None
+
+        with self._lock:
+            # Miniaturas de versiones anteriores de la misma foto
+            for viejo in [n for n in self._entradas if n.startswith(prefijo) and n != nombre]:
+                self._quitar(viejo)
+            self._total_bytes -= self._entradas.pop(nombre, 0)
+            self._agregar(nombre, tamano)
+            while self._total_bytes > self.max_bytes and len(self._entradas) > 1:
+                self._quitar(next(iter(self._entradas)))
+        return str(ruta)
+
+    def descartar(self, foto_path: Optional[str]):
+        if not foto_path:
+            return
+        prefijo = self._prefijo(foto_path)
+        with self._lock:
+            for nombre in [n for n in self._entradas if n.startswith(prefijo)]:
+                self._quitar(nombre)
+
+
+@recurso_compartido
+def obtener_cache_miniaturas() -> CacheMiniaturas:
+    return CacheMiniaturas(MINIATURAS_DIR)
+
+
+def foto_en_proceso(foto_path: Optional[str]) -> bool:
+    return isinstance(foto_path, str) and obtener_procesador_fotos().en_proceso(foto_path)
+
+
+@perfilado
+def eliminar_foto_si_huerfana(foto_path: Optional[str]) -> bool:
+    # Con la deduplicación varios instrumentos pueden compartir un archivo:
+    # sólo se borra cuando ya ningún instrumento lo referencia.
+    if not foto_path:
+        return False
+    # Consulta y borrado bajo el mismo lock que la deduplicación: si otra
+    # subida acaba de reutilizar el archivo, su instrumento puede no estar
+    # guardado todavía. Esa foto, si al final nadie la usa, la recoge
+    # "mantenimiento_instrumentos.py fotos".
+    with _lock_fotos:
+        reservada = _fotos_reutilizadas.get(str(foto_path))
+        if reservada is not None and monotonic() - reservada <= FOTOS_HUERFANAS_GRACIA_SEGUNDOS:
+            return False
+        with conexion() as conn:
+            en_uso = conn.execute(
+                "SELECT 1 FROM instrumentos WHERE foto_path = ? LIMIT 1", (foto_path,)
+            ).fetchone()
+        if en_uso:
+            return False
+        obtener_cache_miniaturas().descartar(foto_path)
+        try:
+            os.remove(foto_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("No se pudo borrar la foto %s", foto_path, exc_info=True)
+            return False
+    return True
+
+
+@perfilado
+@modifica_datos
+def optimizar_fotos_existentes() -> Dict[str, int]:
+    """Convierte las fotos ya guardadas al formato optimizado y deduplicado."""
+    resumen = {"convertidas": 0, "duplicadas": 0, "errores": 0}
+    procesador = obtener_procesador_fotos()
+    trabajos: list[tuple[Path, Path, Future]] = []
+    cambios: list[tuple[Path, Path]] = []
+
+    for origen in sorted(IMAGES_DIR.iterdir()):
+        if not origen.is_file() or origen.name.startswith("."):
+            continue
+        # El nombre no alcanza: una recompresión fallida deja la subida
+        # original con nombre .webp
+        if _PATRON_FOTO_OPTIMIZADA.match(origen.name) and _es_webp(origen):
+            continue
+        if origen.suffix.lower() not in EXTENSIONES_FOTO or not _es_imagen(origen):
+            continue
+        destino = IMAGES_DIR / f"{_hash_archivo(origen)[:32]}.webp"
+        if destino == origen:
+            # Se recomprime en el lugar: foto_path no cambia
+            trabajos.append((origen, destino, procesador.enviar(origen, destino, borrar_origen=False)))
+        elif destino.exists():
+            resumen["duplicadas"] += 1
+            cambios.append((origen, destino))
+        else:
+            trabajos.append((origen, destino, procesador.enviar(origen, destino, borrar_origen=False)))
+
+    for origen, destino, futuro in trabajos:
+        try:
+            futuro.result()
+        except Exception:
+            resumen["errores"] += 1
+            continue
+        resumen["convertidas"] += 1
+        if destino != origen:
+            cambios.append((origen, destino))
+
+    with conexion() as conn:
+        conn.executemany(
+            "UPDATE instrumentos SET foto_path = ? WHERE foto_path = ?",
+            [(str(destino), str(origen)) for origen, destino in cambios],
+        )
+    miniaturas = obtener_cache_miniaturas()
+    for origen, _destino in cambios:
+        miniaturas.descartar(str(origen))
+        origen.unlink(missing_ok=True)
+    return resumen
+
+
+# ---------- Instrumentos ----------
+OPCIONES_RESERVA_USO = ["Libre", "Con reserva", "Uso restringido"]
+ESTADOS_INSTRUMENTO = ["Operativo", "En reparación", "Fuera de servicio", "De baja"]
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def insertar_instrumento(
+    grupo_unidad: str,
+    responsable: str,
+    investigador_grupo: str,
+    instrumento: str,
+    numero_inventario: str,
+    reserva_uso: str,
+    estado: str,
+    ubicacion: str,
+    descripcion: str,
+    foto_path: Optional[str],
+):
+    with conexion() as conn:
+        conn.execute(
+            """
+            INSERT INTO instrumentos
+            (grupo_unidad, responsable, investigador_grupo, instrumento,
+             numero_inventario, reserva_uso, estado, ubicacion,
+             descripcion, foto_path, fecha_registro)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                grupo_unidad,
+                responsable,
+                investigador_grupo,
+                instrumento,
+                numero_inventario,
+                reserva_uso,
+                estado,
+                ubicacion,
+                descripcion,
+                foto_path,
+                ahora_epoch(),
+            ),
+        )
+
+
+# Peso de cada columna de COLUMNAS_FTS en el ranking bm25 de la búsqueda global
+PESOS_FTS = [10.0, 4.0, 4.0, 2.0, 1.0, 8.0]
+
+
+def _expresion_fts(texto: str) -> str:
+    # Cada palabra se cita (el usuario no puede inyectar operadores FTS) y se
+    # busca como prefijo; todas las palabras tienen que aparecer.
+    palabras = re.findall(r"\w+", texto)
+    return " AND ".join(f'"{p}"*' for p in palabras)
+
+
+def consulta_fts(
+    busqueda: str = "",
+    filtro_grupo: str = "",
+    filtro_investigador: str = "",
+    filtro_instrumento: str = "",
+) -> str:
+    partes = []
+    for columna, texto in (
+        ("grupo_unidad", filtro_grupo),
+        ("investigador_grupo", filtro_investigador),
+        ("instrumento", filtro_instrumento),
+    ):
+        expr = _expresion_fts(texto)
+        if expr:
+            partes.append(f"{columna} : ({expr})")
+    expr = _expresion_fts(busqueda)
+    if expr:
+        partes.append(f"({expr})")
+    return " AND ".join(partes)
+
+
+@perfilado
+def cargar_instrumentos(
+    filtro_grupo: str = "",
+    filtro_investigador: str = "",
+    filtro_instrumento: str = "",
+    busqueda: str = "",
+) -> pd.DataFrame:
+    return _cargar_instrumentos(
+        version_datos(), filtro_grupo, filtro_investigador, filtro_instrumento, busqueda
+    )
+
+
+@cache_lecturas
+def _cargar_instrumentos(
+    version: int,
+    filtro_grupo: str,
+    filtro_investigador: str,
+    filtro_instrumento: str,
+    busqueda: str,
+) -> pd.DataFrame:
+    query, params = consulta_instrumentos(filtro_grupo, filtro_investigador, filtro_instrumento, busqueda)
+    with conexion() as conn:
+        return _tipar_columnas(pd.read_sql_query(query, conn, params=params))
+
+
+def consulta_instrumentos(
+    filtro_grupo: str = "",
+    filtro_investigador: str = "",
+    filtro_instrumento: str = "",
+    busqueda: str = "",
+) -> tuple[str, list[Any]]:
+    match = consulta_fts(busqueda, filtro_grupo, filtro_investigador, filtro_instrumento)
+    if match:
+        pesos = ", ".join(str(p) for p in PESOS_FTS)
+        query = f"""
+        SELECT i.*
+        FROM instrumentos_fts f
+        JOIN instrumentos_legible i ON i.id = f.rowid
+        WHERE instrumentos_fts MATCH ?
+        ORDER BY bm25(instrumentos_fts, {pesos})
+        """
+        return query, [match]
+    return "SELECT * FROM instrumentos_legible", []
+
+
+# ---------- Paginación por keyset ----------
+# En lugar de OFFSET (que recorre y descarta todas las filas anteriores), cada
+# página continúa desde la clave (valor_orden, id) de la última fila de la
+# página previa, así el costo de una página no crece con su número.
+CursorPagina = tuple[Any, int]
+
+ORDEN_INSTRUMENTOS = {
+    "id": "i.id",
+    "instrumento": "i.instrumento COLLATE NOCASE",
+    "investigador_grupo": "i.investigador_grupo COLLATE NOCASE",
+    "grupo_unidad": "i.grupo_unidad COLLATE NOCASE",
+    "estado": "i.estado",
+    "fecha_registro": "i.fecha_registro",
+}
+
+
+def _condicion_keyset(
+    expr: str,
+    expr_id: str,
+    descendente: bool,
+    cursor: CursorPagina,
+) -> tuple[str, list[Any]]:
+    # SQLite ordena los NULL primero en ASC y al final en DESC; la condición
+    # los contempla para no saltear ni repetir filas sin valor de orden.
+    valor, ultimo_id = cursor
+    if descendente:
+        if valor is None:
+            return f"({expr} IS NULL AND {expr_id} < ?)", [ultimo_id]
+        return f"(({expr}, {expr_id}) < (?, ?) OR {expr} IS NULL)", [valor, ultimo_id]
+    if valor is None:
+        return f"(({expr} IS NULL AND {expr_id} > ?) OR {expr} IS NOT NULL)", [ultimo_id]
+    return f"(({expr}, {expr_id}) > (?, ?))", [valor, ultimo_id]
+
+
+def _valor_sql(valor: Any) -> Any:
+    # Los escalares de numpy/pandas no se pueden pasar como parámetro a sqlite3
+    if valor is None or pd.isna(valor):
+        return None
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+def _leer_pagina(
+    conn: sqlite3.Connection,
+    query: str,
+    params: list[Any],
+    tamano_pagina: int,
+) -> tuple[pd.DataFrame, Optional[CursorPagina]]:
+    # Se pide una fila de más para saber si existe una página siguiente
+    df = pd.read_sql_query(query + " LIMIT ?", conn, params=params + [tamano_pagina + 1])
+    siguiente = None
+    if len(df) > tamano_pagina:
+        df = df.iloc[:tamano_pagina]
+        ultima = df.iloc[-1]
+        siguiente = (_valor_sql(ultima["_orden"]), int(ultima["id"]))
+    return _tipar_columnas(df.drop(columns=["_orden"])), siguiente
+
+
+@perfilado
+def cargar_instrumentos_pagina(
+    filtro_grupo: str = "",
+    filtro_investigador: str = "",
+    filtro_instrumento: str = "",
+    busqueda: str = "",
+    orden: str = "id",
+    descendente: bool = False,
+    tamano_pagina: int = 50,
+    despues_de: Optional[CursorPagina] = None,
+) -> tuple[pd.DataFrame, int, Optional[CursorPagina]]:
+    """Devuelve (página, total de filas que cumplen el filtro, cursor de la siguiente página)."""
+    return _cargar_instrumentos_pagina(
+        version_datos(),
+        filtro_grupo,
+        filtro_investigador,
+        filtro_instrumento,
+        busqueda,
+        orden,
+        descendente,
+        tamano_pagina,
+        despues_de,
+    )
+
+
+@cache_lecturas
+def _cargar_instrumentos_pagina(
+    version: int,
+    filtro_grupo: str,
+    filtro_investigador: str,
+    filtro_instrumento: str,
+    busqueda: str,
+    orden: str,
+    descendente: bool,
+    tamano_pagina: int,
+    despues_de: Optional[CursorPagina],
+) -> tuple[pd.DataFrame, int, Optional[CursorPagina]]:
+    match = consulta_fts(busqueda, filtro_grupo, filtro_investigador, filtro_instrumento)
+    if orden == "relevancia" and match:
+        pesos = ", ".join(str(p) for p in PESOS_FTS)
+        expr = f"bm25(instrumentos_fts, {pesos})"
+    else:
+        expr = ORDEN_INSTRUMENTOS.get(orden, "i.id")
+
+    condiciones: list[str] = []
+    params: list[Any] = []
+    if match:
+        desde = "instrumentos_fts JOIN instrumentos i ON i.id = instrumentos_fts.rowid"
+        condiciones.append("instrumentos_fts MATCH ?")
+        params.append(match)
+    else:
+        desde = "instrumentos i"
+
+    with conexion() as conn:
+        if match:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM instrumentos_fts WHERE instrumentos_fts MATCH ?", (match,)
+            ).fetchone()[0]
+        else:
+            total = conn.execute("SELECT COUNT(*) FROM instrumentos").fetchone()[0]
+
+        if despues_de is not None:
+            cond, p = _condicion_keyset(expr, "i.id", descendente, despues_de)
+            condiciones.append(cond)
+            params.extend(p)
+
+        direccion = "DESC" if descendente else "ASC"
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        query = f"""
+        SELECT {columnas_legibles("i", COLUMNAS_INSTRUMENTOS)}, {expr} AS _orden
+        FROM {desde}
+        {where}
+        ORDER BY {expr} {direccion}, i.id {direccion}
+        """
+        df, siguiente = _leer_pagina(conn, query, params, tamano_pagina)
+
+    return df, int(total), siguiente
+
+
+@perfilado
+@modifica_datos
+def reconstruir_indice_busqueda():
+    # Regenera instrumentos_fts desde la tabla instrumentos (por ejemplo,
+    # si se editó la base con otra herramienta que no dispara los triggers)
+    with conexion() as conn:
+        conn.execute("INSERT INTO instrumentos_fts(instrumentos_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO instrumentos_fts(instrumentos_fts) VALUES ('optimize')")
+
+
+# ---------- Autocompletado ----------
+# Índice de trigramas en memoria sobre nombre, número de inventario y grupo,
+# para sugerir instrumentos mientras se escribe aunque haya errores de tipeo.
+# Se arma una vez por proceso y se pone al día leyendo la tabla cambios, así
+# también ve lo que escriben otros procesos sin volver a leer instrumentos.
+COLUMNAS_AUTOCOMPLETAR = {"instrumento": 1.0, "numero_inventario": 1.0, "grupo_unidad": 0.6}
+AUTOCOMPLETAR_LIMITE = 10
+AUTOCOMPLETAR_CANDIDATOS = 200
+# Fracción mínima de los trigramas de la consulta que tiene que tener un campo
+AUTOCOMPLETAR_SIMILITUD_MINIMA = 0.3
+# Altas y modificaciones que se acumulan aparte antes de recompactar el índice
+AUTOCOMPLETAR_MAX_DELTA = 2000
+# El texto normalizado sólo tiene espacios, letras y dígitos: cada trigrama
+# se codifica como un entero menor que 37³
+_ALFABETO_TRIGRAMAS = {c: i for i, c in enumerate(" abcdefghijklmnopqrstuvwxyz0123456789")}
+_TRIGRAMAS_POSIBLES = len(_ALFABETO_TRIGRAMAS) ** 3
+_PATRON_PALABRA_AUTOCOMPLETAR = re.compile(r"[a-z0-9]+")
+
+
+def _texto_autocompletar(texto: Any) -> str:
+    if not isinstance(texto, str):
+        return ""
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return " ".join(_PATRON_PALABRA_AUTOCOMPLETAR.findall(texto.lower()))
+
+
+@lru_cache(maxsize=1 << 16)
+def _trigramas_palabra(palabra: str) -> tuple[int, ...]:
+    # Como pg_trgm: la palabra con dos espacios delante y uno detrás, así el
+    # comienzo aporta más trigramas que el medio. Las palabras se repiten
+    # mucho entre instrumentos (marcas, grupos), de ahí la caché.
+    n = len(_ALFABETO_TRIGRAMAS)
+    c = [_ALFABETO_TRIGRAMAS[letra] for letra in f"  {palabra} "]
+    return tuple({(c[i] * n + c[i + 1]) * n + c[i + 2] for i in range(len(c) - 2)})
+
+
+def _trigramas(texto: str) -> set[int]:
+    return set().union(*map(_trigramas_palabra, texto.split()))
+
+
+class IndiceTrigramas:
+    """Trigrama -> instrumentos que lo contienen, con los textos normalizados de cada uno.
+
+    El grueso vive en arreglos de numpy (formato CSR: los instrumentos con el
+    trigrama t están en posiciones[inicio[t]:inicio[t + 1]]), que ocupan poco
+    y se cuentan con bincount. Lo que cambia después se guarda aparte en un
+    diccionario chico y se marca como vencido en la base, hasta recompactar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._textos: Dict[int, tuple[str, ...]] = {}
+        self._ids_base = np.empty(0, dtype=np.int64)
+        self._vigentes = np.empty(0, dtype=bool)
+        self._inicio = np.zeros(_TRIGRAMAS_POSIBLES + 1, dtype=np.int64)
+        self._posiciones = np.empty(0, dtype=np.int32)
+        self._delta: Dict[int, set[int]] = {}
+        self._ids_delta: set[int] = set()
+        self._version: Optional[int] = None
+        self._posicion = 0
+        self._precarga: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._textos)
+
+    def precargar(self):
+        """Arma el índice en segundo plano, para que no lo pague la primera búsqueda."""
+        if self._precarga is None:
+            self._precarga = threading.Thread(target=self._precargar, name="autocompletado", daemon=True)
+            self._precarga.start()
+
+    def _precargar(self):
+        try:
+            with self._lock:
+                self._poner_al_dia()
+        except Exception:
+            logger.exception("No se pudo armar el índice de autocompletado")
+
+    # ---------- Altas, bajas y compactación ----------
+    def _vencer_base(self, instrumento_id: int):
+        p = int(np.searchsorted(self._ids_base, instrumento_id))
+        if p < len(self._ids_base) and self._ids_base[p] == instrumento_id:
+            self._vigentes[p] = False
+
+    def _quitar(self, instrumento_id: int):
+        textos = self._textos.pop(instrumento_id, None)
+        self._vencer_base(instrumento_id)
+        if textos is None or instrumento_id not in self._ids_delta:
+            return
+        self._ids_delta.discard(instrumento_id)
+        for trigrama in _trigramas(" ".join(textos)):
+            ids = self._delta.get(trigrama)
+            if ids is not None:
+                ids.discard(instrumento_id)
+                if not ids:
+                    del self._delta[trigrama]
+
+    def _agregar(self, instrumento_id: int, fila: Dict[str, Any]):
+        self._quitar(instrumento_id)
+        textos = tuple(_texto_autocompletar(fila.get(c)) for c in COLUMNAS_AUTOCOMPLETAR)
+        self._textos[instrumento_id] = textos
+        self._ids_delta.add(instrumento_id)
+        for trigrama in _trigramas(" ".join(textos)):
+            self._delta.setdefault(trigrama, set()).add(instrumento_id)
+        if len(self._ids_delta) > AUTOCOMPLETAR_MAX_DELTA:
+            self._compactar()
+
+    def _compactar(self):
+        ids = sorted(self._textos)
+        codigos = array("i")
+        cantidades = np.empty(len(ids), dtype=np.int64)
+        for p, iid in enumerate(ids):
+            trigramas = _trigramas(" ".join(self._textos[iid]))
+            codigos.extend(trigramas)
+            cantidades[p] = len(trigramas)
+        codigos_np = np.frombuffer(codigos, dtype=np.int32)
+        orden = np.argsort(codigos_np)
+        self._posiciones = np.repeat(np.arange(len(ids), dtype=np.int32), cantidades)[orden]
+        self._inicio = np.searchsorted(codigos_np[orden], np.arange(_TRIGRAMAS_POSIBLES + 1))
+        self._ids_base = np.array(ids, dtype=np.int64)
+        self._vigentes = np.ones(len(ids), dtype=bool)
+        self._delta.clear()
+        self._ids_delta.clear()
+
+    def _reconstruir(self, conn: sqlite3.Connection):
+        self._textos.clear()
+        self._ids_delta.clear()
+        cursor = conn.execute(f"SELECT id, {', '.join(COLUMNAS_AUTOCOMPLETAR)} FROM instrumentos")
+        for row in cursor:
+            self._textos[row[0]] = tuple(_texto_autocompletar(v) for v in row[1:])
+        self._compactar()
+
+    def _poner_al_dia(self):
+        version = version_datos()
+        if version == self._version:
+            return
+        with conexion() as conn:
+            # La posición se lee antes que los datos: lo que se escriba en el
+            # medio se vuelve a aplicar la próxima vez, y aplicarlo dos veces
+            # da lo mismo
+            posicion = _posicion_cambios(conn)
+            minimo = conn.execute("SELECT MIN(seq) FROM cambios").fetchone()[0]
+            podado = minimo > self._posicion + 1 if minimo is not None else posicion > self._posicion
+            if self._version is None or posicion < self._posicion or podado:
+                # Primera vez, base restaurada o registro podado
+                self._reconstruir(conn)
+            else:
+                cambios = conn.execute(
+                    """
+                    SELECT operacion, fila_id, datos FROM cambios
+                    WHERE seq > ? AND tabla = 'instrumentos'
+                    ORDER BY seq
+                    """,
+                    (self._posicion,),
+                )
+                for operacion, fila_id, datos in cambios:
+                    if operacion == "D":
+                        self._quitar(fila_id)
+                    else:
+                        self._agregar(fila_id, json.loads(datos))
+        self._posicion = posicion
+        self._version = version
+
+    # ---------- Búsqueda ----------
+    def _candidatos(self, trigramas: set[int]) -> Dict[int, int]:
+        """Id -> trigramas de la consulta que tiene, para los que más tienen."""
+        minimo = AUTOCOMPLETAR_SIMILITUD_MINIMA * len(trigramas)
+        candidatos: Dict[int, int] = {}
+        if len(self._ids_base):
+            partes = [self._posiciones[self._inicio[t]:self._inicio[t + 1]] for t in trigramas]
+            conteo = np.bincount(np.concatenate(partes), minlength=len(self._ids_base))
+            conteo[~self._vigentes] = 0
+            if len(conteo) > AUTOCOMPLETAR_CANDIDATOS:
+                mejores = np.argpartition(conteo, -AUTOCOMPLETAR_CANDIDATOS)[-AUTOCOMPLETAR_CANDIDATOS:]
+            else:
+                mejores = np.arange(len(conteo))
+            candidatos = {
+                int(self._ids_base[p]): int(conteo[p]) for p in mejores if conteo[p] >= minimo
+            }
+        delta: Counter = Counter()
+        for trigrama in trigramas:
+            delta.update(self._delta.get(trigrama, ()))
+        candidatos.update((iid, n) for iid, n in delta.items() if n >= minimo)
+        return candidatos
+
+    def buscar(self, texto: str, limite: int = AUTOCOMPLETAR_LIMITE) -> list[tuple[int, float]]:
+        consulta = _texto_autocompletar(texto)
+        trigramas = _trigramas(consulta)
+        if not trigramas:
+            return []
+        with self._lock:
+            self._poner_al_dia()
+            candidatos = [(iid, self._textos[iid]) for iid in self._candidatos(trigramas)]
+
+        # Sólo los candidatos se puntúan campo por campo
+        resultados = []
+        for iid, textos in candidatos:
+            puntaje = 0.0
+            for peso, campo in zip(COLUMNAS_AUTOCOMPLETAR.values(), textos):
+                similitud = len(trigramas & _trigramas(campo)) / len(trigramas)
+                if similitud < AUTOCOMPLETAR_SIMILITUD_MINIMA:
+                    continue
+                # Lo escrito tal cual dentro del campo va antes que lo parecido
+                if campo.startswith(consulta):
+                    similitud += 0.5
+                elif consulta in campo:
+                    similitud += 0.3
+                # Entre iguales, el texto más corto es el más específico
+                puntaje = max(puntaje, peso * similitud - len(campo) / 10000)
+            if puntaje > 0:
+                resultados.append((iid, round(puntaje, 4)))
+        resultados.sort(key=lambda r: (-r[1], r[0]))
+        return resultados[:limite]
+
+
+@recurso_compartido
+def obtener_indice_autocompletar() -> IndiceTrigramas:
+    return IndiceTrigramas()
+
+
+@perfilado
+def autocompletar_instrumentos(texto: str, limite: int = AUTOCOMPLETAR_LIMITE) -> list[int]:
+    """Ids de los instrumentos que mejor coinciden con `texto`, tolerando errores de tipeo."""
+    return [iid for iid, _ in obtener_indice_autocompletar().buscar(texto, limite)]
+
+
+@perfilado
+def obtener_instrumento_por_id(instrumento_id: int) -> Optional[Dict[str, Any]]:
+    with conexion() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute("SELECT * FROM instrumentos WHERE id = ?", (instrumento_id,))
+        return _fila_tipada(cur.fetchone())
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def actualizar_instrumento(
+    instrumento_id: int,
+    grupo_unidad: str,
+    responsable: str,
+    investigador_grupo: str,
+    instrumento: str,
+    numero_inventario: str,
+    reserva_uso: str,
+    estado: str,
+    ubicacion: str,
+    descripcion: str,
+    foto_path: Optional[str],
+):
+    with conexion() as conn:
+        conn.execute(
+            """
+            UPDATE instrumentos
+            SET grupo_unidad = ?,
+                responsable = ?,
+                investigador_grupo = ?,
+                instrumento = ?,
+                numero_inventario = ?,
+                reserva_uso = ?,
+                estado = ?,
+                ubicacion = ?,
+                descripcion = ?,
+                foto_path = ?
+            WHERE id = ?
+            """,
+            (
+                grupo_unidad,
+                responsable,
+                investigador_grupo,
+                instrumento,
+                numero_inventario,
+                reserva_uso,
+                estado,
+                ubicacion,
+                descripcion,
+                foto_path,
+                instrumento_id,
+            ),
+        )
+
+
+@perfilado
+def contar_reservas_de_instrumento(instrumento_id: int) -> int:
+    """Reservas activas y archivadas del instrumento."""
+    with conexion() as conn:
+        n = conn.execute(
+            """
+            SELECT (SELECT COUNT(*) FROM reservas WHERE instrumento_id = ?)
+                 + (SELECT COUNT(*) FROM reservas_archivo WHERE instrumento_id = ?)
+            """,
+            (instrumento_id, instrumento_id),
+        ).fetchone()[0]
+    return int(n)
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def borrar_reservas_de_instrumento(instrumento_id: int):
+    with conexion() as conn:
+        conn.execute("DELETE FROM reservas WHERE instrumento_id = ?", (instrumento_id,))
+        conn.execute("DELETE FROM reservas_archivo WHERE instrumento_id = ?", (instrumento_id,))
+        conn.execute("DELETE FROM uso_diario WHERE instrumento_id = ?", (instrumento_id,))
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def borrar_instrumento(instrumento_id: int):
+    inst = obtener_instrumento_por_id(instrumento_id)
+    foto_path = inst.get("foto_path") if inst else None
+
+    with conexion() as conn:
+        conn.execute("DELETE FROM instrumentos WHERE id = ?", (instrumento_id,))
+
+    # Si el borrado no llega a confirmarse, la foto tiene que seguir ahí
+    despues_de_confirmar(lambda: eliminar_foto_si_huerfana(foto_path))
+
+
+# ---------- Reservas ----------
+ESTADOS_RESERVA = ["Confirmada", "Tentativa", "Cancelada"]
+
+
+class ReservaSolapada(Exception):
+    """La reserva pisa otra reserva del mismo instrumento que no admite solapamiento."""
+
+    def __init__(self, conflictos: list[Dict[str, Any]]):
+        self.conflictos = conflictos
+        detalle = "; ".join(
+            f"[ID {c['id']}] {c['usuario']} {c['fecha_inicio']} → {c['fecha_fin']} ({c['estado']})"
+            for c in conflictos
+        )
+        super().__init__(f"La reserva se solapa con: {detalle}")
+
+
+def buscar_solapamientos(
+    conn: sqlite3.Connection,
+    instrumento_id: int,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    excluir_reserva_id: Optional[int] = None,
+) -> list[Dict[str, Any]]:
+    # Dos intervalos [a, b) y [c, d) se solapan si a < d y c < b. Las
+    # reservas canceladas no ocupan el instrumento y las que no tienen
+    # estado se tratan como confirmadas, igual que en la UI.
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute(
+        """
+        SELECT id, usuario, fecha_inicio, fecha_fin,
+               COALESCE(estado, 'Confirmada') AS estado
+        FROM reservas INDEXED BY idx_reservas_instrumento_fin
+        WHERE instrumento_id = ?
+          AND fecha_fin > ?
+          AND fecha_inicio < ?
+          AND COALESCE(estado, 'Confirmada') != 'Cancelada'
+          AND id IS NOT ?
+        ORDER BY fecha_inicio
+        """,
+        (instrumento_id, a_epoch(fecha_inicio), a_epoch(fecha_fin), excluir_reserva_id),
+    )
+    return [_fila_tipada(row) for row in cur.fetchall()]
+
+
+def _verificar_solapamientos(
+    conn: sqlite3.Connection,
+    instrumento_id: int,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    estado: str,
+    permitir_tentativas: bool,
+    excluir_reserva_id: Optional[int] = None,
+) -> list[Dict[str, Any]]:
+    """Lanza ReservaSolapada si hay conflictos bloqueantes y devuelve los tolerados."""
+    if estado == "Cancelada":
+        return []
+
+    solapes = buscar_solapamientos(conn, instrumento_id, fecha_inicio, fecha_fin, excluir_reserva_id)
+    bloqueantes = _bloqueantes(solapes, estado, permitir_tentativas)
+    if bloqueantes:
+        raise ReservaSolapada(bloqueantes)
+    return solapes
+
+
+def _bloqueantes(solapes: list[Dict[str, Any]], estado: str, permitir_tentativas: bool) -> list[Dict[str, Any]]:
+    if not permitir_tentativas:
+        return solapes
+    # Sólo bloquea un choque entre dos reservas confirmadas
+    return [s for s in solapes if estado == "Confirmada" and s["estado"] == "Confirmada"]
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def insertar_reserva(
+    instrumento_id: int,
+    usuario: str,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    comentario: str,
+    estado: str = "Confirmada",
+    permitir_tentativas: bool = True,
+) -> list[Dict[str, Any]]:
+    with conexion() as conn:
+        # Lock de escritura antes del chequeo: nadie puede insertar una
+        # reserva solapada entre la verificación y el INSERT.
+        _iniciar_escritura(conn)
+        solapes = _verificar_solapamientos(
+            conn, instrumento_id, fecha_inicio, fecha_fin, estado, permitir_tentativas
+        )
+        conn.execute(
+            """
+            INSERT INTO reservas
+            (instrumento_id, usuario, fecha_inicio, fecha_fin,
+             comentario, estado, fecha_registro)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                instrumento_id,
+                usuario,
+                a_epoch(fecha_inicio),
+                a_epoch(fecha_fin),
+                comentario,
+                estado,
+                ahora_epoch(),
+            ),
+        )
+        _actualizar_uso_diario(conn, [(1, instrumento_id, usuario, estado, fecha_inicio, fecha_fin)])
+    return solapes
+
+
+@perfilado
+def cargar_reservas(instrumento_id: Optional[int] = None, archivadas: bool = False) -> pd.DataFrame:
+    return _cargar_reservas(version_datos(), instrumento_id, archivadas)
+
+
+@cache_lecturas
+def _cargar_reservas(version: int, instrumento_id: Optional[int], archivadas: bool) -> pd.DataFrame:
+    query, params = consulta_reservas(instrumento_id, archivadas)
+    with conexion() as conn:
+        return _tipar_columnas(pd.read_sql_query(query, conn, params=params))
+
+
+def consulta_reservas(instrumento_id: Optional[int] = None, archivadas: bool = False) -> tuple[str, list[Any]]:
+    vista = "reservas_archivo_legible" if archivadas else "reservas_legible"
+    if instrumento_id is None:
+        query = f"""
+        SELECT r.id, r.instrumento_id, i.instrumento,
+               r.usuario, r.fecha_inicio, r.fecha_fin,
+               r.estado, r.comentario, r.serie_id
+        FROM {vista} r
+        JOIN instrumentos i ON r.instrumento_id = i.id
+        ORDER BY r.fecha_inicio DESC
+        """
+        params: list[Any] = []
+    else:
+        query = f"""
+        SELECT r.id, r.instrumento_id, i.instrumento,
+               r.usuario, r.fecha_inicio, r.fecha_fin,
+               r.estado, r.comentario, r.serie_id
+        FROM {vista} r
+        JOIN instrumentos i ON r.instrumento_id = i.id
+        WHERE r.instrumento_id = ?
+        ORDER BY r.fecha_inicio DESC
+        """
+        params = [instrumento_id]
+    return query, params
+
+
+ORDEN_RESERVAS = {
+    "fecha_inicio": "r.fecha_inicio",
+    "fecha_fin": "r.fecha_fin",
+    "usuario": "r.usuario COLLATE NOCASE",
+    "estado": "r.estado",
+    "instrumento": "i.instrumento COLLATE NOCASE",
+    "id": "r.id",
+}
+
+
+@perfilado
+def cargar_reservas_pagina(
+    instrumento_id: Optional[int] = None,
+    orden: str = "fecha_inicio",
+    descendente: bool = True,
+    tamano_pagina: int = 50,
+    despues_de: Optional[CursorPagina] = None,
+    archivadas: bool = False,
+) -> tuple[pd.DataFrame, int, Optional[CursorPagina]]:
+    """Devuelve (página, total de reservas, cursor de la siguiente página)."""
+    return _cargar_reservas_pagina(
+        version_datos(), instrumento_id, orden, descendente, tamano_pagina, despues_de, archivadas
+    )
+
+
+@cache_lecturas
+def _cargar_reservas_pagina(
+    version: int,
+    instrumento_id: Optional[int],
+    orden: str,
+    descendente: bool,
+    tamano_pagina: int,
+    despues_de: Optional[CursorPagina],
+    archivadas: bool,
+) -> tuple[pd.DataFrame, int, Optional[CursorPagina]]:
+    tabla = "reservas_archivo" if archivadas else "reservas"
+    expr = ORDEN_RESERVAS.get(orden, "r.fecha_inicio")
+    condiciones: list[str] = []
+    params: list[Any] = []
+    if instrumento_id is not None:
+        condiciones.append("r.instrumento_id = ?")
+        params.append(instrumento_id)
+
+    with conexion() as conn:
+        if instrumento_id is None:
+            total = conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+        else:
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM {tabla} WHERE instrumento_id = ?", (instrumento_id,)
+            ).fetchone()[0]
+
+        if despues_de is not None:
+            cond, p = _condicion_keyset(expr, "r.id", descendente, despues_de)
+            condiciones.append(cond)
+            params.extend(p)
+
+        direccion = "DESC" if descendente else "ASC"
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        query = f"""
+        SELECT r.id, r.instrumento_id, i.instrumento,
+               r.usuario, {columnas_legibles("r", ["fecha_inicio", "fecha_fin"])},
+               r.estado, r.comentario, r.serie_id, {expr} AS _orden
+        FROM {tabla} r
+        JOIN instrumentos i ON r.instrumento_id = i.id
+        {where}
+        ORDER BY {expr} {direccion}, r.id {direccion}
+        """
+        df, siguiente = _leer_pagina(conn, query, params, tamano_pagina)
+
+    return df, int(total), siguiente
+
+
+@perfilado
+def obtener_reserva_por_id(reserva_id: int, archivadas: bool = False) -> Optional[Dict[str, Any]]:
+    tabla = "reservas_archivo" if archivadas else "reservas"
+    with conexion() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute(f"SELECT * FROM {tabla} WHERE id = ?", (reserva_id,))
+        return _fila_tipada(cur.fetchone())
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def actualizar_reserva(
+    reserva_id: int,
+    instrumento_id: int,
+    usuario: str,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    comentario: str,
+    estado: str,
+    permitir_tentativas: bool = True,
+) -> list[Dict[str, Any]]:
+    with conexion() as conn:
+        _iniciar_escritura(conn)
+        solapes = _verificar_solapamientos(
+            conn,
+            instrumento_id,
+            fecha_inicio,
+            fecha_fin,
+            estado,
+            permitir_tentativas,
+            excluir_reserva_id=reserva_id,
+        )
+        movimientos = _movimiento_reserva(conn, reserva_id, -1)
+        conn.execute(
+            """
+            UPDATE reservas
+            SET instrumento_id = ?,
+                usuario = ?,
+                fecha_inicio = ?,
+                fecha_fin = ?,
+                comentario = ?,
+                estado = ?
+            WHERE id = ?
+            """,
+            (
+                instrumento_id,
+                usuario,
+                a_epoch(fecha_inicio),
+                a_epoch(fecha_fin),
+                comentario,
+                estado,
+                reserva_id,
+            ),
+        )
+        if movimientos:
+            movimientos.append((1, instrumento_id, usuario, estado, fecha_inicio, fecha_fin))
+            _actualizar_uso_diario(conn, movimientos)
+    return solapes
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def borrar_reserva(reserva_id: int):
+    with conexion() as conn:
+        movimientos = _movimiento_reserva(conn, reserva_id, -1)
+        conn.execute("DELETE FROM reservas WHERE id = ?", (reserva_id,))
+        _actualizar_uso_diario(conn, movimientos)
+
+
+# ---------- Reservas recurrentes ----------
+# Una serie guarda la regla (diaria o semanal, cada N días/semanas, hasta una
+# fecha y con días exceptuados) y se expande en reservas comunes con serie_id.
+# Todas las ocurrencias se verifican contra las reservas existentes con una
+# sola consulta por índice y se insertan en una única transacción.
+FRECUENCIAS_SERIE = ["diaria", "semanal"]
+SERIE_MAX_OCURRENCIAS = 500
+
+
+class SerieSolapada(ReservaSolapada):
+    """Alguna ocurrencia de la serie pisa reservas que no admiten solapamiento."""
+
+    def __init__(self, conflictos: list[Dict[str, Any]]):
+        self.conflictos = conflictos
+        ocurrencias = len({c["ocurrencia"] for c in conflictos})
+        detalle = "; ".join(
+            f"{c['ocurrencia']:%d/%m/%Y %H:%M} con [ID {c['id']}] {c['usuario']} ({c['estado']})"
+            for c in conflictos[:10]
+        )
+        resto = f" y {len(conflictos) - 10} más" if len(conflictos) > 10 else ""
+        Exception.__init__(self, f"{ocurrencias} ocurrencia(s) de la serie se solapan: {detalle}{resto}")
+
+
+def expandir_serie(
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    frecuencia: str,
+    hasta: date,
+    intervalo: int = 1,
+    dias_semana: Optional[Iterable[int]] = None,
+    excepciones: Iterable[date] = (),
+) -> list[tuple[datetime, datetime]]:
+    """Ocurrencias (inicio, fin) de la regla, en orden.
+
+    fecha_inicio/fecha_fin son los de la primera ocurrencia y fijan el horario
+    de todas. En las semanales, dias_semana usa 0 = lunes (por defecto, el día
+    de fecha_inicio) y el intervalo cuenta semanas desde la del inicio.
+    """
+    if frecuencia not in FRECUENCIAS_SERIE:
+        raise ValueError(f"Frecuencia desconocida: {frecuencia}")
+    if intervalo < 1:
+        raise ValueError("El intervalo debe ser de al menos 1.")
+    if fecha_fin <= fecha_inicio:
+        raise ValueError("La fecha/hora de fin debe ser posterior al inicio.")
+
+    primer_dia = pd.Timestamp(fecha_inicio.date())
+    dias = pd.date_range(primer_dia, pd.Timestamp(hasta), freq="D")
+    desfase = (dias - primer_dia).days.to_numpy()
+    if frecuencia == "diaria":
+        mascara = desfase % intervalo == 0
+    else:
+        semanas = (desfase + primer_dia.weekday()) // 7
+        dias_semana = sorted(set(dias_semana)) if dias_semana else [primer_dia.weekday()]
+        mascara = np.isin(dias.weekday, dias_semana) & (semanas % intervalo == 0)
+    if excepciones:
+        mascara &= ~dias.isin(pd.DatetimeIndex([pd.Timestamp(d) for d in excepciones]))
+    dias = dias[mascara]
+
+    if len(dias) == 0:
+        raise ValueError("La regla no genera ninguna ocurrencia.")
+    if len(dias) > SERIE_MAX_OCURRENCIAS:
+        raise ValueError(
+            f"La regla genera {len(dias)} ocurrencias; el máximo es {SERIE_MAX_OCURRENCIAS}."
+        )
+
+    # Misma hora de reloj en cada día, también si cambia el horario de verano
+    hora = fecha_inicio - primer_dia.to_pydatetime()
+    duracion = fecha_fin - fecha_inicio
+    ocurrencias = [(d + hora, d + hora + duracion) for d in dias.to_pydatetime()]
+    if any(sig[0] < ant[1] for ant, sig in zip(ocurrencias, ocurrencias[1:])):
+        raise ValueError("Las ocurrencias de la serie se superponen entre sí.")
+    return ocurrencias
+
+
+def _solapamientos_serie(
+    conn: sqlite3.Connection,
+    instrumento_id: int,
+    ocurrencias: list[tuple[datetime, datetime]],
+) -> list[Dict[str, Any]]:
+    # Las ocurrencias viajan como un arreglo JSON y cada una busca sus choques
+    # en idx_reservas_instrumento_fin, igual que buscar_solapamientos. CROSS
+    # JOIN fija el orden: primero la ocurrencia, después el rango del índice.
+    candidatas = json.dumps([[a_epoch(i), a_epoch(f)] for i, f in ocurrencias])
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    cur.execute(
+        """
+        WITH candidatas AS (
+            SELECT key AS n,
+                   json_extract(value, '$[0]') AS inicio,
+                   json_extract(value, '$[1]') AS fin
+            FROM json_each(?)
+        )
+        SELECT c.n, r.id, r.usuario, r.fecha_inicio, r.fecha_fin,
+               COALESCE(r.estado, 'Confirmada') AS estado
+        FROM candidatas c
+        CROSS JOIN reservas r INDEXED BY idx_reservas_instrumento_fin
+          ON r.instrumento_id = ?
+         AND r.fecha_fin > c.inicio
+         AND r.fecha_inicio < c.fin
+        WHERE COALESCE(r.estado, 'Confirmada') != 'Cancelada'
+        ORDER BY c.n, r.fecha_inicio
+        """,
+        (candidatas, instrumento_id),
+    )
+    solapes = []
+    for row in cur.fetchall():
+        fila = _fila_tipada(row)
+        fila["ocurrencia"] = ocurrencias[fila.pop("n")][0]
+        solapes.append(fila)
+    return solapes
+
+
+def _insertar_ocurrencias(
+    conn: sqlite3.Connection,
+    serie_id: int,
+    instrumento_id: int,
+    usuario: str,
+    ocurrencias: list[tuple[datetime, datetime]],
+    comentario: str,
+    estado: str,
+    permitir_tentativas: bool,
+) -> list[Dict[str, Any]]:
+    """Verifica e inserta las ocurrencias; devuelve los solapamientos tolerados."""
+    solapes = [] if estado == "Cancelada" else _solapamientos_serie(conn, instrumento_id, ocurrencias)
+    bloqueantes = _bloqueantes(solapes, estado, permitir_tentativas)
+    if bloqueantes:
+        raise SerieSolapada(bloqueantes)
+
+    registro = ahora_epoch()
+    conn.executemany(
+        """
+        INSERT INTO reservas
+        (instrumento_id, usuario, fecha_inicio, fecha_fin,
+         comentario, estado, fecha_registro, serie_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (instrumento_id, usuario, a_epoch(i), a_epoch(f), comentario, estado, registro, serie_id)
+            for i, f in ocurrencias
+        ],
+    )
+    _actualizar_uso_diario(
+        conn, [(1, instrumento_id, usuario, estado, i, f) for i, f in ocurrencias]
+    )
+    return solapes
+
+
+def _valores_regla(dias_semana: Optional[Iterable[int]], excepciones: Iterable[date]) -> tuple[Optional[str], str]:
+    dias = ",".join(str(d) for d in sorted(set(dias_semana))) if dias_semana else None
+    return dias, ",".join(sorted(d.isoformat() for d in excepciones))
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def insertar_serie_reservas(
+    instrumento_id: int,
+    usuario: str,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    frecuencia: str,
+    hasta: date,
+    intervalo: int = 1,
+    dias_semana: Optional[Iterable[int]] = None,
+    excepciones: Iterable[date] = (),
+    comentario: str = "",
+    estado: str = "Confirmada",
+    permitir_tentativas: bool = True,
+) -> tuple[int, int, list[Dict[str, Any]]]:
+    """Crea la serie y todas sus reservas. Devuelve (serie_id, ocurrencias, solapes tolerados).
+
+    Si alguna ocurrencia choca con una reserva que no admite solapamiento no
+    se guarda nada y se lanza SerieSolapada.
+    """
+    excepciones = list(excepciones)
+    ocurrencias = expandir_serie(
+        fecha_inicio, fecha_fin, frecuencia, hasta, intervalo, dias_semana, excepciones
+    )
+    dias, excepciones_txt = _valores_regla(dias_semana, excepciones)
+    with conexion() as conn:
+        _iniciar_escritura(conn)
+        cur = conn.execute(
+            """
+            INSERT INTO series_reserva
+            (instrumento_id, usuario, frecuencia, intervalo, dias_semana, fecha_inicio,
+             fecha_fin, hasta, excepciones, comentario, estado, fecha_registro)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                instrumento_id,
+                usuario,
+                frecuencia,
+                intervalo,
+                dias,
+                a_epoch(fecha_inicio),
+                a_epoch(fecha_fin),
+                hasta.isoformat(),
+                excepciones_txt,
+                comentario,
+                estado,
+                ahora_epoch(),
+            ),
+        )
+        serie_id = cur.lastrowid
+        solapes = _insertar_ocurrencias(
+            conn, serie_id, instrumento_id, usuario, ocurrencias, comentario, estado, permitir_tentativas
+        )
+    return serie_id, len(ocurrencias), solapes
+
+
+@perfilado
+def obtener_serie(serie_id: int) -> Optional[Dict[str, Any]]:
+    with conexion() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute(
+            """
+            SELECT s.*,
+                   (SELECT COUNT(*) FROM reservas r WHERE r.serie_id = s.id) AS ocurrencias
+            FROM series_reserva s
+            WHERE s.id = ?
+            """,
+            (serie_id,),
+        )
+        serie = _fila_tipada(cur.fetchone())
+    if serie is not None:
+        serie["hasta"] = date.fromisoformat(serie["hasta"])
+        serie["dias_semana"] = [int(d) for d in (serie["dias_semana"] or "").split(",") if d]
+        serie["excepciones"] = [date.fromisoformat(d) for d in (serie["excepciones"] or "").split(",") if d]
+    return serie
+
+
+def _quitar_ocurrencias(conn: sqlite3.Connection, serie_id: int, desde: Optional[datetime]) -> list[tuple]:
+    # Sólo las vigentes: las archivadas quedan en reservas_archivo
+    desde_epoch_ = a_epoch(desde) if desde is not None else None
+    condicion = "serie_id = ? AND fecha_inicio >= COALESCE(?, fecha_inicio)"
+    filas = conn.execute(
+        f"SELECT instrumento_id, usuario, estado, fecha_inicio, fecha_fin FROM reservas WHERE {condicion}",
+        (serie_id, desde_epoch_),
+    ).fetchall()
+    conn.execute(f"DELETE FROM reservas WHERE {condicion}", (serie_id, desde_epoch_))
+    return [(-1,) + tuple(fila) for fila in filas]
+
+
+def _dias_archivados(conn: sqlite3.Connection, serie_id: int) -> set[date]:
+    return {
+        desde_epoch(row[0]).date()
+        for row in conn.execute("SELECT fecha_inicio FROM reservas_archivo WHERE serie_id = ?", (serie_id,))
+    }
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def actualizar_serie(
+    serie_id: int,
+    instrumento_id: int,
+    usuario: str,
+    fecha_inicio: datetime,
+    fecha_fin: datetime,
+    frecuencia: str,
+    hasta: date,
+    intervalo: int = 1,
+    dias_semana: Optional[Iterable[int]] = None,
+    excepciones: Iterable[date] = (),
+    comentario: str = "",
+    estado: str = "Confirmada",
+    permitir_tentativas: bool = True,
+    desde: Optional[datetime] = None,
+) -> tuple[int, list[Dict[str, Any]]]:
+    """Reemplaza las ocurrencias de la serie (las que empiezan desde `desde`, o todas).
+
+    Las ocurrencias editadas una por una también se reemplazan; las archivadas
+    no se tocan y sus días no se vuelven a generar. Devuelve
+    (ocurrencias nuevas, solapes tolerados); si hay choques bloqueantes no
+    cambia nada y se lanza SerieSolapada.
+    """
+    excepciones = list(excepciones)
+    ocurrencias = expandir_serie(
+        fecha_inicio, fecha_fin, frecuencia, hasta, intervalo, dias_semana, excepciones
+    )
+    if desde is not None:
+        ocurrencias = [o for o in ocurrencias if o[0] >= desde]
+    dias, excepciones_txt = _valores_regla(dias_semana, excepciones)
+
+    with conexion() as conn:
+        _iniciar_escritura(conn)
+        if conn.execute("SELECT 1 FROM series_reserva WHERE id = ?", (serie_id,)).fetchone() is None:
+            raise ValueError(f"No existe la serie {serie_id}")
+        # Primero se quitan las ocurrencias viejas, así no chocan con las nuevas
+        movimientos = _quitar_ocurrencias(conn, serie_id, desde)
+        archivados = _dias_archivados(conn, serie_id)
+        if archivados:
+            ocurrencias = [o for o in ocurrencias if o[0].date() not in archivados]
+        conn.execute(
+            """
+            UPDATE series_reserva
+            SET instrumento_id = ?, usuario = ?, frecuencia = ?, intervalo = ?,
+                dias_semana = ?, fecha_inicio = ?, fecha_fin = ?, hasta = ?,
+                excepciones = ?, comentario = ?, estado = ?
+            WHERE id = ?
+            """,
+            (
+                instrumento_id,
+                usuario,
+                frecuencia,
+                intervalo,
+                dias,
+                a_epoch(fecha_inicio),
+                a_epoch(fecha_fin),
+                hasta.isoformat(),
+                excepciones_txt,
+                comentario,
+                estado,
+                serie_id,
+            ),
+        )
+        solapes = []
+        if ocurrencias:
+            solapes = _insertar_ocurrencias(
+                conn, serie_id, instrumento_id, usuario, ocurrencias, comentario, estado, permitir_tentativas
+            )
+        _actualizar_uso_diario(conn, movimientos)
+    return len(ocurrencias), solapes
+
+
+@perfilado
+@modifica_datos
+@encolar_escritura
+def cancelar_serie(serie_id: int, desde: Optional[datetime] = None) -> int:
+    """Marca como canceladas las ocurrencias de la serie (desde `desde`, o todas)."""
+    desde_epoch_ = a_epoch(desde) if desde is not None else None
+    with conexion() as conn:
+        _iniciar_escritura(conn)
+        condicion = """
+            serie_id = ? AND fecha_inicio >= COALESCE(?, fecha_inicio)
+            AND COALESCE(estado, 'Confirmada') != 'Cancelada'
+        """
+        filas = conn.execute(
+            f"SELECT instrumento_id, usuario, estado, fecha_inicio, fecha_fin FROM reservas WHERE {condicion}",
+            (serie_id, desde_epoch_),
+        ).fetchall()
+        conn.execute(f"UPDATE reservas SET estado = 'Cancelada' WHERE {condicion}", (serie_id, desde_epoch_))
+        conn.execute("UPDATE series_reserva SET estado = 'Cancelada' WHERE id = ?", (serie_id,))
+        movimientos = []
+        for instrumento_id, usuario, estado, inicio, fin in filas:
+            movimientos.append((-1, instrumento_id, usuario, estado, inicio, fin))
+            movimientos.append((1, instrumento_id, usuario, "Cancelada", inicio, fin))
+        _actualizar_uso_diario(conn, movimientos)
+    return len(filas)
+
+
+# ---------- Archivo de reservas ----------
+# Las reservas terminadas antes de una fecha de corte, y las canceladas, se
+# mueven a reservas_archivo: el listado, los solapamientos y la disponibilidad
+# sólo recorren las reservas vigentes. Las archivadas se consultan y exportan
+# con archivadas=True y siguen contando en las estadísticas de uso.
+ARCHIVO_ANTIGUEDAD_DIAS = 365
+ARCHIVO_FILAS_POR_LOTE = 2000
+
+
+def _condicion_archivo(incluir_canceladas: bool) -> str:
+    if incluir_canceladas:
+        return "fecha_fin < ? OR estado = 'Cancelada'"
+    return "fecha_fin < ?"
+
+
+@perfilado
+@modifica_datos
+def archivar_reservas(terminadas_antes_de: datetime, incluir_canceladas: bool = True) -> int:
+    """Mueve al archivo las reservas terminadas antes del corte (y las canceladas). Devuelve cuántas."""
+    if terminadas_antes_de > datetime.now():
+        raise ValueError("La fecha de corte no puede ser futura.")
+
+    condicion = _condicion_archivo(incluir_canceladas)
+    columnas = ", ".join(COLUMNAS_RESERVAS + ["serie_id"])
+
+    movidas = 0
+    ultimo_id = 0
+    while True:
+        # Un lote por transacción: el lock de escritura se suelta entre lotes
+        # y la app sigue aceptando reservas mientras se archiva. Cada lote
+        # sigue recorriendo por id desde donde terminó el anterior.
+        with conexion() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [
+                row[0]
+                for row in conn.execute(
+                    f"SELECT id FROM reservas WHERE id > ? AND ({condicion}) ORDER BY id LIMIT ?",
+                    (ultimo_id, a_epoch(terminadas_antes_de), ARCHIVO_FILAS_POR_LOTE),
+                )
+            ]
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+            lote = json.dumps(ids)
+            conn.execute(
+                f"""
+                INSERT INTO reservas_archivo ({columnas}, fecha_archivado)
+                SELECT {columnas}, ? FROM reservas
+                WHERE id IN (SELECT value FROM json_each(?))
+                """,
+                (ahora_epoch(), lote),
+            )
+            conn.execute("DELETE FROM reservas WHERE id IN (SELECT value FROM json_each(?))", (lote,))
+        movidas += len(ids)
+    return movidas
+
+
+@perfilado
+def contar_archivables(terminadas_antes_de: datetime, incluir_canceladas: bool = True) -> int:
+    return _contar_archivables(version_datos(), a_epoch(terminadas_antes_de), incluir_canceladas)
+
+
+@cache_lecturas
+def _contar_archivables(version: int, corte: int, incluir_canceladas: bool) -> int:
+    # Se llama en cada recarga de la barra lateral. El OR de
+    # _condicion_archivo recorre la tabla entera; partido en dos rangos
+    # disjuntos cada conteo usa su índice.
+    with conexion() as conn:
+        n = conn.execute("SELECT COUNT(*) FROM reservas WHERE fecha_fin < ?", (corte,)).fetchone()[0]
+        if incluir_canceladas:
+            n += conn.execute(
+                "SELECT COUNT(*) FROM reservas WHERE estado = 'Cancelada' AND fecha_fin >= ?", (corte,)
+            ).fetchone()[0]
+    return int(n)
+
+
+# ---------- Estadísticas de uso ----------
+# uso_diario acumula horas reservadas por día, instrumento, usuario y estado.
+# Las funciones que escriben reservas la actualizan en su misma transacción
+# (sumando la reserva nueva y restando la anterior), así las estadísticas
+# nunca recorren la tabla reservas completa.
+def _fecha_reserva(valor: Any) -> datetime:
+    if isinstance(valor, datetime):
+        return valor
+    if isinstance(valor, str):
+        # Reservas anteriores a la migración a epoch
+        return datetime.strptime(valor, FORMATO_FECHA)
+    return desde_epoch(valor)
+
+
+def _horas_por_dia(inicio: datetime, fin: datetime) -> Iterator[tuple[str, float]]:
+    dia = datetime.combine(inicio.date(), time(0, 0))
+    while dia < fin:
+        siguiente = dia + timedelta(days=1)
+        horas = (min(fin, siguiente) - max(inicio, dia)).total_seconds() / 3600
+        if horas > 0:
+            yield dia.strftime("%Y-%m-%d"), horas
+        dia = siguiente
+
+
+def _actualizar_uso_diario(conn: sqlite3.Connection, movimientos: Iterable[tuple]):
+    """Aplica movimientos (signo, instrumento_id, usuario, estado, inicio, fin) a uso_diario."""
+    acumulado: Dict[tuple, list] = {}
+    for signo, instrumento_id, usuario, estado, inicio, fin in movimientos:
+        for dia, horas in _horas_por_dia(_fecha_reserva(inicio), _fecha_reserva(fin)):
+            clave = (dia, int(instrumento_id), usuario, estado or "Confirmada")
+            valores = acumulado.setdefault(clave, [0.0, 0])
+            valores[0] += signo * horas
+            valores[1] += signo
+
+    conn.executemany(
+        """
+        INSERT INTO uso_diario (dia, instrumento_id, usuario, estado, horas, reservas)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dia, instrumento_id, usuario, estado) DO UPDATE
+        SET horas = horas + excluded.horas,
+            reservas = reservas + excluded.reservas
+        """,
+        [clave + tuple(valores) for clave, valores in acumulado.items() if valores[1] != 0 or valores[0] != 0],
+    )
+    conn.executemany(
+        """
+        DELETE FROM uso_diario
+        WHERE dia = ? AND instrumento_id = ? AND usuario = ? AND estado = ? AND reservas <= 0
+        """,
+        [clave for clave, valores in acumulado.items() if valores[1] < 0],
+    )
+
+
+def _movimiento_reserva(
+    conn: sqlite3.Connection, reserva_id: int, signo: int, tabla: str = "reservas"
+) -> list[tuple]:
+    row = conn.execute(
+        f"SELECT instrumento_id, usuario, estado, fecha_inicio, fecha_fin FROM {tabla} WHERE id = ?",
+        (reserva_id,),
+    ).fetchone()
+    return [(signo,) + tuple(row)] if row else []
+
+
+def _recalcular_uso_diario(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM uso_diario")
+    # Las reservas archivadas siguen contando en las estadísticas. Durante las
+    # migraciones anteriores al archivo la tabla todavía no existe.
+    tablas = ["reservas"]
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reservas_archivo'").fetchone():
+        tablas.append("reservas_archivo")
+    cur = conn.execute(
+        " UNION ALL ".join(
+            f"SELECT instrumento_id, usuario, estado, fecha_inicio, fecha_fin FROM {tabla}" for tabla in tablas
+        )
+    )
+    while True:
+        bloque = cur.fetchmany(EXPORT_FILAS_POR_BLOQUE)
+        if not bloque:
+            break
+        _actualizar_uso_diario(conn, [(1,) + tuple(row) for row in bloque])
+
+
+@perfilado
+@modifica_datos
+def recalcular_estadisticas_uso():
+    with conexion() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _recalcular_uso_diario(conn)
+
+
+PERIODOS_USO = {
+    "semana": "date(u.dia, '-6 days', 'weekday 1')",  # lunes de la semana
+    "mes": "strftime('%Y-%m-01', u.dia)",
+}
+
+DIMENSIONES_USO = {
+    "instrumento": "'[ID ' || i.id || '] ' || i.instrumento",
+    "grupo_unidad": "COALESCE(NULLIF(i.grupo_unidad, ''), '(sin grupo)')",
+    "usuario": "u.usuario",
+}
+
+
+@perfilado
+def cargar_uso(
+    desde: date,
+    hasta: date,
+    periodo: str = "semana",
+    dimension: str = "instrumento",
+    estados: tuple[str, ...] = ("Confirmada", "Tentativa"),
+) -> pd.DataFrame:
+    """Horas reservadas por período, dimensión y estado, leídas de uso_diario."""
+    return _cargar_uso(version_datos(), desde, hasta, periodo, dimension, tuple(estados))
+
+
+@cache_lecturas
+def _cargar_uso(
+    version: int,
+    desde: date,
+    hasta: date,
+    periodo: str,
+    dimension: str,
+    estados: tuple[str, ...],
+) -> pd.DataFrame:
+    if not estados:
+        return pd.DataFrame(columns=["periodo", "dimension", "estado", "horas", "reservas"])
+    expr_periodo = PERIODOS_USO[periodo]
+    expr_dimension = DIMENSIONES_USO[dimension]
+    query = f"""
+    SELECT {expr_periodo} AS periodo,
+           {expr_dimension} AS dimension,
+           u.estado,
+           SUM(u.horas) AS horas,
+           SUM(u.reservas) AS reservas
+    FROM uso_diario u
+    JOIN instrumentos i ON i.id = u.instrumento_id
+    WHERE u.dia >= ? AND u.dia <= ?
+      AND u.estado IN ({', '.join('?' * len(estados))})
+    GROUP BY periodo, dimension, u.estado
+    ORDER BY periodo
+    """
+    params = [desde.strftime("%Y-%m-%d"), hasta.strftime("%Y-%m-%d"), *estados]
+    with conexion() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    df["periodo"] = pd.to_datetime(df["periodo"])
+    return df
+
+
+# ---------- Disponibilidad ----------
+@perfilado
+def cargar_reservas_ventana(
+    desde: datetime,
+    hasta: datetime,
+    instrumento_ids: Optional[list[int]] = None,
+) -> pd.DataFrame:
+    """Reservas que se solapan con [desde, hasta), opcionalmente de algunos instrumentos."""
+    ids = tuple(sorted(instrumento_ids)) if instrumento_ids is not None else None
+    return _cargar_reservas_ventana(version_datos(), desde, hasta, ids)
+
+
+@cache_lecturas
+def _cargar_reservas_ventana(
+    version: int,
+    desde: datetime,
+    hasta: datetime,
+    instrumento_ids: Optional[tuple[int, ...]],
+) -> pd.DataFrame:
+    condiciones = ["r.fecha_fin > ?", "r.fecha_inicio < ?"]
+    params: list[Any] = [a_epoch(desde), a_epoch(hasta)]
+    if instrumento_ids is not None:
+        if not instrumento_ids:
+            return pd.DataFrame(columns=["id", "instrumento_id", "instrumento", "usuario", "fecha_inicio", "fecha_fin", "estado"])
+        condiciones.append(f"r.instrumento_id IN ({', '.join('?' * len(instrumento_ids))})")
+        params.extend(instrumento_ids)
+
+    query = f"""
+    SELECT r.id, r.instrumento_id, i.instrumento, r.usuario,
+           {columnas_legibles("r", ["fecha_inicio", "fecha_fin"])},
+           COALESCE(r.estado, 'Confirmada') AS estado
+    FROM reservas r
+    JOIN instrumentos i ON r.instrumento_id = i.id
+    WHERE {' AND '.join(condiciones)}
+    """
+    with conexion() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return _tipar_columnas(df)
+
+
+def ocupacion_por_franja(
+    reservas: pd.DataFrame,
+    instrumento_ids: list[int],
+    desde: datetime,
+    hasta: datetime,
+    paso: timedelta,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Cantidad de reservas activas por instrumento y franja horaria.
+
+    Devuelve (inicio de cada franja, matriz instrumentos x franjas). Cada
+    reserva suma +1 en la franja donde empieza y -1 en la que termina sobre
+    un arreglo de diferencias; una suma acumulada por fila da la ocupación.
+    Así el costo es O(reservas + instrumentos x franjas), sin bucles en Python.
+    """
+    t0 = np.datetime64(desde, "s")
+    paso_np = np.timedelta64(int(paso.total_seconds()), "s")
+    n_franjas = max(1, int(np.ceil((np.datetime64(hasta, "s") - t0) / paso_np)))
+    inicios_franja = t0 + np.arange(n_franjas) * paso_np
+
+    diferencias = np.zeros((len(instrumento_ids), n_franjas + 1), dtype=np.int32)
+    activas = reservas[reservas["estado"] != "Cancelada"]
+    if len(activas):
+        filas = pd.Index(instrumento_ids).get_indexer(activas["instrumento_id"])
+        ini = (activas["fecha_inicio"].to_numpy("datetime64[s]") - t0) / paso_np
+        fin = (activas["fecha_fin"].to_numpy("datetime64[s]") - t0) / paso_np
+        # Una franja cuenta como ocupada si la reserva la toca aunque sea en parte
+        a = np.clip(np.floor(ini), 0, n_franjas).astype(np.int64)
+        b = np.clip(np.ceil(fin), 0, n_franjas).astype(np.int64)
+        validas = (filas >= 0) & (b > a)
+        np.add.at(diferencias, (filas[validas], a[validas]), 1)
+        np.add.at(diferencias, (filas[validas], b[validas]), -1)
+
+    ocupacion = np.cumsum(diferencias, axis=1)[:, :n_franjas]
+    return inicios_franja, ocupacion
+
+
+# ---------- Exportación ----------
+# Las exportaciones leen la consulta por bloques (fetchmany) y los escriben a
+# un archivo temporal en disco, sin armar el resultado completo en memoria.
+# La UI las pasa a st.download_button como callable, así sólo se generan
+# cuando alguien efectivamente hace clic en descargar.
+EXPORT_FILAS_POR_BLOQUE = 5000
+XLSX_MAX_FILAS_HOJA = 1_048_575  # límite de Excel, sin contar el encabezado
+
+FORMATOS_EXPORTACION = {
+    "CSV": ("csv", "text/csv", None),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", "pyarrow"),
+    "Excel (XLSX)": (
+        "xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "openpyxl",
+    ),
+}
+
+
+def formatos_disponibles() -> list[str]:
+    # Parquet y XLSX dependen de paquetes opcionales
+    return [
+        formato
+        for formato, (_ext, _mime, modulo) in FORMATOS_EXPORTACION.items()
+        if modulo is None or importlib.util.find_spec(modulo) is not None
+    ]
+
+
+def _escribir_csv(bloques: Iterator[pd.DataFrame], archivo: BinaryIO, hoja: str):
+    for n, bloque in enumerate(bloques):
+        archivo.write(bloque.to_csv(index=False, header=n == 0).encode("utf-8"))
+
+
+def _escribir_parquet(bloques: Iterator[pd.DataFrame], archivo: BinaryIO, hoja: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor = None
+    esquema = None
+    try:
+        for bloque in bloques:
+            if esquema is None:
+                # El esquema sale del primer bloque: enteros y reales se
+                # mantienen, el resto (incluidas columnas vacías) es texto
+                campos = []
+                for columna, tipo in bloque.dtypes.items():
+                    if pd.api.types.is_integer_dtype(tipo):
+                        campos.append(pa.field(columna, pa.int64()))
+                    elif pd.api.types.is_float_dtype(tipo) and bloque[columna].notna().any():
+                        campos.append(pa.field(columna, pa.float64()))
+                    else:
+                        campos.append(pa.field(columna, pa.string()))
+                esquema = pa.schema(campos)
+                escritor = pq.ParquetWriter(archivo, esquema, compression="zstd")
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def _escribir_xlsx(bloques: Iterator[pd.DataFrame], archivo: BinaryIO, hoja: str):
+    from openpyxl import Workbook
+
+    # write_only escribe las filas en streaming en lugar de mantener el libro en memoria
+    libro = Workbook(write_only=True)
+    hoja_actual = None
+    filas_en_hoja = 0
+    n_hoja = 0
+    for bloque in bloques:
+        bloque = bloque.astype(object).where(bloque.notna(), None)
+        for fila in bloque.itertuples(index=False, name=None):
+            if hoja_actual is None or filas_en_hoja >= XLSX_MAX_FILAS_HOJA:
+                n_hoja += 1
+                hoja_actual = libro.create_sheet(hoja if n_hoja == 1 else f"{hoja} ({n_hoja})")
+                hoja_actual.append(list(bloque.columns))
+                filas_en_hoja = 0
+            hoja_actual.append(list(fila))
+            filas_en_hoja += 1
+    if hoja_actual is None:
+        libro.create_sheet(hoja)
+    libro.save(archivo)
+
+
+_ESCRITORES = {
+    "CSV": _escribir_csv,
+    "Parquet": _escribir_parquet,
+    "Excel (XLSX)": _escribir_xlsx,
+}
+
+
+def _exportar(
+    query: str,
+    params: list[Any],
+    formato: str,
+    hoja: str,
+    excluir_columnas: tuple[str, ...] = (),
+) -> BinaryIO:
+    archivo = tempfile.TemporaryFile()
+    with conexion() as conn:
+        bloques = pd.read_sql_query(query, conn, params=params, chunksize=EXPORT_FILAS_POR_BLOQUE)
+        bloques = (_enteros_nulables(b) for b in bloques)
+        if excluir_columnas:
+            bloques = (b.drop(columns=list(excluir_columnas), errors="ignore") for b in bloques)
+        _ESCRITORES[formato](bloques, archivo, hoja)
+    archivo.seek(0)
+    return archivo
+
+
+def nombre_exportacion(base: str, formato: str) -> str:
+    return f"{base}.{FORMATOS_EXPORTACION[formato][0]}"
+
+
+def mime_exportacion(formato: str) -> str:
+    return FORMATOS_EXPORTACION[formato][1]
+
+
+@perfilado
+def exportar_instrumentos(
+    formato: str,
+    filtro_grupo: str = "",
+    filtro_investigador: str = "",
+    filtro_instrumento: str = "",
+    busqueda: str = "",
+) -> BinaryIO:
+    query, params = consulta_instrumentos(filtro_grupo, filtro_investigador, filtro_instrumento, busqueda)
+    return _exportar(query, params, formato, "Instrumentos", excluir_columnas=("foto_path",))
+
+
+@perfilado
+def exportar_reservas(formato: str, instrumento_id: Optional[int] = None, archivadas: bool = False) -> BinaryIO:
+    query, params = consulta_reservas(instrumento_id, archivadas)
+    return _exportar(query, params, formato, "Reservas archivadas" if archivadas else "Reservas")
+
+
+# ---------- Importación masiva ----------
+# Una planilla se valida completa (obligatorios, enumeraciones, fechas,
+# instrumentos existentes y solapamientos) y las filas válidas se insertan
+# con executemany en una sola transacción. En modo simulación se hace todo
+# lo mismo pero se descarta la transacción al final.
+CAMPOS_IMPORTACION_INSTRUMENTOS = {
+    # campo: obligatorio
+    "grupo_unidad": False,
+    "responsable": False,
+    "investigador_grupo": True,
+    "instrumento": True,
+    "numero_inventario": False,
+    "reserva_uso": False,
+    "estado": False,
+    "ubicacion": False,
+    "descripcion": False,
+}
+
+CAMPOS_IMPORTACION_RESERVAS = {
+    "instrumento_id": True,
+    "usuario": True,
+    "fecha_inicio": True,
+    "fecha_fin": True,
+    "comentario": False,
+    "estado": False,
+}
+
+# Encabezados alternativos que se reconocen al sugerir la correspondencia
+# (los mismos textos que muestran los formularios)
+ALIAS_CAMPOS_IMPORTACION = {
+    "grupo_unidad": ["Grupo / Unidad", "Grupo", "Unidad"],
+    "investigador_grupo": ["Investigador / Grupo", "Investigador"],
+    "numero_inventario": ["Número de inventario", "N° inventario", "Inventario"],
+    "reserva_uso": ["Reserva de uso"],
+    "estado": ["Estado del instrumento", "Estado de la reserva"],
+    "ubicacion": ["Ubicación"],
+    "descripcion": ["Descripción / Observaciones", "Descripción", "Observaciones"],
+    "instrumento_id": ["ID instrumento", "ID"],
+    "usuario": ["Usuario solicitante"],
+    "fecha_inicio": ["Fecha inicio", "Inicio"],
+    "fecha_fin": ["Fecha fin", "Fin"],
+}
+
+IMPORTACION_FILAS_VISTA_PREVIA = 50
+
+
+def leer_planilla(archivo) -> pd.DataFrame:
+    # Todo se lee como texto: la validación decide cómo interpretar cada campo
+    if Path(archivo.name).suffix.lower() in (".xlsx", ".xlsm"):
+        return pd.read_excel(archivo, dtype=str).fillna("")
+    return pd.read_csv(archivo, dtype=str, keep_default_na=False, sep=None, engine="python")
+
+
+def _normalizar_nombre(texto: str) -> str:
+    sin_tildes = unicodedata.normalize("NFKD", str(texto)).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", sin_tildes.lower()).strip("_")
+
+
+def mapeo_sugerido(columnas: list[str], campos: Dict[str, bool]) -> Dict[str, str]:
+    normalizadas = {_normalizar_nombre(c): c for c in columnas}
+    mapeo = {}
+    for campo in campos:
+        for nombre in [campo] + ALIAS_CAMPOS_IMPORTACION.get(campo, []):
+            columna = normalizadas.get(_normalizar_nombre(nombre))
+            if columna is not None and columna not in mapeo.values():
+                mapeo[campo] = columna
+                break
+    return mapeo
+
+
+def _columna(df: pd.DataFrame, mapeo: Dict[str, str], campo: str) -> pd.Series:
+    if campo not in mapeo:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[mapeo[campo]].fillna("").astype(str).str.strip()
+
+
+def _registrar_errores(errores: list[Dict[str, Any]], mascara: pd.Series, campo: str, valores: pd.Series, mensaje: str):
+    # La fila se informa como en la planilla: 1 es el encabezado
+    for idx in mascara[mascara].index:
+        errores.append({"fila": int(idx) + 2, "campo": campo, "valor": valores.at[idx], "error": mensaje})
+
+
+def _validar_obligatorios(
+    df: pd.DataFrame,
+    mapeo: Dict[str, str],
+    campos: Dict[str, bool],
+    errores: list[Dict[str, Any]],
+) -> Dict[str, pd.Series]:
+    columnas = {campo: _columna(df, mapeo, campo) for campo in campos}
+    for campo, obligatorio in campos.items():
+        if obligatorio:
+            _registrar_errores(errores, columnas[campo] == "", campo, columnas[campo], "Campo obligatorio vacío")
+    return columnas
+
+
+def _validar_enumeracion(
+    valores: pd.Series,
+    opciones: list[str],
+    defecto: str,
+    campo: str,
+    errores: list[Dict[str, Any]],
+) -> pd.Series:
+    # Sin distinguir mayúsculas; se guarda la forma canónica. Vacío = defecto.
+    canonicos = {o.lower(): o for o in opciones}
+    resultado = valores.str.lower().map(canonicos)
+    resultado = resultado.where(valores != "", defecto)
+    _registrar_errores(
+        errores, resultado.isna(), campo, valores, f"Valor no válido; opciones: {', '.join(opciones)}"
+    )
+    return resultado
+
+
+def _parsear_fechas(valores: pd.Series) -> pd.Series:
+    # Primero ISO (lo que exporta la app y lo que devuelve Excel); el resto se
+    # interpreta con el día primero, como se escribe en Argentina (dd/mm/aaaa).
+    fechas = pd.to_datetime(valores, errors="coerce", format="ISO8601")
+    resto = fechas.isna() & (valores != "")
+    if resto.any():
+        fechas[resto] = pd.to_datetime(valores[resto], errors="coerce", format="mixed", dayfirst=True)
+    return fechas
+
+
+def _resultado_importacion(
+    filas: list[tuple],
+    columnas: list[str],
+    errores: list[Dict[str, Any]],
+    insertadas: int,
+) -> Dict[str, Any]:
+    return {
+        "validas": len(filas),
+        "insertadas": insertadas,
+        "errores": pd.DataFrame(errores, columns=["fila", "campo", "valor", "error"]).sort_values("fila"),
+        "vista_previa": _vista_previa(filas[:IMPORTACION_FILAS_VISTA_PREVIA], columnas),
+    }
+
+
+def _vista_previa(filas: list[tuple], columnas: list[str]) -> pd.DataFrame:
+    vista = pd.DataFrame(filas, columns=columnas)
+    for c in COLUMNAS_FECHA.intersection(vista.columns):
+        vista[c] = pd.to_datetime(vista[c].map(desde_epoch))
+    return vista
+
+
+@perfilado
+def importar_instrumentos(
+    df: pd.DataFrame,
+    mapeo: Dict[str, str],
+    simular: bool = False,
+) -> Dict[str, Any]:
+    errores: list[Dict[str, Any]] = []
+    col = _validar_obligatorios(df, mapeo, CAMPOS_IMPORTACION_INSTRUMENTOS, errores)
+    col["reserva_uso"] = _validar_enumeracion(col["reserva_uso"], OPCIONES_RESERVA_USO, "Con reserva", "reserva_uso", errores)
+    col["estado"] = _validar_enumeracion(col["estado"], ESTADOS_INSTRUMENTO, "Operativo", "estado", errores)
+
+    filas_con_error = {e["fila"] - 2 for e in errores}
+    validas = ~df.index.isin(filas_con_error)
+    ahora = ahora_epoch()
+    columnas = list(CAMPOS_IMPORTACION_INSTRUMENTOS)
+    filas = [
+        fila + (ahora,)
+        for fila in zip(*(col[c][validas].tolist() for c in columnas))
+    ]
+
+    insertadas = 0
+    if filas and not simular:
+        with conexion() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                """
+                INSERT INTO instrumentos
+                (grupo_unidad, responsable, investigador_grupo, instrumento,
+                 numero_inventario, reserva_uso, estado, ubicacion,
+                 descripcion, fecha_registro)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                filas,
+            )
+        insertadas = len(filas)
+    if insertadas:
+        # Como @modifica_datos, pero una vista previa no vacía las cachés
+        _version_datos().incrementar()
+    return _resultado_importacion(filas, columnas + ["fecha_registro"], errores, insertadas)
+
+
+@perfilado
+def importar_reservas(
+    df: pd.DataFrame,
+    mapeo: Dict[str, str],
+    simular: bool = False,
+    permitir_tentativas: bool = True,
+) -> Dict[str, Any]:
+    errores: list[Dict[str, Any]] = []
+    col = _validar_obligatorios(df, mapeo, CAMPOS_IMPORTACION_RESERVAS, errores)
+    col["estado"] = _validar_enumeracion(col["estado"], ESTADOS_RESERVA, "Confirmada", "estado", errores)
+
+    ids = pd.to_numeric(col["instrumento_id"], errors="coerce")
+    _registrar_errores(
+        errores, ids.isna() & (col["instrumento_id"] != ""), "instrumento_id", col["instrumento_id"], "No es un número"
+    )
+    inicio = _parsear_fechas(col["fecha_inicio"])
+    fin = _parsear_fechas(col["fecha_fin"])
+    _registrar_errores(errores, inicio.isna() & (col["fecha_inicio"] != ""), "fecha_inicio", col["fecha_inicio"], "Fecha no válida")
+    _registrar_errores(errores, fin.isna() & (col["fecha_fin"] != ""), "fecha_fin", col["fecha_fin"], "Fecha no válida")
+    _registrar_errores(errores, fin <= inicio, "fecha_fin", col["fecha_fin"], "La fecha de fin debe ser posterior al inicio")
+
+    columnas = list(CAMPOS_IMPORTACION_RESERVAS)
+    with conexion() as conn:
+        # El chequeo contra la base y el INSERT van en la misma transacción.
+        # La vista previa sólo lee: una transacción diferida le da una foto
+        # fija de la base sin bloquear a los escritores mientras valida.
+        conn.execute("BEGIN" if simular else "BEGIN IMMEDIATE")
+        existentes = {row[0] for row in conn.execute("SELECT id FROM instrumentos")}
+        _registrar_errores(
+            errores,
+            ids.notna() & ~ids.isin(existentes),
+            "instrumento_id",
+            col["instrumento_id"],
+            "El instrumento no existe",
+        )
+
+        # Listas de Python: acceder fila por fila a una Series es mucho más lento
+        filas_planilla = [int(idx) + 2 for idx in df.index]
+        l_ids = ids.tolist()
+        l_inicio = list(inicio.dt.to_pydatetime())
+        l_fin = list(fin.dt.to_pydatetime())
+        l_estado = col["estado"].tolist()
+        l_usuario = col["usuario"].tolist()
+        l_comentario = col["comentario"].tolist()
+        l_texto_inicio = col["fecha_inicio"].tolist()
+
+        filas_con_error = {e["fila"] for e in errores}
+        candidatas = [i for i, fila in enumerate(filas_planilla) if fila not in filas_con_error]
+        # Barrido por instrumento en orden de inicio: basta comparar con el
+        # mayor fin ya aceptado para detectar choques dentro de la planilla.
+        candidatas.sort(key=lambda i: (l_ids[i], l_inicio[i]))
+        max_fin_confirmadas: Dict[int, datetime] = {}
+        max_fin_todas: Dict[int, datetime] = {}
+        filas: list[tuple] = []
+        movimientos: list[tuple] = []
+        for i in candidatas:
+            inst_id = int(l_ids[i])
+            estado = l_estado[i]
+            ini, fn = l_inicio[i], l_fin[i]
+            if estado != "Cancelada":
+                # Mismas reglas que _verificar_solapamientos
+                if permitir_tentativas:
+                    tope = max_fin_confirmadas.get(inst_id) if estado == "Confirmada" else None
+                else:
+                    tope = max_fin_todas.get(inst_id)
+                error = None
+                if tope is not None and ini < tope:
+                    error = "Se solapa con otra reserva de la planilla"
+                else:
+                    try:
+                        _verificar_solapamientos(conn, inst_id, ini, fn, estado, permitir_tentativas)
+                    except ReservaSolapada as e:
+                        error = str(e)
+                if error:
+                    errores.append({
+                        "fila": filas_planilla[i],
+                        "campo": "fecha_inicio",
+                        "valor": l_texto_inicio[i],
+                        "error": error,
+                    })
+                    continue
+                max_fin_todas[inst_id] = max(fn, max_fin_todas.get(inst_id, fn))
+                if estado == "Confirmada":
+                    max_fin_confirmadas[inst_id] = max(fn, max_fin_confirmadas.get(inst_id, fn))
+            filas.append((
+                inst_id,
+                l_usuario[i],
+                a_epoch(ini),
+                a_epoch(fn),
+                l_comentario[i],
+                estado,
+            ))
+            movimientos.append((1, inst_id, l_usuario[i], estado, ini, fn))
+
+        ahora = ahora_epoch()
+        if filas and not simular:
+            conn.executemany(
+                """
+                INSERT INTO reservas
+                (instrumento_id, usuario, fecha_inicio, fecha_fin,
+                 comentario, estado, fecha_registro)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [fila + (ahora,) for fila in filas],
+            )
+            _actualizar_uso_diario(conn, movimientos)
+        elif simular:
+            conn.rollback()
+    if filas and not simular:
+        _version_datos().incrementar()
+    return _resultado_importacion(filas, columnas, errores, 0 if simular else len(filas))
+
+
+# ---------- Registro de cambios (replicación) ----------
+# Los triggers de _migracion_registro_cambios anotan en `cambios` cada alta,
+# modificación y baja de TABLAS_REPLICADAS. Una réplica guarda hasta qué
+# número de secuencia aplicó; la base de origen le exporta sólo lo posterior
+# (JSON Lines comprimido con gzip) y la réplica lo aplica. Las réplicas son de
+# sólo lectura: un cambio hecho a mano en ellas tomaría un seq que después
+# llega desde el origen. Las fotos no viajan en el registro, sólo foto_path.
+CAMBIOS_FORMATO = "instrumentos-cambios"
+CAMBIOS_FORMATO_VERSION = 1
+CAMBIOS_POR_LOTE = 5000
+# Tablas cuyas filas suman en uso_diario
+_TABLAS_CON_USO = {"reservas", "reservas_archivo"}
+
+
+def _posicion_cambios(conn: sqlite3.Connection) -> int:
+    # sqlite_sequence recuerda el último seq aunque se poden los cambios
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cambios'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _origen(conn: sqlite3.Connection) -> str:
+    return conn.execute("SELECT valor FROM metadatos WHERE clave = 'origen'").fetchone()[0]
+
+
+@perfilado
+def posicion_cambios() -> Dict[str, Any]:
+    """Origen de la base y último número de secuencia registrado o aplicado."""
+    with conexion() as conn:
+        return {"origen": _origen(conn), "posicion": _posicion_cambios(conn)}
+
+
+@perfilado
+def exportar_cambios(destino: BinaryIO, desde: int = 0) -> Dict[str, Any]:
+    """Escribe en `destino` los cambios con seq > desde. Devuelve el encabezado."""
+    with conexion() as conn:
+        # Una sola transacción de lectura: encabezado y filas del mismo instante
+        conn.execute("BEGIN")
+        posicion = _posicion_cambios(conn)
+        primero = conn.execute("SELECT MIN(seq) FROM cambios").fetchone()[0]
+        if desde < posicion and (primero is None or primero > desde + 1):
+            raise ValueError(
+                f"El registro ya no tiene los cambios posteriores a {desde} (fueron podados). "
+                "Hay que copiar la base completa a la réplica."
+            )
+        encabezado = {
+            "formato": CAMBIOS_FORMATO,
+            "version": CAMBIOS_FORMATO_VERSION,
+            "origen": _origen(conn),
+            "desde": desde,
+            "hasta": max(posicion, desde),
+            "cambios": conn.execute("SELECT COUNT(*) FROM cambios WHERE seq > ?", (desde,)).fetchone()[0],
+        }
+        with gzip.open(destino, "wt", encoding="utf-8") as salida:
+            salida.write(json.dumps(encabezado) + "\n")
+            cur = conn.execute(
+                "SELECT seq, tabla, operacion, fila_id, datos, fecha FROM cambios WHERE seq > ? ORDER BY seq",
+                (desde,),
+            )
+            while True:
+                bloque = cur.fetchmany(CAMBIOS_POR_LOTE)
+                if not bloque:
+                    break
+                salida.writelines(
+                    json.dumps({"seq": seq, "tabla": tabla, "op": op, "id": fila_id, "datos": datos, "fecha": fecha})
+                    + "\n"
+                    for seq, tabla, op, fila_id, datos, fecha in bloque
+                )
+    return encabezado
+
+
+def _leer_encabezado(linea: str) -> Dict[str, Any]:
+    try:
+        encabezado = json.loads(linea)
+    except ValueError:
+        encabezado = None
+    if not isinstance(encabezado, dict) or encabezado.get("formato") != CAMBIOS_FORMATO:
+        raise ValueError("El archivo no es una exportación de cambios de instrumentos.")
+    if encabezado.get("version") != CAMBIOS_FORMATO_VERSION:
+        raise ValueError(f"Versión de formato no soportada: {encabezado.get('version')}")
+    return encabezado
+
+
+def _aplicar_cambio(
+    conn: sqlite3.Connection,
+    cambio: Dict[str, Any],
+    columnas: Dict[str, list[str]],
+    movimientos: list[tuple],
+):
+    tabla, fila_id = cambio["tabla"], int(cambio["id"])
+    if tabla not in columnas:
+        raise ValueError(f"Tabla no replicable en el registro de cambios: {tabla}")
+
+    if tabla in _TABLAS_CON_USO:
+        movimientos.extend(_movimiento_reserva(conn, fila_id, -1, tabla))
+
+    if cambio["op"] == "D":
+        conn.execute(f"DELETE FROM {tabla} WHERE id = ?", (fila_id,))
+    else:
+        fila = json.loads(cambio["datos"])
+        cols = [c for c in columnas[tabla] if c in fila]
+        conn.execute(
+            f"""
+            INSERT INTO {tabla} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})
+            ON CONFLICT (id) DO UPDATE SET {', '.join(f"{c} = excluded.{c}" for c in cols if c != "id")}
+            """,
+            [fila[c] for c in cols],
+        )
+        if tabla in _TABLAS_CON_USO:
+            movimientos.append(
+                (1, fila["instrumento_id"], fila["usuario"], fila["estado"], fila["fecha_inicio"], fila["fecha_fin"])
+            )
+
+    conn.execute(
+        "INSERT INTO cambios (seq, tabla, operacion, fila_id, datos, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+        (cambio["seq"], tabla, cambio["op"], fila_id, cambio["datos"], cambio["fecha"]),
+    )
+
+
+def _aplicar_lote(
+    conn: sqlite3.Connection,
+    lote: list[Dict[str, Any]],
+    encabezado: Dict[str, Any],
+    columnas: Dict[str, list[str]],
+) -> tuple[int, int]:
+    conn.execute("BEGIN IMMEDIATE")
+    posicion = _posicion_cambios(conn)
+    origen = _origen(conn)
+    if encabezado["origen"] != origen:
+        if posicion > 0:
+            raise ValueError(
+                "La exportación viene de otra base de origen y esta base ya tiene cambios propios."
+            )
+        # Réplica nueva y vacía: adopta el origen
+        conn.execute("UPDATE metadatos SET valor = ? WHERE clave = 'origen'", (encabezado["origen"],))
+    if encabezado["desde"] > posicion:
+        raise ValueError(
+            f"Faltan cambios: la réplica está en {posicion} y la exportación empieza después de "
+            f"{encabezado['desde']}. Exportá desde {posicion}."
+        )
+
+    conn.execute("INSERT INTO metadatos (clave, valor) VALUES ('aplicando_cambios', '1')")
+    movimientos: list[tuple] = []
+    aplicados = 0
+    for cambio in lote:
+        # Volver a aplicar una exportación ya aplicada no repite nada
+        if cambio["seq"] <= posicion:
+            continue
+        _aplicar_cambio(conn, cambio, columnas, movimientos)
+        aplicados += 1
+    conn.execute("DELETE FROM metadatos WHERE clave = 'aplicando_cambios'")
+    _actualizar_uso_diario(conn, movimientos)
+    return aplicados, len(lote) - aplicados
+
+
+@perfilado
+@modifica_datos
+def aplicar_cambios(origen: BinaryIO) -> Dict[str, int]:
+    """Aplica una exportación de exportar_cambios(). Un lote de CAMBIOS_POR_LOTE por transacción."""
+    aplicados = omitidos = 0
+    with gzip.open(origen, "rt", encoding="utf-8") as entrada, conexion() as conn:
+        encabezado = _leer_encabezado(entrada.readline())
+        columnas = {
+            tabla: [row[1] for row in conn.execute(f"PRAGMA table_info({tabla})")]
+            for tabla in TABLAS_REPLICADAS
+        }
+        lote: list[Dict[str, Any]] = []
+        for linea in entrada:
+            lote.append(json.loads(linea))
+            if len(lote) == CAMBIOS_POR_LOTE:
+                a, o = _aplicar_lote(conn, lote, encabezado, columnas)
+                conn.commit()
+                aplicados, omitidos, lote = aplicados + a, omitidos + o, []
+        a, o = _aplicar_lote(conn, lote, encabezado, columnas)
+        aplicados, omitidos = aplicados + a, omitidos + o
+        posicion = _posicion_cambios(conn)
+    return {"aplicados": aplicados, "omitidos": omitidos, "posicion": posicion}
+
+
+@perfilado
+def podar_cambios(hasta: int) -> int:
+    """Borra del registro los cambios con seq <= hasta (ya aplicados en todas las réplicas)."""
+    with conexion() as conn:
+        return conn.execute("DELETE FROM cambios WHERE seq <= ?", (hasta,)).rowcount
+
+
+# ---------- Copias de seguridad ----------
+# Cada copia es una carpeta BACKUP_DIR/<AAAAMMDD-HHMMSS> con la base copiada
+# por la API de backup de SQLite y un manifiesto (manifiesto.json) con el
+# hash de la base y de cada foto. Las fotos se guardan una sola vez en
+# BACKUP_DIR/fotos, nombradas por su SHA-256: una copia nueva sólo agrega las
+# fotos nuevas o modificadas, y cada manifiesto sabe qué versión le toca.
+# La copia que se hace antes de restaurar lleva el prefijo "previa-" y queda
+# fuera de la rotación: es la vuelta atrás de una restauración equivocada y
+# sólo se borra a mano.
+BACKUP_PAGINAS_POR_PASO = 256
+BACKUP_PAUSA_SEGUNDOS = 0.02
+# Si otra conexión escribe durante la copia por pasos, SQLite la reinicia.
+# Pasados estos reinicios se copia de una vez: en WAL una lectura larga no
+# frena a los que escriben.
+BACKUP_MAX_REINICIOS = 3
+BACKUP_RETENER = int(os.environ.get("INSTRUMENTOS_COPIAS_RETENER", 7))
+BACKUP_INTERVALO_HORAS = float(os.environ.get("INSTRUMENTOS_COPIAS_HORAS", 24))
+BACKUP_REVISION_SEGUNDOS = 300
+# Un bloqueo más viejo que esto quedó de un proceso que murió a mitad de copia
+BACKUP_BLOQUEO_VENCE_SEGUNDOS = 6 * 3600
+BACKUP_MANIFIESTO = "manifiesto.json"
+BACKUP_BASE = "instrumentos.db"
+BACKUP_PREFIJO_PREVIA = "previa-"
+_PATRON_COPIA = re.compile(rf"^({BACKUP_PREFIJO_PREVIA})?\d{{8}}-\d{{6}}(-\d+)?$")
+
+
+class CopiaEnCurso(Exception):
+    pass
+
+
+class _ReiniciosExcedidos(Exception):
+    pass
+
+
+def _almacen_fotos() -> Path:
+    return BACKUP_DIR / "fotos"
+
+
+def _bloqueo_vencido(bloqueo: Path) -> bool:
+    try:
+        if datetime.now().timestamp() - bloqueo.stat().st_mtime > BACKUP_BLOQUEO_VENCE_SEGUNDOS:
+            return True
+        pid = int(bloqueo.read_text() or 0)
+    except (FileNotFoundError, ValueError):
+        return False
+    if os.name != "posix" or pid <= 0:
+        return False
+    # Proceso que se cortó a mitad de copia (p. ej. la app se detuvo)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+@contextmanager
+def _bloqueo_copias() -> Iterator[None]:
+    # Archivo creado con O_EXCL: una sola copia o restauración a la vez, aunque
+    # la app y un script corran en procesos distintos
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    bloqueo = BACKUP_DIR / ".en_curso"
+    if _bloqueo_vencido(bloqueo):
+        logger.warning("Se descarta un bloqueo de copia vencido: %s", bloqueo)
+        bloqueo.unlink(missing_ok=True)
+    try:
+        fd = os.open(bloqueo, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        raise CopiaEnCurso("Ya hay una copia de seguridad o restauración en curso.") from None
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        bloqueo.unlink(missing_ok=True)
+
+
+def _copiar_base(destino: Path) -> int:
+    """Copia la base con la API de backup, por pasos. Devuelve cuántas veces se reinició."""
+    reinicios = 0
+    restantes_previas: Optional[int] = None
+
+    def progreso(estado: int, restantes: int, total: int):
+        nonlocal reinicios, restantes_previas
+        if restantes_previas is not None and restantes > restantes_previas:
+            reinicios += 1
+            if reinicios > BACKUP_MAX_REINICIOS:
+                raise _ReiniciosExcedidos()
+        restantes_previas = restantes
+        # Entre paso y paso la base queda libre para las sesiones activas
+        sleep(BACKUP_PAUSA_SEGUNDOS)
+
+    with closing(sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)) as origen:
+        with closing(sqlite3.connect(destino)) as copia:
+            try:
+                origen.backup(copia, pages=BACKUP_PAGINAS_POR_PASO, progress=progreso)
+            except _ReiniciosExcedidos:
+                origen.backup(copia)
+            # Un único archivo, sin -wal ni -shm al lado
+            copia.execute("PRAGMA journal_mode=DELETE")
+    return reinicios
+
+
+def _manifiesto(carpeta: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads((carpeta / BACKUP_MANIFIESTO).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _copiar_fotos(anteriores: Dict[str, Dict[str, Any]]) -> tuple[Dict[str, Dict[str, Any]], int]:
+    """Guarda en el almacén las fotos nuevas o modificadas. Devuelve (fotos, copiadas)."""
+    almacen = _almacen_fotos()
+    almacen.mkdir(parents=True, exist_ok=True)
+    fotos: Dict[str, Dict[str, Any]] = {}
+    copiadas = 0
+    if not IMAGES_DIR.exists():
+        return fotos, copiadas
+
+    for ruta in IMAGES_DIR.iterdir():
+        # Los nombres con punto son subidas o recompresiones a medio escribir
+        if ruta.name.startswith(".") or not ruta.is_file():
+            continue
+        info = ruta.stat()
+        previa = anteriores.get(ruta.name)
+        if (
+            previa is not None
+            and previa["bytes"] == info.st_size
+            and previa["mtime_ns"] == info.st_mtime_ns
+            and (almacen / previa["sha256"]).exists()
+        ):
+            fotos[ruta.name] = previa
+            continue
+
+        sha = _hash_archivo(ruta)
+        destino = almacen / sha
+        if not destino.exists():
+            tmp = almacen / f".{sha}_{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(ruta, tmp)
+            os.replace(tmp, destino)
+            copiadas += 1
+        fotos[ruta.name] = {"sha256": sha, "bytes": info.st_size, "mtime_ns": info.st_mtime_ns}
+    return fotos, copiadas
+
+
+def _carpetas_copias(previas: bool = False) -> list[Path]:
+    """Copias de la más vieja a la más nueva; las previas a una restauración sólo con previas=True."""
+    if not BACKUP_DIR.exists():
+        return []
+    return sorted(
+        (
+            c for c in BACKUP_DIR.iterdir()
+            if c.is_dir() and _PATRON_COPIA.match(c.name)
+            and (previas or not c.name.startswith(BACKUP_PREFIJO_PREVIA))
+        ),
+        key=lambda c: c.name.removeprefix(BACKUP_PREFIJO_PREVIA),
+    )
+
+
+def _rotar_copias(retener: int) -> int:
+    """Borra las copias más viejas y las fotos del almacén que ya no usa ninguna."""
+    # Con el bloqueo tomado, cualquier carpeta oculta es de una copia cortada
+    for resto in BACKUP_DIR.glob(".*"):
+        if resto.is_dir() and _PATRON_COPIA.match(resto.name[1:]):
+            shutil.rmtree(resto, ignore_errors=True)
+    carpetas = _carpetas_copias()
+    borrar = carpetas[:-retener] if retener > 0 else []
+    for carpeta in borrar:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    en_uso = set()
+    for carpeta in _carpetas_copias(previas=True):
+        manifiesto = _manifiesto(carpeta) or {}
+        en_uso.update(f["sha256"] for f in manifiesto.get("fotos", {}).values())
+    almacen = _almacen_fotos()
+    if almacen.exists():
+        for archivo in almacen.iterdir():
+            if archivo.name not in en_uso:
+                archivo.unlink(missing_ok=True)
+    return len(borrar)
+
+
+@perfilado
+def crear_copia(retener: int = BACKUP_RETENER, previa: bool = False) -> Dict[str, Any]:
+    """Copia la base y las fotos sin detener la app. Devuelve el manifiesto.
+
+    Con previa=True la copia lleva el prefijo de las previas a una
+    restauración y la rotación no la borra.
+    """
+    with _bloqueo_copias():
+        inicio = perf_counter()
+        carpetas = _carpetas_copias(previas=True)
+        anterior = _manifiesto(carpetas[-1]) if carpetas else None
+
+        nombre = (BACKUP_PREFIJO_PREVIA if previa else "") + datetime.now().strftime("%Y%m%d-%H%M%S")
+        sufijo = 1
+        base_nombre = nombre
+        while (BACKUP_DIR / nombre).exists():
+            sufijo += 1
+            nombre = f"{base_nombre}-{sufijo}"
+        # Se arma en una carpeta oculta y se renombra al final: una copia
+        # interrumpida nunca aparece en la lista
+        tmp = BACKUP_DIR / f".{nombre}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        try:
+            reinicios = _copiar_base(tmp / BACKUP_BASE)
+            with closing(sqlite3.connect(tmp / BACKUP_BASE)) as copia:
+                resultado = copia.execute("PRAGMA quick_check").fetchone()[0]
+                esquema = version_esquema(copia)
+            if resultado != "ok":
+                raise RuntimeError(f"La copia de la base no pasó quick_check: {resultado}")
+
+            fotos, copiadas = _copiar_fotos((anterior or {}).get("fotos", {}))
+            manifiesto = {
+                "nombre": nombre,
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "esquema": esquema,
+                "base": {
+                    "archivo": BACKUP_BASE,
+                    "bytes": (tmp / BACKUP_BASE).stat().st_size,
+                    "sha256": _hash_archivo(tmp / BACKUP_BASE),
+                },
+                "fotos": fotos,
+                "fotos_copiadas": copiadas,
+                "reinicios": reinicios,
+                "segundos": round(perf_counter() - inicio, 3),
+            }
+            (tmp / BACKUP_MANIFIESTO).write_text(json.dumps(manifiesto, indent=1), encoding="utf-8")
+            os.replace(tmp, BACKUP_DIR / nombre)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        manifiesto["rotadas"] = _rotar_copias(retener)
+    logger.info(
+        "Copia %s: %d fotos nuevas, %d reinicios, %.1f s",
+        nombre, copiadas, reinicios, manifiesto["segundos"],
+    )
+    return manifiesto
+
+
+@perfilado
+def listar_copias() -> list[Dict[str, Any]]:
+    """Copias disponibles, de la más nueva a la más vieja."""
+    copias = []
+    for carpeta in reversed(_carpetas_copias(previas=True)):
+        manifiesto = _manifiesto(carpeta)
+        if manifiesto is None:
+            continue
+        copias.append({
+            "nombre": carpeta.name,
+            "fecha": datetime.fromisoformat(manifiesto["fecha"]),
+            "esquema": manifiesto["esquema"],
+            "bytes_base": manifiesto["base"]["bytes"],
+            "fotos": len(manifiesto["fotos"]),
+            "fotos_copiadas": manifiesto.get("fotos_copiadas", 0),
+        })
+    return copias
+
+
+def resumen_copias() -> tuple[int, Optional[datetime]]:
+    """(cantidad de copias, fecha de la última), sin leer los manifiestos."""
+    carpetas = _carpetas_copias()
+    if not carpetas:
+        return 0, None
+    return len(carpetas), datetime.strptime(carpetas[-1].name[:15], "%Y%m%d-%H%M%S")
+
+
+@perfilado
+def verificar_copia(nombre: str, completa: bool = True) -> list[str]:
+    """Problemas encontrados en la copia (lista vacía si está bien).
+
+    Con completa=True también se recalcula el hash de cada foto.
+    """
+    carpeta = BACKUP_DIR / nombre
+    manifiesto = _manifiesto(carpeta) if _PATRON_COPIA.match(nombre) else None
+    if manifiesto is None:
+        return [f"No existe la copia {nombre} o su manifiesto está dañado."]
+
+    problemas = []
+    base = carpeta / manifiesto["base"]["archivo"]
+    if not base.exists():
+        return [f"Falta el archivo {base.name}."]
+    if _hash_archivo(base) != manifiesto["base"]["sha256"]:
+        problemas.append("El hash de la base no coincide con el manifiesto.")
+    else:
+        with closing(sqlite3.connect(f"file:{base}?mode=ro", uri=True)) as conn:
+            resultado = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+            if resultado != ["ok"]:
+                problemas.append("integrity_check: " + "; ".join(resultado[:5]))
+            esquema = version_esquema(conn)
+        if esquema > ESQUEMA_VERSION:
+            problemas.append(f"La copia tiene esquema {esquema}, más nuevo que el de esta aplicación.")
+
+    almacen = _almacen_fotos()
+    for nombre_foto, foto in manifiesto["fotos"].items():
+        guardada = almacen / foto["sha256"]
+        if not guardada.exists():
+            problemas.append(f"Falta la foto {nombre_foto}.")
+        elif guardada.stat().st_size != foto["bytes"] or (completa and _hash_archivo(guardada) != foto["sha256"]):
+            problemas.append(f"La foto {nombre_foto} está dañada.")
+    return problemas
+
+
+@perfilado
+@modifica_datos
+def restaurar_copia(nombre: str, restaurar_fotos: bool = True) -> Dict[str, Any]:
+    """Verifica la copia y la vuelca sobre la base actual (y las fotos faltantes o distintas).
+
+    Antes se hace una copia del estado actual con el prefijo "previa-", que
+    la rotación no borra.
+    """
+    problemas = verificar_copia(nombre)
+    if problemas:
+        raise ValueError("La copia no pasó la verificación: " + " ".join(problemas[:5]))
+    previa = crear_copia(retener=0, previa=True)
+
+    manifiesto = _manifiesto(BACKUP_DIR / nombre)
+    with _bloqueo_copias():
+        base = BACKUP_DIR / nombre / manifiesto["base"]["archivo"]
+        # La API de backup escribe sobre la base en uso con el lock de
+        # escritura: las otras conexiones ven el contenido nuevo en su
+        # próxima lectura, sin reemplazar archivos por debajo del WAL
+        with closing(sqlite3.connect(f"file:{base}?mode=ro", uri=True)) as origen:
+            with closing(sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)) as destino:
+                origen.backup(destino)
+                resultado = destino.execute("PRAGMA integrity_check").fetchone()[0]
+        if resultado != "ok":
+            raise RuntimeError(
+                f"La base restaurada no pasó integrity_check ({resultado}). "
+                f"El estado anterior está en la copia {previa['nombre']}."
+            )
+
+        fotos_restauradas = 0
+        if restaurar_fotos:
+            IMAGES_DIR.mkdir(exist_ok=True)
+            almacen = _almacen_fotos()
+            for nombre_foto, foto in manifiesto["fotos"].items():
+                destino_foto = IMAGES_DIR / nombre_foto
+                if destino_foto.exists() and destino_foto.stat().st_size == foto["bytes"]:
+                    if _hash_archivo(destino_foto) == foto["sha256"]:
+                        continue
+                tmp = IMAGES_DIR / f".restaurada_{uuid.uuid4().hex}"
+                shutil.copyfile(almacen / foto["sha256"], tmp)
+                os.replace(tmp, destino_foto)
+                fotos_restauradas += 1
+
+    return {"copia": nombre, "previa": previa["nombre"], "fotos_restauradas": fotos_restauradas}
+
+
+class ProgramadorCopias:
+    """Hilo en segundo plano que hace una copia cada `intervalo_horas`."""
+
+    def __init__(self, intervalo_horas: float = BACKUP_INTERVALO_HORAS):
+        self.intervalo = timedelta(hours=intervalo_horas)
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self.ultimo_error: Optional[str] = None
+
+    def iniciar(self):
+        if self._hilo is None and self.intervalo > timedelta(0):
+            self._hilo = threading.Thread(target=self._ciclo, name="copias", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def esperar(self):
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _toca_copia(self) -> bool:
+        carpetas = _carpetas_copias()
+        if not carpetas:
+            return True
+        ultima = datetime.fromtimestamp((carpetas[-1] / BACKUP_MANIFIESTO).stat().st_mtime)
+        return datetime.now() - ultima >= self.intervalo
+
+    def _ciclo(self):
+        while True:
+            try:
+                if self._toca_copia():
+                    crear_copia()
+                self.ultimo_error = None
+            except CopiaEnCurso:
+                pass
+            except Exception as e:
+                logger.exception("Falló la copia de seguridad programada")
+                self.ultimo_error = str(e)
+            if self._detener.wait(BACKUP_REVISION_SEGUNDOS):
+                break
+
+
+@recurso_compartido
+def obtener_programador_copias() -> ProgramadorCopias:
+    return ProgramadorCopias()
+
+
+# ==============================
+# Mantenimiento
+# ==============================
+# Tareas para correr fuera de hora con mantenimiento_instrumentos.py. Ninguna
+# pasa por el escritor único: un VACUUM o un ANALYZE toman la base entera.
+MANTENIMIENTO_WORKERS = 8
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def estado_paginas() -> Dict[str, int]:
+    with conexion() as conn:
+        return {
+            "paginas": conn.execute("PRAGMA page_count").fetchone()[0],
+            "libres": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "bytes_pagina": conn.execute("PRAGMA page_size").fetchone()[0],
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+
+
+@perfilado
+def analizar_base() -> float:
+    """Actualiza las estadísticas del planificador y compacta el índice de búsqueda."""
+    inicio = perf_counter()
+    with conexion() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.execute("INSERT INTO instrumentos_fts(instrumentos_fts) VALUES ('optimize')")
+    return round(perf_counter() - inicio, 2)
+
+
+@perfilado
+def liberar_paginas(paginas: int = 0, convertir: bool = False) -> Dict[str, Any]:
+    """Devuelve al sistema las páginas libres (todas si `paginas` es 0).
+
+    Necesita auto_vacuum=INCREMENTAL. Con `convertir`, una base en otro modo
+    se pasa a INCREMENTAL con un VACUUM completo, que reescribe el archivo y
+    bloquea las escrituras mientras dura.
+    """
+    antes = estado_paginas()
+    modo = None
+    with conexion() as conn:
+        if antes["auto_vacuum"] == AUTO_VACUUM_INCREMENTAL:
+            if antes["libres"]:
+                # executescript avanza la sentencia hasta el final; execute
+                # liberaría una sola página
+                conn.executescript(f"PRAGMA incremental_vacuum({int(paginas)});")
+            modo = "incremental"
+        elif convertir:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            modo = "completo"
+    despues = estado_paginas()
+    return {
+        "modo": modo,
+        "auto_vacuum": despues["auto_vacuum"],
+        "libres_antes": antes["libres"],
+        "libres_despues": despues["libres"],
+        "bytes_liberados": (antes["paginas"] - despues["paginas"]) * despues["bytes_pagina"],
+    }
+
+
+@perfilado
+def verificar_integridad(completa: bool = True) -> list[str]:
+    """Lista de problemas de la base en uso; vacía si está sana."""
+    problemas = []
+    with conexion() as conn:
+        pragma = "integrity_check" if completa else "quick_check"
+        resultado = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+        if resultado != ["ok"]:
+            problemas.extend(f"{pragma}: {r}" for r in resultado)
+        # Las claves foráneas no se hacen cumplir, así que se revisan aquí
+        for tabla, fila, padre, _ in conn.execute("PRAGMA foreign_key_check"):
+            problemas.append(f"{tabla} fila {fila}: apunta a una fila de {padre} que no existe")
+        try:
+            # rank = 1 compara además el índice con la tabla instrumentos
+            conn.execute("INSERT INTO instrumentos_fts(instrumentos_fts, rank) VALUES ('integrity-check', 1)")
+        except sqlite3.DatabaseError as e:
+            problemas.append(
+                f"Índice de búsqueda desincronizado ({e}); se corrige con 'integridad --reconstruir-busqueda'"
+            )
+    return problemas
+
+
+def _estado_archivo(ruta: str) -> tuple[str, Optional[os.stat_result]]:
+    try:
+        return os.path.realpath(ruta), os.stat(ruta)
+    except OSError:
+        return os.path.realpath(ruta), None
+
+
+@perfilado
+def revisar_fotos(
+    borrar: bool = False, gracia_segundos: float = FOTOS_HUERFANAS_GRACIA_SEGUNDOS
+) -> Dict[str, Any]:
+    """Cruza foto_path con la carpeta de fotos.
+
+    Informa los archivos que ningún instrumento usa (y los borra si `borrar`)
+    y los instrumentos cuya foto ya no está en disco. Los stat corren en un
+    pool de hilos: en un disco de red la latencia de cada uno domina.
+    """
+    with conexion() as conn:
+        referencias = conn.execute(
+            "SELECT id, foto_path FROM instrumentos WHERE foto_path IS NOT NULL AND foto_path != '' ORDER BY id"
+        ).fetchall()
+    archivos = [str(a) for a in IMAGES_DIR.iterdir()] if IMAGES_DIR.exists() else []
+
+    with ThreadPoolExecutor(max_workers=MANTENIMIENTO_WORKERS, thread_name_prefix="mantenimiento") as pool:
+        estados_ref = list(pool.map(_estado_archivo, [ruta for _, ruta in referencias]))
+        estados_dir = list(pool.map(_estado_archivo, archivos))
+
+        en_uso = {real for real, _ in estados_ref}
+        faltantes = [
+            {"id": iid, "foto_path": ruta}
+            for (iid, ruta), (_, info) in zip(referencias, estados_ref)
+            if info is None and not foto_en_proceso(ruta)
+        ]
+        limite = datetime.now().timestamp() - gracia_segundos
+        huerfanas = [
+            (ruta, info.st_size)
+            for ruta, (real, info) in zip(archivos, estados_dir)
+            if info is not None and stat.S_ISREG(info.st_mode) and real not in en_uso
+            and info.st_mtime < limite and not foto_en_proceso(ruta)
+        ]
+        # eliminar_foto_si_huerfana vuelve a consultar la base justo antes de
+        # borrar, por si un instrumento empezó a usar el archivo entretanto
+        borradas = sum(pool.map(eliminar_foto_si_huerfana, [ruta for ruta, _ in huerfanas])) if borrar else 0
+
+    return {
+        "archivos": len(archivos),
+        "referencias": len(referencias),
+        "huerfanas": [{"archivo": Path(ruta).name, "bytes": tamano} for ruta, tamano in huerfanas],
+        "bytes_huerfanos": sum(tamano for _, tamano in huerfanas),
+        "borradas": borradas,
+        "faltantes": faltantes,
+    }
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Mantenimiento de instrumentos.db y de la carpeta de fotos.
+
+    python mantenimiento_instrumentos.py analizar          # ANALYZE + PRAGMA optimize
+    python mantenimiento_instrumentos.py vacuum            # libera páginas libres
+    python mantenimiento_instrumentos.py integridad
+    python mantenimiento_instrumentos.py fotos --simular   # sólo informa
+    python mantenimiento_instrumentos.py todo
+
+"fotos" borra los archivos de INSTRUMENTOS_FOTOS que ningún instrumento usa
+(con más de una hora de antigüedad, para no tocar subidas en curso) e informa
+los instrumentos cuya foto ya no está en disco. Con --simular no borra nada.
+
+"vacuum" necesita la base en modo auto_vacuum=INCREMENTAL, que es el de las
+bases nuevas. Una base anterior se convierte una sola vez con
+"vacuum --convertir": reescribe el archivo entero y mientras dura la app no
+puede guardar cambios, así que conviene hacerlo fuera de hora.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+
+def _analizar(datos) -> int:
+    print(f"Estadísticas actualizadas en {datos.analizar_base()} s.")
+    return 0
+
+
+def _vacuum(datos, paginas: int, convertir: bool) -> int:
+    resultado = datos.liberar_paginas(paginas, convertir)
+    if resultado["modo"] is None:
+        print(
+            f"La base tiene {resultado['libres_antes']} páginas libres pero no está en modo "
+            "auto_vacuum=INCREMENTAL. Ejecute 'vacuum --convertir' una vez, fuera de hora."
+        )
+        return 0
+    print(
+        f"Vacuum {resultado['modo']}: páginas libres {resultado['libres_antes']} → "
+        f"{resultado['libres_despues']}, {resultado['bytes_liberados'] / 1e6:.1f} MB liberados."
+    )
+    return 0
+
+
+def _integridad(datos, rapida: bool, reconstruir: bool) -> int:
+    problemas = datos.verificar_integridad(completa=not rapida)
+    for problema in problemas:
+        print(problema)
+    if reconstruir and any(p.startswith("Índice de búsqueda") for p in problemas):
+        datos.reconstruir_indice_busqueda()
+        print("Índice de búsqueda reconstruido.")
+    if not problemas:
+        print("La base está sana.")
+    return 1 if problemas else 0
+
+
+def _fotos(datos, simular: bool) -> int:
+    resultado = datos.revisar_fotos(borrar=not simular)
+    for huerfana in resultado["huerfanas"]:
+        print(f"huérfana  {huerfana['archivo']}  {huerfana['bytes'] / 1e3:.0f} kB")
+    for faltante in resultado["faltantes"]:
+        print(f"falta     instrumento {faltante['id']}: {faltante['foto_path']}")
+    accion = "se borrarían" if simular else f"borradas {resultado['borradas']} de"
+    print(
+        f"{resultado['archivos']} archivos, {resultado['referencias']} instrumentos con foto. "
+        f"Huérfanas: {accion} {len(resultado['huerfanas'])} "
+        f"({resultado['bytes_huerfanos'] / 1e6:.1f} MB). Fotos faltantes: {len(resultado['faltantes'])}."
+    )
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Mantenimiento del inventario de instrumentos")
+    parser.add_argument("--base", help="Ruta de la base (por defecto INSTRUMENTOS_DB o instrumentos.db)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    sub.add_parser("analizar", help="Actualiza las estadísticas del planificador (ANALYZE, PRAGMA optimize)")
+    p_vac = sub.add_parser("vacuum", help="Devuelve al disco las páginas libres de la base")
+    p_vac.add_argument("--paginas", type=int, default=0, help="Máximo de páginas a liberar (0: todas)")
+    p_vac.add_argument("--convertir", action="store_true",
+                       help="Pasa la base a auto_vacuum=INCREMENTAL con un VACUUM completo")
+    p_int = sub.add_parser("integridad", help="integrity_check, claves foráneas e índice de búsqueda")
+    p_int.add_argument("--rapida", action="store_true", help="Usa quick_check en lugar de integrity_check")
+    p_int.add_argument("--reconstruir-busqueda", action="store_true",
+                       help="Reconstruye el índice de búsqueda si está desincronizado")
+    p_fot = sub.add_parser("fotos", help="Borra fotos huérfanas e informa fotos faltantes")
+    p_fot.add_argument("--simular", action="store_true", help="Sólo informa, no borra")
+    p_todo = sub.add_parser("todo", help="integridad, fotos, vacuum y analizar, en ese orden")
+    p_todo.add_argument("--simular", action="store_true", help="No borra fotos")
+
+    args = parser.parse_args()
+    if args.base:
+        # Antes de importar datos_instrumentos, que lee la ruta al cargarse
+        os.environ["INSTRUMENTOS_DB"] = str(Path(args.base).resolve())
+
+    import datos_instrumentos as datos
+
+    datos.init_db()
+    if args.comando == "analizar":
+        return _analizar(datos)
+    if args.comando == "vacuum":
+        return _vacuum(datos, args.paginas, args.convertir)
+    if args.comando == "integridad":
+        return _integridad(datos, args.rapida, args.reconstruir_busqueda)
+    if args.comando == "fotos":
+        return _fotos(datos, args.simular)
+
+    codigo = _integridad(datos, rapida=False, reconstruir=False)
+    if codigo:
+        # Sobre una base dañada no se borra ni se reescribe nada
+        return codigo
+    _fotos(datos, args.simular)
+    _vacuum(datos, 0, convertir=False)
+    return _analizar(datos)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Replicación incremental de instrumentos.db a otra sede o a una máquina de
+reportes, a partir del registro de cambios de la base.
+
+    # En la réplica: hasta dónde llegó
+    python replicacion_instrumentos.py --base replica.db posicion
+    # En el origen: sólo los cambios posteriores
+    python replicacion_instrumentos.py exportar --desde 1234 --salida cambios.jsonl.gz
+    # En la réplica
+    python replicacion_instrumentos.py --base replica.db aplicar cambios.jsonl.gz
+
+Con "-" como archivo se usa la salida o entrada estándar, así se puede
+encadenar por ssh:
+
+    ssh origen python replicacion_instrumentos.py exportar --desde \\
+        "$(python replicacion_instrumentos.py posicion --solo-numero)" \\
+        | python replicacion_instrumentos.py aplicar -
+
+Una réplica nueva es una base vacía (o inexistente): la primera exportación
+desde 0 trae todo. Si el origen ya podó su registro, la réplica se arma
+copiando la base completa y sigue desde ahí. Las fotos se copian aparte.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+
+def _abrir(ruta: str, modo: str):
+    if ruta == "-":
+        return (sys.stdout if "w" in modo else sys.stdin).buffer
+    return open(ruta, modo)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replicación incremental del inventario de instrumentos")
+    parser.add_argument("--base", help="Ruta de la base (por defecto INSTRUMENTOS_DB o instrumentos.db)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_pos = sub.add_parser("posicion", help="Origen y último cambio registrado o aplicado")
+    p_pos.add_argument("--solo-numero", action="store_true", help="Imprime sólo el número de secuencia")
+
+    p_exp = sub.add_parser("exportar", help="Exporta los cambios posteriores a un número de secuencia")
+    p_exp.add_argument("--desde", type=int, default=0)
+    p_exp.add_argument("--salida", default="-")
+
+    p_apl = sub.add_parser("aplicar", help="Aplica una exportación en esta base")
+    p_apl.add_argument("archivo")
+
+    p_pod = sub.add_parser("podar", help="Borra del registro los cambios ya aplicados en todas las réplicas")
+    p_pod.add_argument("--hasta", type=int, required=True)
+
+    args = parser.parse_args()
+    if args.base:
+        # Antes de importar datos_instrumentos, que lee la ruta al cargarse
+        os.environ["INSTRUMENTOS_DB"] = str(Path(args.base).resolve())
+
+    import datos_instrumentos as datos
+
+    datos.init_db()
+    try:
+        if args.comando == "posicion":
+            posicion = datos.posicion_cambios()
+            print(posicion["posicion"] if args.solo_numero else json.dumps(posicion))
+        elif args.comando == "exportar":
+            with _abrir(args.salida, "wb") as salida:
+                encabezado = datos.exportar_cambios(salida, args.desde)
+            print(
+                f"Exportados {encabezado['cambios']} cambios ({encabezado['desde']} → {encabezado['hasta']})",
+                file=sys.stderr,
+            )
+        elif args.comando == "aplicar":
+            with _abrir(args.archivo, "rb") as entrada:
+                resultado = datos.aplicar_cambios(entrada)
+            print(
+                f"Aplicados {resultado['aplicados']} cambios, omitidos {resultado['omitidos']} "
+                f"ya aplicados; posición {resultado['posicion']}",
+                file=sys.stderr,
+            )
+        elif args.comando == "podar":
+            print(f"Cambios borrados del registro: {datos.podar_cambios(args.hasta)}", file=sys.stderr)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
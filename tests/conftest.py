@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def datos(tmp_path, monkeypatch):
+    """datos_instrumentos recién importado sobre una base y carpetas temporales.
+
+    El módulo lee las rutas al cargarse y comparte el pool y las cachés por
+    proceso, así que cada prueba lo importa de nuevo.
+    """
+    monkeypatch.setenv("INSTRUMENTOS_DB", str(tmp_path / "instrumentos.db"))
+    monkeypatch.setenv("INSTRUMENTOS_FOTOS", str(tmp_path / "fotos"))
+    monkeypatch.setenv("INSTRUMENTOS_COPIAS", str(tmp_path / "copias"))
+    monkeypatch.setenv("INSTRUMENTOS_MINIATURAS", str(tmp_path / "miniaturas"))
+    monkeypatch.delitem(sys.modules, "datos_instrumentos", raising=False)
+    modulo = importlib.import_module("datos_instrumentos")
+    yield modulo
+    modulo.obtener_pool().cerrar()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+API JSON de sólo lectura: ETag y 304, paginación con el cursor "siguiente"
+y errores de parámetros.
+"""
+import importlib
+import json
+import sys
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+import pytest
+
+
+@pytest.fixture
+def api(datos, monkeypatch):
+    """URL base de un servidor de la API sobre la base temporal, con cinco instrumentos."""
+    monkeypatch.delitem(sys.modules, "api_instrumentos", raising=False)
+    modulo = importlib.import_module("api_instrumentos")
+    servidor = modulo.crear_servidor("127.0.0.1", 0)
+    for n in range(5):
+        datos.insertar_instrumento(
+            grupo_unidad="Suelos", responsable="R", investigador_grupo="Pérez", instrumento=f"Balanza {n}",
+            numero_inventario=f"INV-{n}", reserva_uso="Con reserva", estado="Operativo", ubicacion="",
+            descripcion="", foto_path="/no/se/publica.webp",
+        )
+    hilo = threading.Thread(target=servidor.serve_forever, args=(0.05,), daemon=True)
+    hilo.start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _get(url: str, **cabeceras) -> tuple[int, dict, dict]:
+    pedido = urllib.request.Request(url, headers=cabeceras)
+    try:
+        with urllib.request.urlopen(pedido, timeout=10) as r:
+            cuerpo = r.read()
+            return r.status, dict(r.headers), json.loads(cuerpo) if cuerpo else None
+    except urllib.error.HTTPError as e:
+        cuerpo = e.read()
+        return e.code, dict(e.headers), json.loads(cuerpo) if cuerpo else None
+
+
+def test_etag_responde_304_hasta_que_cambian_los_datos(api, datos):
+    estado, cabeceras, cuerpo = _get(f"{api}/api/instrumentos")
+    assert estado == 200 and cuerpo["total"] == 5
+    etag = cabeceras["ETag"]
+
+    estado, _, cuerpo = _get(f"{api}/api/instrumentos/1", **{"If-None-Match": f'W/{etag}, "otro"'})
+    assert (estado, cuerpo) == (304, None)
+
+    datos.borrar_instrumento(5)
+    estado, cabeceras, cuerpo = _get(f"{api}/api/instrumentos", **{"If-None-Match": etag})
+    assert estado == 200 and cuerpo["total"] == 4
+    assert cabeceras["ETag"] != etag
+
+
+def test_cursor_siguiente_recorre_todas_las_paginas(api):
+    ids, despues_de = [], None
+    while True:
+        url = f"{api}/api/instrumentos?orden=instrumento&desc=1&tamano=2"
+        if despues_de is not None:
+            url += "&despues_de=" + quote(json.dumps(despues_de))
+        estado, _, cuerpo = _get(url)
+        assert estado == 200
+        ids.extend(fila["id"] for fila in cuerpo["datos"])
+        despues_de = cuerpo["siguiente"]
+        if despues_de is None:
+            break
+    assert ids == [5, 4, 3, 2, 1]
+
+
+def test_no_publica_rutas_de_fotos(api):
+    _, _, lista = _get(f"{api}/api/instrumentos")
+    _, _, uno = _get(f"{api}/api/instrumentos/1")
+    assert "foto_path" not in lista["datos"][0] and "foto_path" not in uno
+
+
+@pytest.mark.parametrize(
+    "ruta, estado",
+    [
+        ("/api/instrumentos?tamano=0", 400),
+        ("/api/instrumentos?orden=foto_path", 400),
+        ("/api/instrumentos?despues_de=basura", 400),
+        ("/api/disponibilidad?desde=2027-01-02&hasta=2027-01-01", 400),
+        ("/api/instrumentos/99", 404),
+        ("/api/reservas/99", 404),
+        ("/api/otra", 404),
+    ],
+)
+def test_errores(api, ruta, estado):
+    codigo, _, cuerpo = _get(api + ruta)
+    assert codigo == estado and cuerpo["error"]
@@ -0,0 +1,622 @@
+# -*- coding: utf-8 -*-
+"""
+Migraciones de una base con el esquema original, expansión de series,
+reglas de solapamiento de reservas y mantenimiento de fotos.
+
+    python -m pytest tests
+"""
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+# Esquema de instrumentos.db antes de las migraciones (fechas como texto en
+# hora local, estado de reserva opcional)
+ESQUEMA_ORIGINAL = """
+CREATE TABLE instrumentos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    grupo_unidad TEXT,
+    responsable TEXT,
+    investigador_grupo TEXT NOT NULL,
+    instrumento TEXT NOT NULL,
+    numero_inventario TEXT,
+    reserva_uso TEXT,
+    estado TEXT,
+    ubicacion TEXT,
+    descripcion TEXT,
+    foto_path TEXT,
+    fecha_registro TEXT
+);
+CREATE TABLE reservas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    instrumento_id INTEGER NOT NULL,
+    usuario TEXT NOT NULL,
+    fecha_inicio TEXT NOT NULL,
+    fecha_fin TEXT NOT NULL,
+    comentario TEXT,
+    estado TEXT,
+    fecha_registro TEXT,
+    FOREIGN KEY(instrumento_id) REFERENCES instrumentos(id)
+);
+"""
+
+
+def _base_original(ruta):
+    conn = sqlite3.connect(ruta)
+    conn.executescript(ESQUEMA_ORIGINAL)
+    conn.executemany(
+        "INSERT INTO instrumentos (grupo_unidad, responsable, investigador_grupo, instrumento,"
+        " numero_inventario, reserva_uso, estado, ubicacion, descripcion, foto_path, fecha_registro)"
+        " VALUES (?, 'R', ?, ?, ?, 'Con reserva', 'Operativo', '', '', NULL, '2024-02-01 10:30:00')",
+        [
+            ("Suelos", "Pérez", "Espectrofotómetro", "INV-1"),
+            ("Química", "Gómez", "Balanza analítica", "INV-2"),
+            ("Química", "Gómez", "Se borra", "INV-3"),
+        ],
+    )
+    conn.execute("DELETE FROM instrumentos WHERE id = 3")
+    conn.executemany(
+        "INSERT INTO reservas (instrumento_id, usuario, fecha_inicio, fecha_fin, comentario, estado, fecha_registro)"
+        " VALUES (?, ?, ?, ?, '', ?, '2024-02-20 08:00:00')",
+        [
+            (1, "ana", "2024-03-01 09:00:00", "2024-03-01 12:00:00", None),
+            (1, "ana", "2024-03-01 22:00:00", "2024-03-02 02:00:00", "Confirmada"),
+            (2, "beto", "2024-03-04 10:00:00", "2024-03-04 11:30:00", "Cancelada"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+# ---------- Migraciones ----------
+def test_migra_base_original(datos):
+    _base_original(datos.DB_PATH)
+    datos.init_db()
+
+    with datos.conexion() as conn:
+        assert datos.version_esquema(conn) == datos.ESQUEMA_VERSION
+        tablas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        assert {
+            "instrumentos", "reservas", "uso_diario", "series_reserva", "reservas_archivo",
+            "cambios", "instrumentos_fts", "reservas_legible",
+        } <= tablas
+        tipos = {r[1]: r[2] for r in conn.execute("PRAGMA table_info(reservas)")}
+        assert tipos["fecha_inicio"] == tipos["fecha_fin"] == "INTEGER"
+        assert "serie_id" in tipos
+
+        # Las fechas de texto se leen como hora local
+        filas = conn.execute("SELECT id, fecha_inicio, fecha_fin, estado FROM reservas ORDER BY id").fetchall()
+        assert filas[0] == (
+            1, datos.a_epoch(datetime(2024, 3, 1, 9)), datos.a_epoch(datetime(2024, 3, 1, 12)), None
+        )
+        assert filas[1][1:3] == (datos.a_epoch(datetime(2024, 3, 1, 22)), datos.a_epoch(datetime(2024, 3, 2, 2)))
+        registro = conn.execute("SELECT fecha_registro FROM instrumentos WHERE id = 1").fetchone()[0]
+        assert registro == datos.a_epoch(datetime(2024, 2, 1, 10, 30))
+
+        # AUTOINCREMENT no reutiliza el id del instrumento borrado
+        assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'instrumentos'").fetchone()[0] == 3
+
+        # Una reserva sin estado cuenta como confirmada; la que cruza la
+        # medianoche se reparte entre los dos días
+        uso = conn.execute(
+            "SELECT dia, instrumento_id, usuario, estado, horas, reservas FROM uso_diario ORDER BY dia, instrumento_id"
+        ).fetchall()
+        assert uso == [
+            ("2024-03-01", 1, "ana", "Confirmada", 5.0, 2),
+            ("2024-03-02", 1, "ana", "Confirmada", 2.0, 1),
+            ("2024-03-04", 2, "beto", "Cancelada", 1.5, 1),
+        ]
+
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        # El registro de cambios arranca con una foto de las filas existentes
+        assert conn.execute("SELECT COUNT(*) FROM cambios WHERE tabla = 'reservas'").fetchone()[0] == 3
+
+    assert datos.cargar_instrumentos(busqueda="espectrofotometro")["id"].tolist() == [1]
+
+
+def test_init_db_es_idempotente(datos):
+    datos.init_db()
+    datos.init_db()
+    with datos.conexion() as conn:
+        assert datos.version_esquema(conn) == datos.ESQUEMA_VERSION
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+
+# ---------- Series ----------
+def test_expandir_serie_semanal(datos):
+    ocurrencias = datos.expandir_serie(
+        datetime(2027, 1, 4, 9), datetime(2027, 1, 4, 12), "semanal", date(2027, 1, 31),
+        intervalo=2, dias_semana=[0, 3], excepciones=[date(2027, 1, 7)],
+    )
+    # Semanas del 4 y del 18 de enero; el jueves 7 es excepción
+    assert [i for i, _ in ocurrencias] == [
+        datetime(2027, 1, 4, 9), datetime(2027, 1, 18, 9), datetime(2027, 1, 21, 9),
+    ]
+    assert all(f - i == datetime(2027, 1, 4, 12) - datetime(2027, 1, 4, 9) for i, f in ocurrencias)
+
+
+def test_expandir_serie_diaria(datos):
+    ocurrencias = datos.expandir_serie(
+        datetime(2027, 1, 1, 8), datetime(2027, 1, 1, 9), "diaria", date(2027, 1, 7), intervalo=3
+    )
+    assert [i.day for i, _ in ocurrencias] == [1, 4, 7]
+
+
+@pytest.mark.parametrize(
+    "argumentos",
+    [
+        dict(frecuencia="mensual"),
+        dict(intervalo=0),
+        dict(hasta=date(2026, 12, 31)),
+        # Dura más que el intervalo: cada ocurrencia pisa la siguiente
+        dict(fecha_fin=datetime(2027, 1, 3, 9)),
+    ],
+)
+def test_expandir_serie_rechaza_reglas_invalidas(datos, argumentos):
+    regla = dict(
+        fecha_inicio=datetime(2027, 1, 1, 8), fecha_fin=datetime(2027, 1, 1, 9),
+        frecuencia="diaria", hasta=date(2027, 1, 10),
+    )
+    regla.update(argumentos)
+    with pytest.raises(ValueError):
+        datos.expandir_serie(**regla)
+
+
+# ---------- Solapamientos ----------
+@pytest.fixture
+def instrumento(datos):
+    datos.init_db()
+    datos.insertar_instrumento(
+        grupo_unidad="Suelos", responsable="R", investigador_grupo="Pérez", instrumento="Balanza",
+        numero_inventario="INV-1", reserva_uso="Con reserva", estado="Operativo", ubicacion="",
+        descripcion="", foto_path=None,
+    )
+    return 1
+
+
+def _reservar(datos, instrumento_id, desde, hasta, estado="Confirmada", permitir_tentativas=True):
+    return datos.insertar_reserva(
+        instrumento_id, "usuario", datetime(2027, 3, 1, desde), datetime(2027, 3, 1, hasta), "",
+        estado=estado, permitir_tentativas=permitir_tentativas,
+    )
+
+
+def test_confirmadas_no_se_solapan(datos, instrumento):
+    assert _reservar(datos, instrumento, 9, 12) == []
+    with pytest.raises(datos.ReservaSolapada):
+        _reservar(datos, instrumento, 11, 13)
+    # Intervalos semiabiertos: terminar a las 12 y empezar a las 12 no choca
+    assert _reservar(datos, instrumento, 12, 13) == []
+
+
+def test_tentativas_se_toleran_salvo_que_se_pida_lo_contrario(datos, instrumento):
+    _reservar(datos, instrumento, 9, 12, estado="Tentativa")
+    solapes = _reservar(datos, instrumento, 10, 11)
+    assert [s["estado"] for s in solapes] == ["Tentativa"]
+    with pytest.raises(datos.ReservaSolapada):
+        _reservar(datos, instrumento, 10, 11, estado="Tentativa", permitir_tentativas=False)
+
+
+def test_canceladas_no_ocupan(datos, instrumento):
+    _reservar(datos, instrumento, 9, 12, estado="Cancelada")
+    assert _reservar(datos, instrumento, 9, 12, permitir_tentativas=False) == []
+
+
+def test_actualizar_reserva_no_choca_consigo_misma(datos, instrumento):
+    _reservar(datos, instrumento, 9, 12)
+    assert datos.actualizar_reserva(
+        1, instrumento, "usuario", datetime(2027, 3, 1, 10), datetime(2027, 3, 1, 13), "", "Confirmada"
+    ) == []
+
+
+def test_serie_que_choca_no_guarda_nada(datos, instrumento):
+    _reservar(datos, instrumento, 9, 12)
+    with pytest.raises(datos.SerieSolapada):
+        datos.insertar_serie_reservas(
+            instrumento, "serie", datetime(2027, 2, 22, 10), datetime(2027, 2, 22, 11), "semanal",
+            date(2027, 3, 15),
+        )
+    with datos.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM series_reserva").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM reservas").fetchone()[0] == 1
+
+
+
+def test_editar_serie_no_desarchiva_ocurrencias(datos, instrumento):
+    regla = dict(
+        instrumento_id=instrumento, usuario="serie", fecha_inicio=datetime(2020, 1, 6, 9),
+        fecha_fin=datetime(2020, 1, 6, 10), frecuencia="semanal", hasta=date(2020, 2, 24),
+    )
+    serie_id, ocurrencias, _ = datos.insertar_serie_reservas(**regla)
+    assert ocurrencias == 8
+    assert datos.archivar_reservas(datetime(2021, 1, 1)) == 8
+
+    # La misma regla extendida dos semanas: sólo se generan los días nuevos
+    regla["hasta"] = date(2020, 3, 9)
+    assert datos.actualizar_serie(serie_id, **regla, comentario="editada")[0] == 2
+    with datos.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM reservas_archivo WHERE serie_id = ?", (serie_id,)).fetchone()[0] == 8
+        vigentes = conn.execute("SELECT fecha_inicio FROM reservas WHERE serie_id = ? ORDER BY 1", (serie_id,)).fetchall()
+    assert [datos.desde_epoch(v[0]) for v in vigentes] == [datetime(2020, 3, 2, 9), datetime(2020, 3, 9, 9)]
+    assert datos.cargar_uso(date(2020, 1, 1), date(2020, 12, 31), "mes")["horas"].sum() == 10
+
+# ---------- Fotos ----------
+def test_optimizar_recomprime_subidas_que_quedaron_sin_recomprimir(datos, instrumento):
+    from PIL import Image
+
+    # Lo que deja _procesar_foto si falla: la subida original con nombre .webp
+    original = datos.IMAGES_DIR / "subida.png"
+    Image.new("RGB", (40, 30), "red").save(original)
+    destino = datos.IMAGES_DIR / f"{datos._hash_archivo(original)[:32]}.webp"
+    original.rename(destino)
+    with datos.conexion() as conn:
+        conn.execute("UPDATE instrumentos SET foto_path = ? WHERE id = ?", (str(destino), instrumento))
+    assert not datos._es_webp(destino)
+
+    assert datos.optimizar_fotos_existentes()["convertidas"] == 1
+    assert datos._es_webp(destino)
+    assert datos.obtener_instrumento_por_id(instrumento)["foto_path"] == str(destino)
+    assert datos.optimizar_fotos_existentes()["convertidas"] == 0
+
+
+def test_foto_reutilizada_no_se_borra_antes_de_guardar_el_instrumento(datos, instrumento):
+    import io
+
+    from PIL import Image
+
+    class Subida(io.BytesIO):
+        name = "foto.png"
+
+    contenido = io.BytesIO()
+    Image.new("RGB", (40, 30), "blue").save(contenido, "PNG")
+    primera = datos.guardar_imagen(Subida(contenido.getvalue()))
+    while datos.foto_en_proceso(primera):
+        time.sleep(0.01)
+    # La misma foto subida de nuevo, para un instrumento que todavía no se
+    # guardó, mientras se borra el único que la usaba
+    assert datos.guardar_imagen(Subida(contenido.getvalue())) == primera
+    assert not datos.eliminar_foto_si_huerfana(primera)
+    assert datos.Path(primera).exists()
+
+
+# ---------- Importación ----------
+def test_vista_previa_de_importacion_no_escribe_ni_invalida_cachés(datos, instrumento):
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "inst": [instrumento, instrumento],
+        "quien": ["ana", "beto"],
+        "desde": ["2027-03-01 09:00", "2027-03-02 09:00"],
+        "hasta": ["2027-03-01 10:00", "2027-03-02 10:00"],
+    })
+    mapeo = {"instrumento_id": "inst", "usuario": "quien", "fecha_inicio": "desde", "fecha_fin": "hasta"}
+    version = datos.version_datos()
+
+    previa = datos.importar_reservas(df, mapeo, simular=True)
+    assert (previa["validas"], previa["insertadas"]) == (2, 0)
+    assert datos.version_datos() == version
+    assert datos.cargar_reservas().empty
+
+    assert datos.importar_reservas(df, mapeo)["insertadas"] == 2
+    assert datos.version_datos() > version
+    assert len(datos.cargar_reservas()) == 2
+
+
+# ---------- Archivo ----------
+def test_contar_archivables_coincide_con_lo_archivado(datos, instrumento):
+    datos.insertar_reserva(instrumento, "a", datetime(2020, 1, 1, 9), datetime(2020, 1, 1, 10), "")
+    datos.insertar_reserva(instrumento, "b", datetime(2020, 1, 2, 9), datetime(2020, 1, 2, 10), "", estado="Cancelada")
+    _reservar(datos, instrumento, 9, 10, estado="Cancelada")
+    _reservar(datos, instrumento, 11, 12)
+    corte = datetime(2021, 1, 1)
+
+    assert datos.contar_archivables(corte, incluir_canceladas=False) == 2
+    assert datos.contar_archivables(corte) == 3
+    with datos.conexion() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM reservas WHERE estado = 'Cancelada' AND fecha_fin >= ?", (0,)
+        ).fetchall()
+    assert "idx_reservas_canceladas" in plan[0][3]
+
+    assert datos.archivar_reservas(corte) == 3
+    assert datos.contar_archivables(corte) == 0
+
+
+def test_miniaturas_en_la_carpeta_configurada(datos, tmp_path):
+    from PIL import Image
+
+    datos.IMAGES_DIR.mkdir(exist_ok=True)
+    foto = datos.IMAGES_DIR / "grande.png"
+    Image.new("RGB", (1200, 900), "green").save(foto)
+    miniatura = datos.obtener_cache_miniaturas().obtener(str(foto))
+    assert datos.Path(miniatura).parent == tmp_path / "miniaturas"
+    with Image.open(miniatura) as im:
+        assert max(im.size) == datos.MINIATURA_LADO
+
+
+# ---------- Copias de seguridad ----------
+def test_copia_verificada_y_restaurada(datos, instrumento):
+    datos.IMAGES_DIR.mkdir(exist_ok=True)
+    (datos.IMAGES_DIR / "a.webp").write_bytes(b"foto a")
+    copia = datos.crear_copia()
+    assert datos.verificar_copia(copia["nombre"]) == []
+
+    datos.borrar_instrumento(instrumento)
+    (datos.IMAGES_DIR / "a.webp").write_bytes(b"foto cambiada")
+    resultado = datos.restaurar_copia(copia["nombre"])
+    assert resultado["fotos_restauradas"] == 1
+    assert (datos.IMAGES_DIR / "a.webp").read_bytes() == b"foto a"
+    assert datos.obtener_instrumento_por_id(instrumento) is not None
+
+    # Una foto del almacén que no coincide con el manifiesto se detecta
+    sha = copia["fotos"]["a.webp"]["sha256"]
+    (datos.BACKUP_DIR / "fotos" / sha).write_bytes(b"foto b")
+    assert datos.verificar_copia(copia["nombre"]) == ["La foto a.webp está dañada."]
+    with pytest.raises(ValueError):
+        datos.restaurar_copia(copia["nombre"])
+
+
+def test_la_copia_previa_a_restaurar_no_rota(datos, instrumento):
+    datos.IMAGES_DIR.mkdir(exist_ok=True)
+    (datos.IMAGES_DIR / "a.webp").write_bytes(b"foto a")
+    copia = datos.crear_copia()
+    previa = datos.restaurar_copia(copia["nombre"])["previa"]
+    assert previa.startswith(datos.BACKUP_PREFIJO_PREVIA)
+
+    # La foto sólo queda en el almacén por la copia previa
+    (datos.IMAGES_DIR / "a.webp").unlink()
+    for _ in range(2):
+        datos.crear_copia(retener=1)
+    nombres = [c["nombre"] for c in datos.listar_copias()]
+    assert previa in nombres and copia["nombre"] not in nombres
+    assert datos.resumen_copias()[0] == 1
+    assert datos.verificar_copia(previa) == []
+
+
+# ---------- Búsqueda ----------
+def _alta(datos, instrumento, **campos):
+    valores = dict(
+        grupo_unidad="Suelos", responsable="R", investigador_grupo="Pérez", instrumento=instrumento,
+        numero_inventario="", reserva_uso="Con reserva", estado="Operativo", ubicacion="",
+        descripcion="", foto_path=None,
+    )
+    valores.update(campos)
+    datos.insertar_instrumento(**valores)
+
+
+@pytest.fixture
+def inventario(datos):
+    datos.init_db()
+    _alta(datos, "Centrífuga", descripcion="Rotor para tubos de pH")
+    _alta(datos, "Medidor de pH", grupo_unidad="Química", investigador_grupo="Gómez")
+    _alta(datos, "Balanza", grupo_unidad="Química", descripcion="Química analítica de suelos")
+    return datos
+
+
+def test_busqueda_ordena_por_relevancia(inventario):
+    # El nombre pesa más que la descripción; sin acentos y por prefijo
+    assert inventario.cargar_instrumentos(busqueda="ph")["id"].tolist() == [2, 1]
+    assert inventario.cargar_instrumentos(busqueda="centrifu")["id"].tolist() == [1]
+    # Todas las palabras tienen que aparecer
+    assert inventario.cargar_instrumentos(busqueda="medidor rotor").empty
+
+
+def test_filtros_buscan_solo_en_su_columna(inventario):
+    assert inventario.cargar_instrumentos(filtro_grupo="suelos")["id"].tolist() == [1]
+    assert sorted(inventario.cargar_instrumentos(filtro_grupo="quim")["id"]) == [2, 3]
+    assert inventario.cargar_instrumentos(filtro_grupo="quim", busqueda="ph")["id"].tolist() == [2]
+    assert inventario.cargar_instrumentos(filtro_investigador="gom", filtro_instrumento="bal").empty
+
+
+@pytest.mark.parametrize("texto", ['ph" OR "rotor', "NEAR(ph rotor)", "ph*", "-ph", "instrumento:ph"])
+def test_busqueda_no_interpreta_operadores(inventario, texto):
+    # Lo que escribe el usuario nunca llega como sintaxis FTS
+    inventario.cargar_instrumentos(busqueda=texto)
+
+
+def test_indice_sigue_a_la_tabla(inventario):
+    fila = inventario.obtener_instrumento_por_id(2)
+    campos = {c: fila[c] for c in inventario.CAMPOS_IMPORTACION_INSTRUMENTOS if c in fila}
+    campos.update(instrumento="Peachímetro", foto_path=None)
+    inventario.actualizar_instrumento(2, **campos)
+    assert inventario.cargar_instrumentos(busqueda="peachimetro")["id"].tolist() == [2]
+    assert inventario.cargar_instrumentos(busqueda="medidor").empty
+
+    inventario.borrar_instrumento(2)
+    assert inventario.cargar_instrumentos(busqueda="peachimetro").empty
+    assert inventario.verificar_integridad() == []
+
+
+# ---------- Paginación ----------
+def _todas_las_paginas(cargar, **argumentos):
+    ids, cursor = [], None
+    while True:
+        pagina, total, cursor = cargar(tamano_pagina=2, despues_de=cursor, **argumentos)
+        ids.extend(pagina["id"].tolist())
+        if cursor is None:
+            return ids, total
+
+
+@pytest.fixture
+def sin_grupo(datos):
+    # Tres instrumentos sin grupo y dos nombres que sólo difieren en mayúsculas
+    datos.init_db()
+    for nombre, grupo in [("b", None), ("a", "Suelos"), ("c", None), ("A", "química"), ("d", "Suelos"), ("e", None)]:
+        _alta(datos, nombre, grupo_unidad=grupo)
+    return datos
+
+
+@pytest.mark.parametrize("descendente", [False, True])
+@pytest.mark.parametrize("orden", ["grupo_unidad", "instrumento", "id"])
+def test_paginas_de_instrumentos_con_claves_nulas(sin_grupo, orden, descendente):
+    # De a dos filas, los cursores no saltean ni repiten filas: NULL, empates
+    # sin distinguir mayúsculas y desempate por id
+    ids, total = _todas_las_paginas(sin_grupo.cargar_instrumentos_pagina, orden=orden, descendente=descendente)
+    una_sola, _, _ = sin_grupo.cargar_instrumentos_pagina(orden=orden, descendente=descendente, tamano_pagina=10)
+    assert total == 6
+    assert ids == una_sola["id"].tolist()
+    assert sorted(ids) == [1, 2, 3, 4, 5, 6]
+
+
+@pytest.mark.parametrize(
+    "orden, descendente, esperado",
+    [
+        ("grupo_unidad", False, [1, 3, 6, 4, 2, 5]),
+        ("grupo_unidad", True, [5, 2, 4, 6, 3, 1]),
+        ("instrumento", False, [2, 4, 1, 3, 5, 6]),
+    ],
+)
+def test_orden_de_instrumentos(sin_grupo, orden, descendente, esperado):
+    ids, _ = _todas_las_paginas(sin_grupo.cargar_instrumentos_pagina, orden=orden, descendente=descendente)
+    assert ids == esperado
+
+
+def test_paginas_de_busqueda_por_relevancia(inventario):
+    ids, total = _todas_las_paginas(
+        inventario.cargar_instrumentos_pagina, busqueda="ph", orden="relevancia", descendente=False
+    )
+    assert (ids, total) == ([2, 1], 2)
+
+
+@pytest.mark.parametrize("descendente", [False, True])
+def test_paginas_de_reservas(datos, instrumento, descendente):
+    for hora in (9, 11, 13, 15, 17):
+        _reservar(datos, instrumento, hora, hora + 1)
+    ids, total = _todas_las_paginas(datos.cargar_reservas_pagina, orden="fecha_inicio", descendente=descendente)
+    assert total == 5
+    assert ids == ([5, 4, 3, 2, 1] if descendente else [1, 2, 3, 4, 5])
+
+
+# ---------- Caché de lecturas ----------
+def test_lecturas_cacheadas_hasta_que_cambian_los_datos(inventario, monkeypatch):
+    abiertas = []
+    conexion = inventario.conexion
+    monkeypatch.setattr(inventario, "conexion", lambda: abiertas.append(1) or conexion())
+
+    assert len(inventario.cargar_instrumentos()) == 3
+    assert len(inventario.cargar_instrumentos()) == 3
+    assert len(abiertas) == 1
+
+    _alta(inventario, "Estufa")
+    assert len(inventario.cargar_instrumentos()) == 4
+
+
+def test_escritura_de_otra_conexion_invalida_la_cache(inventario):
+    assert len(inventario.cargar_instrumentos(busqueda="estufa")) == 0
+    # Como la API u otro proceso: una conexión propia, sin pasar por el módulo
+    otra = sqlite3.connect(inventario.DB_PATH)
+    with otra:
+        otra.execute("INSERT INTO instrumentos (investigador_grupo, instrumento) VALUES ('X', 'Estufa')")
+    otra.close()
+    assert inventario.cargar_instrumentos(busqueda="estufa")["id"].tolist() == [4]
+
+
+def test_la_cache_entrega_copias(inventario):
+    df = inventario.cargar_instrumentos()
+    df.loc[:, "instrumento"] = "cambiado"
+    assert "cambiado" not in inventario.cargar_instrumentos()["instrumento"].tolist()
+
+
+# ---------- Escritor único ----------
+def test_pedidos_concurrentes_van_en_un_solo_commit(datos, instrumento):
+    escritor = datos.obtener_escritor()
+    metricas = escritor.metricas.resumen()
+    en_curso, liberar = threading.Event(), threading.Event()
+
+    def retener():
+        en_curso.set()
+        liberar.wait(10)
+
+    # El primer pedido retiene su lote mientras llegan los demás
+    bloqueo = threading.Thread(target=escritor.ejecutar, args=(retener, (), {}))
+    bloqueo.start()
+    assert en_curso.wait(10)
+
+    resultados = {}
+
+    def reservar(hora):
+        try:
+            resultados[hora] = _reservar(datos, instrumento, 9, hora)
+        except datos.ReservaSolapada as e:
+            resultados[hora] = e
+
+    hilos = [threading.Thread(target=reservar, args=(h,)) for h in (10, 11, 12, 13)]
+    for h in hilos:
+        h.start()
+    while escritor.profundidad() < len(hilos):
+        time.sleep(0.01)
+    liberar.set()
+    for h in hilos + [bloqueo]:
+        h.join()
+
+    # Las cuatro reservas chocan entre sí: entra la primera del lote y las
+    # demás fallan solas, sin deshacer a la que entró
+    assert sum(r == [] for r in resultados.values()) == 1
+    assert sum(isinstance(r, datos.ReservaSolapada) for r in resultados.values()) == 3
+    resumen = escritor.metricas.resumen()
+    assert resumen["pedidos"] - metricas["pedidos"] == 5
+    assert resumen["lotes"] - metricas["lotes"] == 2
+    with datos.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM reservas").fetchone()[0] == 1
+        assert conn.execute("SELECT SUM(reservas) FROM uso_diario").fetchone()[0] == 1
+
+
+def test_pedido_que_falla_se_deshace_solo(datos, instrumento):
+    escritor = datos.obtener_escritor()
+    confirmados = []
+
+    def renombrar_y_fallar():
+        with datos.conexion() as conn:
+            conn.execute("UPDATE instrumentos SET instrumento = 'Tocado' WHERE id = ?", (instrumento,))
+        datos.despues_de_confirmar(lambda: confirmados.append("fallido"))
+        raise RuntimeError("falla a propósito")
+
+    with pytest.raises(RuntimeError):
+        escritor.ejecutar(renombrar_y_fallar, (), {})
+    escritor.ejecutar(datos.despues_de_confirmar, (lambda: confirmados.append("ok"),), {})
+
+    assert confirmados == ["ok"]
+    assert datos.obtener_instrumento_por_id(instrumento)["instrumento"] == "Balanza"
+
+
+# ---------- Autocompletado ----------
+def test_autocompletar_tolera_errores_y_acentos(inventario):
+    assert inventario.autocompletar_instrumentos("centrfuga")[0] == 1
+    assert inventario.autocompletar_instrumentos("medidr de ph")[0] == 2
+    assert inventario.autocompletar_instrumentos("CENTRIFUGA")[0] == 1
+    assert inventario.autocompletar_instrumentos("xyzw") == []
+
+
+def test_autocompletar_sigue_los_cambios(inventario):
+    assert inventario.autocompletar_instrumentos("centrifuga")[0] == 1
+    _alta(inventario, "Espectrofotómetro")
+    assert inventario.autocompletar_instrumentos("espectrofotometro") == [4]
+
+    fila = inventario.obtener_instrumento_por_id(1)
+    campos = {c: fila[c] for c in inventario.CAMPOS_IMPORTACION_INSTRUMENTOS}
+    inventario.actualizar_instrumento(1, **dict(campos, instrumento="Agitador"), foto_path=None)
+    assert 1 not in inventario.autocompletar_instrumentos("centrifuga")
+    assert inventario.autocompletar_instrumentos("agitador") == [1]
+
+    inventario.borrar_instrumento(4)
+    assert inventario.autocompletar_instrumentos("espectrofotometro") == []
+
+    # Escrito por otro proceso: llega por el registro de cambios
+    otra = sqlite3.connect(inventario.DB_PATH)
+    with otra:
+        otra.execute("INSERT INTO instrumentos (investigador_grupo, instrumento) VALUES ('X', 'Mufla')")
+    otra.close()
+    assert inventario.autocompletar_instrumentos("mufla") == [5]
+
+
+def test_autocompletar_despues_de_recompactar(inventario, monkeypatch):
+    monkeypatch.setattr(inventario, "AUTOCOMPLETAR_MAX_DELTA", 2)
+    inventario.autocompletar_instrumentos("balanza")
+    for n in range(6):
+        _alta(inventario, f"Pipeta {n}")
+    inventario.borrar_instrumento(3)
+    assert sorted(inventario.autocompletar_instrumentos("pipeta")) == [4, 5, 6, 7, 8, 9]
+    assert 3 not in inventario.autocompletar_instrumentos("balanza")
+    assert len(inventario.obtener_indice_autocompletar()) == 8
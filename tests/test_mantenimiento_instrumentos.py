@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Mantenimiento: fotos huérfanas y faltantes, páginas libres, integridad del
+índice de búsqueda y la CLI.
+"""
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+
+def _alta(datos, instrumento, foto_path=None):
+    datos.insertar_instrumento(
+        grupo_unidad="Suelos", responsable="R", investigador_grupo="Pérez", instrumento=instrumento,
+        numero_inventario="", reserva_uso="Con reserva", estado="Operativo", ubicacion="",
+        descripcion="", foto_path=foto_path,
+    )
+
+
+def _archivo(datos, nombre, horas_atras=0):
+    ruta = datos.IMAGES_DIR / nombre
+    ruta.write_bytes(b"x" * 100)
+    viejo = time.time() - horas_atras * 3600
+    os.utime(ruta, (viejo, viejo))
+    return ruta
+
+
+@pytest.fixture
+def fotos(datos):
+    datos.init_db()
+    datos.IMAGES_DIR.mkdir(exist_ok=True)
+    _alta(datos, "Con foto", str(_archivo(datos, "usada.webp", horas_atras=5)))
+    _alta(datos, "Foto perdida", str(datos.IMAGES_DIR / "perdida.webp"))
+    _archivo(datos, "huerfana.webp", horas_atras=5)
+    # Una subida reciente que todavía no se guardó con su instrumento
+    _archivo(datos, "reciente.webp")
+    return datos
+
+
+def test_revisar_fotos_sin_borrar(fotos):
+    resultado = fotos.revisar_fotos()
+    assert [h["archivo"] for h in resultado["huerfanas"]] == ["huerfana.webp"]
+    assert resultado["bytes_huerfanos"] == 100 and resultado["borradas"] == 0
+    assert [f["id"] for f in resultado["faltantes"]] == [2]
+    assert (fotos.IMAGES_DIR / "huerfana.webp").exists()
+
+
+def test_revisar_fotos_borra_solo_huerfanas_viejas(fotos):
+    assert fotos.revisar_fotos(borrar=True)["borradas"] == 1
+    assert sorted(p.name for p in fotos.IMAGES_DIR.iterdir()) == ["reciente.webp", "usada.webp"]
+
+
+def test_liberar_paginas(datos):
+    datos.init_db()
+    assert datos.estado_paginas()["auto_vacuum"] == datos.AUTO_VACUUM_INCREMENTAL
+    with datos.conexion() as conn:
+        conn.execute("CREATE TABLE relleno (x BLOB)")
+        conn.executemany("INSERT INTO relleno VALUES (zeroblob(4000))", [()] * 200)
+    with datos.conexion() as conn:
+        conn.execute("DROP TABLE relleno")
+    assert datos.estado_paginas()["libres"] > 100
+
+    resultado = datos.liberar_paginas()
+    assert resultado["modo"] == "incremental"
+    assert resultado["libres_despues"] == 0 and resultado["bytes_liberados"] > 400_000
+
+
+def test_integridad_detecta_indice_desincronizado(datos):
+    datos.init_db()
+    _alta(datos, "Balanza")
+    assert datos.verificar_integridad() == []
+
+    # Otra herramienta edita la tabla sin los triggers del índice
+    conn = sqlite3.connect(datos.DB_PATH)
+    with conn:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'instrumentos_fts_au'").fetchone()[0]
+        conn.execute("DROP TRIGGER instrumentos_fts_au")
+        conn.execute("UPDATE instrumentos SET instrumento = 'Estufa'")
+        conn.execute(sql)
+    conn.close()
+    problemas = datos.verificar_integridad()
+    assert len(problemas) == 1 and problemas[0].startswith("Índice de búsqueda")
+
+    datos.reconstruir_indice_busqueda()
+    assert datos.verificar_integridad() == []
+    assert datos.cargar_instrumentos(busqueda="estufa")["id"].tolist() == [1]
+
+
+def test_cli_todo(fotos, monkeypatch, capsys):
+    import mantenimiento_instrumentos
+
+    monkeypatch.setattr(sys, "argv", ["mantenimiento_instrumentos.py", "todo", "--simular"])
+    assert mantenimiento_instrumentos.main() == 0
+    salida = capsys.readouterr().out
+    assert "La base está sana." in salida
+    assert "huérfana  huerfana.webp" in salida and "falta     instrumento 2" in salida
+    assert (fotos.IMAGES_DIR / "huerfana.webp").exists()
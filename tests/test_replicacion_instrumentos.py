@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Replicación por el registro de cambios: la réplica se arma con la CLI en
+otro proceso, como en una sede remota, y se compara tabla por tabla con el
+origen.
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def replicar(datos, tmp_path):
+    """Corre replicacion_instrumentos.py sobre la réplica tmp_path/replica.db."""
+    entorno = dict(os.environ)
+    entorno.update(
+        INSTRUMENTOS_FOTOS=str(tmp_path / "fotos_replica"),
+        INSTRUMENTOS_COPIAS=str(tmp_path / "copias_replica"),
+        INSTRUMENTOS_MINIATURAS=str(tmp_path / "miniaturas_replica"),
+        # Sin copias programadas en la réplica
+        INSTRUMENTOS_COPIAS_HORAS="0",
+    )
+
+    def correr(*argumentos: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(RAIZ / "replicacion_instrumentos.py"), "--base", str(tmp_path / "replica.db"),
+             *argumentos],
+            env=entorno, capture_output=True, text=True, timeout=120,
+        )
+
+    return correr
+
+
+def _exportar(datos, ruta: Path, desde: int = 0) -> Path:
+    with open(ruta, "wb") as salida:
+        datos.exportar_cambios(salida, desde)
+    return ruta
+
+
+def _contenido(ruta: Path) -> dict:
+    conn = sqlite3.connect(ruta)
+    try:
+        return {
+            tabla: conn.execute(f"SELECT * FROM {tabla} ORDER BY 1, 2, 3").fetchall()
+            for tabla in ["instrumentos", "series_reserva", "reservas", "reservas_archivo", "uso_diario"]
+        }
+    finally:
+        conn.close()
+
+
+def _cargar_origen(datos):
+    datos.init_db()
+    for nombre in ("Balanza", "Estufa", "Centrífuga"):
+        datos.insertar_instrumento(
+            grupo_unidad="Suelos", responsable="R", investigador_grupo="Pérez", instrumento=nombre,
+            numero_inventario="", reserva_uso="Con reserva", estado="Operativo", ubicacion="",
+            descripcion="", foto_path=None,
+        )
+    datos.insertar_reserva(1, "ana", datetime(2020, 5, 4, 9), datetime(2020, 5, 4, 12), "")
+    datos.insertar_serie_reservas(
+        2, "beto", datetime(2027, 1, 4, 9), datetime(2027, 1, 4, 10), "semanal", date(2027, 2, 1)
+    )
+
+
+def test_replica_completa_y_reaplicar_no_repite_nada(datos, replicar, tmp_path):
+    _cargar_origen(datos)
+    exportacion = _exportar(datos, tmp_path / "todo.jsonl.gz")
+
+    primera = replicar("aplicar", str(exportacion))
+    assert primera.returncode == 0, primera.stderr
+    assert _contenido(tmp_path / "replica.db") == _contenido(datos.DB_PATH)
+
+    segunda = replicar("aplicar", str(exportacion))
+    assert segunda.returncode == 0, segunda.stderr
+    assert "Aplicados 0 cambios" in segunda.stderr
+    assert _contenido(tmp_path / "replica.db") == _contenido(datos.DB_PATH)
+
+
+def test_replica_incremental(datos, replicar, tmp_path):
+    _cargar_origen(datos)
+    assert replicar("aplicar", str(_exportar(datos, tmp_path / "1.jsonl.gz"))).returncode == 0
+    posicion = int(replicar("posicion", "--solo-numero").stdout)
+    assert posicion == datos.posicion_cambios()["posicion"]
+
+    # Altas, modificaciones, bajas y filas que pasan al archivo
+    datos.insertar_reserva(3, "caro", datetime(2027, 3, 1, 9), datetime(2027, 3, 1, 10), "", estado="Tentativa")
+    datos.cancelar_serie(1, desde=datetime(2027, 1, 18))
+    datos.archivar_reservas(datetime(2021, 1, 1))
+    datos.borrar_instrumento(3)
+
+    resultado = replicar("aplicar", str(_exportar(datos, tmp_path / "2.jsonl.gz", posicion)))
+    assert resultado.returncode == 0, resultado.stderr
+    replica = _contenido(tmp_path / "replica.db")
+    assert replica == _contenido(datos.DB_PATH)
+    assert len(replica["instrumentos"]) == 2 and len(replica["reservas_archivo"]) == 4
+
+
+def test_replica_rechaza_huecos(datos, replicar, tmp_path):
+    _cargar_origen(datos)
+    desde = datos.posicion_cambios()["posicion"] - 1
+    resultado = replicar("aplicar", str(_exportar(datos, tmp_path / "parcial.jsonl.gz", desde)))
+    assert resultado.returncode == 1
+    assert "Faltan cambios" in resultado.stderr